@@ -0,0 +1,264 @@
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import torch
+
+from torchlight.torchlight.gpu import setup_device
+from utils import synthetic_data
+from utils.common import get_joints_from_mocap_data
+from utils.Quaternions import Quaternions
+from utils.spline import Spline, Spline_AS
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+parser = argparse.ArgumentParser(description='Benchmark the training of T2GNet on synthetic data')
+parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 2, 4, 8], metavar='NP',
+                    help='numbers of local processes to measure the training throughput with (default: 1 2 4 8)')
+parser.add_argument('--batch-size', type=int, default=8, metavar='B',
+                    help='batch size of every process (default: 8)')
+parser.add_argument('--num-steps', type=int, default=5, metavar='NS',
+                    help='number of measured training steps, after one warm-up epoch (default: 5)')
+parser.add_argument('--num-frames', type=int, default=120, metavar='NF',
+                    help='maximum number of frames of the synthetic samples, '
+                         'or number of frames with --quaternions (default: 120)')
+parser.add_argument('--num-threads', type=int, default=0, metavar='NT',
+                    help='number of intra-op threads of every process, 0 to share the cores between the processes, '
+                         'or for the torch default with --throughput (default: 0)')
+parser.add_argument('--num-interop-threads', type=int, default=0, metavar='NIT',
+                    help='number of inter-op threads with --throughput, 0 for the torch default (default: 0)')
+parser.add_argument('--throughput', action='store_true', default=False,
+                    help='only measure the training step and inference throughputs of one process on the cpu')
+parser.add_argument('--dist-port', type=int, default=29510, metavar='DP',
+                    help='port of the first process (default: 29510)')
+parser.add_argument('--data-path', type=str, default=None, metavar='DP',
+                    help='directory of the cached start and end poses (default: a temporary directory)')
+parser.add_argument('--splines', action='store_true', default=False,
+                    help='only measure the interpolation and re-parametrization of long splines')
+parser.add_argument('--quaternions', action='store_true', default=False,
+                    help='only measure the per-frame Quaternions call patterns of the data processing')
+parser.add_argument('--transforms', action='store_true', default=False,
+                    help='only measure the time and memory of the global transforms of a long animation')
+parser.add_argument('--num-points', type=int, default=10000, metavar='NPT',
+                    help='number of points of the splines with --splines, '
+                         'or of frames of the animation with --transforms (default: 10000)')
+args = parser.parse_args()
+
+
+def get_training_throughput(num_processes, rank, data_path):
+    """
+    Samples per second of the training epochs of the processes, each training on batch_size samples per step,
+    so that the work per process stays the same as processes are added.
+    """
+    num_threads = args.num_threads if args.num_threads > 0 else max(1, (os.cpu_count() or 1) // num_processes)
+    torch.set_num_threads(num_threads)
+    num_samples = args.batch_size * num_processes * args.num_steps
+    data_dict, tag_categories = synthetic_data.get_data_dict(num_samples + 1, min_frames=args.num_frames // 2,
+                                                             max_frames=args.num_frames)
+    keys = list(data_dict)
+    processor = synthetic_data.get_processor(
+        synthetic_data.get_args(os.path.join(data_path, 'work_{}'.format(rank)), batch_size=args.batch_size),
+        data_path, {k: data_dict[k] for k in keys[:-1]}, {'000000': data_dict[keys[-1]]}, tag_categories)
+    processor.per_train()
+    if num_processes > 1:
+        torch.distributed.barrier()
+    start_time = time.time()
+    processor.per_train()
+    if num_processes > 1:
+        torch.distributed.barrier()
+    return num_samples / (time.time() - start_time)
+
+
+def get_step_throughputs():
+    """
+    Samples per second of the training steps, i.e. the forward pass, the backward pass and the optimizer step,
+    and of the inference of the rotations, on the cpu, on batches filled beforehand.
+    """
+    device = setup_device(False, args.num_threads, args.num_interop_threads)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dict, tag_categories = synthetic_data.get_data_dict(args.batch_size * args.num_steps + 1,
+                                                                 min_frames=args.num_frames // 2,
+                                                                 max_frames=args.num_frames)
+        keys = list(data_dict)
+        processor = synthetic_data.get_processor(
+            synthetic_data.get_args(os.path.join(temp_dir, 'work'), batch_size=args.batch_size),
+            args.data_path or temp_dir, {k: data_dict[k] for k in keys[:-1]}, {'000000': data_dict[keys[-1]]},
+            tag_categories, device=device)
+    # yield_batch fills the same tensors on every pass, keep copies of them
+    batches = [tuple(t.clone() for t in batch) for batch in itertools.islice(
+        processor.yield_batch(args.batch_size, processor.data_loader['train']), args.num_steps)]
+
+    def train_step(batch):
+        processor.optimizer.zero_grad()
+        processor.forward_pass(*batch).backward()
+        processor.optimizer.step()
+
+    def infer(batch):
+        with torch.inference_mode():
+            processor.predict_rotations(processor.model, batch)
+
+    throughputs = []
+    for step, mode in [(train_step, processor.model.train), (infer, processor.model.eval)]:
+        mode()
+        step(batches[0])
+        start_time = time.time()
+        for batch in batches:
+            step(batch)
+        throughputs.append(args.batch_size * len(batches) / (time.time() - start_time))
+    return throughputs
+
+
+def get_min_time(function, repeat=5):
+    """
+    Seconds of the fastest of repeat calls of the function.
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def get_spline_times():
+    """
+    Seconds of the interpolation and the re-parametrization of a random walk of num_points points with the tracks
+    of MocapDataset.compute_splines, as one Spline and as a Spline_AS of 4 such splines.
+    """
+    rng = np.random.RandomState(0)
+    points = np.cumsum(rng.randn(4, args.num_points, 2) * 0.05, axis=1)
+    angles = np.cumsum(rng.randn(4, args.num_points) * 0.1, axis=1)
+    directions = np.stack((np.sin(angles), np.cos(angles)), axis=-1)
+    amplitudes = rng.rand(4, args.num_points, 1)
+    spline = Spline(points[0], closed=False)
+    spline.add_track('direction', directions[0], interp_mode='circular')
+    spline.add_track('amplitude', amplitudes[0], interp_mode='linear')
+    spline_as = Spline_AS(torch.from_numpy(points), closed=False)
+    spline_as.add_track('direction', torch.from_numpy(directions), interp_mode='circular')
+    spline_as.add_track('amplitude', torch.from_numpy(amplitudes), interp_mode='linear')
+    distances = np.linspace(0., spline.length(), args.num_points)
+    distances_as = torch.from_numpy(np.linspace(0., 1., args.num_points)) * spline_as.length().unsqueeze(-1)
+    return {'Spline.interpolate': get_min_time(lambda: spline.interpolate(distances, 'direction')),
+            'Spline.re_parametrize': get_min_time(lambda: spline.re_parametrize(5, 1.)),
+            'Spline_AS.interpolate, 4 splines': get_min_time(lambda: spline_as.interpolate(distances_as,
+                                                                                          'direction')),
+            'Spline_AS.re_parametrize, 4 splines': get_min_time(lambda: spline_as.re_parametrize(5, 1.))}
+
+
+def get_quaternion_times():
+    """
+    Seconds of the per-frame Quaternions call patterns of the data processing, on num_frames frames of 21 joints:
+    the root trajectory integration of get_joints_from_mocap_data, and the conversion of the rotations to euler
+    angles one joint and frame at a time, as save_as_bvh used to do, against one call for all of them.
+    """
+    rng = np.random.RandomState(0)
+    mocap_data = rng.randn(66, args.num_frames)
+    quats = rng.randn(args.num_frames, 21, 4).astype(np.float32)
+    quats /= np.linalg.norm(quats, axis=-1, keepdims=True)
+
+    def get_eulers_per_joint():
+        return [np.degrees(Quaternions(quats[t, j]).euler(order='xyz'))[0]
+                for t in range(args.num_frames) for j in range(quats.shape[1])]
+
+    return {'root integration of get_joints_from_mocap_data': get_min_time(
+                lambda: get_joints_from_mocap_data(mocap_data)),
+            'euler per joint and frame': get_min_time(get_eulers_per_joint),
+            'euler of all the joints and frames': get_min_time(
+                lambda: np.degrees(Quaternions(quats).euler(order='xyz')))}
+
+
+def get_transform_times_and_memory():
+    """
+    Seconds and peak allocated bytes of the global joint positions of an animation of num_points frames
+    of the synthetic skeleton: chaining (F, J, 4, 4) matrices joint by joint, as transforms_global used to,
+    chaining quaternions and translations one hierarchy level at a time, and the matrix view of transforms_global.
+    """
+    # Animation imports its siblings from utils/motion relative to the working directory
+    os.chdir(base_path)
+    from utils.motion import Animation
+
+    rng = np.random.RandomState(0)
+    rotations = rng.randn(args.num_points, len(synthetic_data.joint_parents), 4)
+    rotations /= np.linalg.norm(rotations, axis=-1, keepdims=True)
+    positions = np.tile(synthetic_data.joint_offsets, (args.num_points, 1, 1))
+    positions[:, 0] = rng.randn(args.num_points, 3)
+    anim = Animation.Animation(Quaternions(rotations), positions, Quaternions.id(len(synthetic_data.joint_parents)),
+                               synthetic_data.joint_offsets, synthetic_data.joint_parents)
+
+    def get_positions_of_matrices():
+        locals = Animation.transforms_local(anim)
+        globals = Animation.transforms_blank(anim)
+        globals[:, 0] = locals[:, 0]
+        for i in range(1, anim.shape[1]):
+            globals[:, i] = Animation.transforms_multiply(globals[:, anim.parents[i]], locals[:, i])
+        return globals[:, :, :3, 3] / globals[:, :, 3:, 3]
+
+    results = dict()
+    for name, function in [('positions, matrices', get_positions_of_matrices),
+                           ('positions, quaternions', lambda: Animation.positions_global(anim)),
+                           ('transforms_global matrix view', lambda: Animation.transforms_global(anim))]:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = get_min_time(function), peak
+    return results
+
+
+if __name__ == '__main__':
+    if args.splines:
+        for name, seconds in get_spline_times().items():
+            print('{}, {} points: {:.1f} ms.'.format(name, args.num_points, 1000. * seconds))
+        sys.exit(0)
+
+    if args.quaternions:
+        for name, seconds in get_quaternion_times().items():
+            print('{}, {} frames: {:.2f} ms.'.format(name, args.num_frames, 1000. * seconds))
+        sys.exit(0)
+
+    if args.transforms:
+        for name, (seconds, peak) in get_transform_times_and_memory().items():
+            print('{}, {} frames: {:.1f} ms, {:.1f} MB peak.'.format(name, args.num_points, 1000. * seconds,
+                                                                    peak / 2 ** 20))
+        sys.exit(0)
+
+    if args.throughput:
+        train_throughput, inference_throughput = get_step_throughputs()
+        print('cpu with {} threads: training {:.1f} samples/s, inference {:.1f} samples/s.'.format(
+            torch.get_num_threads(), train_throughput, inference_throughput))
+        sys.exit(0)
+
+    if 'WORLD_SIZE' in os.environ:
+        # one of the processes launched below, the same way main.py launches them
+        world_size = int(os.environ['WORLD_SIZE'])
+        rank = int(os.environ['RANK'])
+        if world_size > 1:
+            torch.distributed.init_process_group(backend='gloo', init_method='env://')
+        throughput = get_training_throughput(world_size, rank, os.environ['BENCHMARK_DATA_PATH'])
+        if rank == 0:
+            print('throughput {}'.format(throughput))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = args.data_path or temp_dir
+        throughputs = dict()
+        for num_processes in args.num_processes:
+            processes = []
+            for rank in range(num_processes):
+                env = dict(os.environ, RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(num_processes),
+                           MASTER_ADDR='127.0.0.1', MASTER_PORT=str(args.dist_port), BENCHMARK_DATA_PATH=data_path)
+                processes.append(subprocess.Popen([sys.executable] + sys.argv, env=env, cwd=base_path,
+                                                  stdout=subprocess.PIPE, text=True))
+            outputs = [process.communicate()[0] for process in processes]
+            if any([process.returncode != 0 for process in processes]):
+                print('{} processes: failed.'.format(num_processes))
+                continue
+            throughputs[num_processes] = float(outputs[0].split('throughput')[-1])
+            # the scaling efficiency is the throughput over that of the fewest processes, scaled to as many processes
+            fewest_processes = min(throughputs)
+            efficiency = throughputs[num_processes] / (throughputs[fewest_processes] * num_processes / fewest_processes)
+            print('{} processes: {:.1f} samples/s, scaling efficiency {:.0f}%.'.format(
+                num_processes, throughputs[num_processes], 100. * efficiency))
@@ -0,0 +1,41 @@
+import argparse
+import datetime
+import os
+
+from utils.artifact_cache import ArtifactCache
+
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+parser = argparse.ArgumentParser(description='List or remove the cached versions of the processed data')
+parser.add_argument('command', type=str, choices=['ls', 'gc'],
+                    help='ls lists the versions of every artifact, gc removes the least recently used ones')
+parser.add_argument('--cache-dir', type=str, default=os.path.join(base_path, '../data/cache'), metavar='CD',
+                    help='directory of the cache (default: ../data/cache)')
+parser.add_argument('--keep', type=int, default=1, metavar='K',
+                    help='number of the most recently used versions of every artifact kept by gc (default: 1)')
+parser.add_argument('--dry-run', action='store_true', default=False,
+                    help='only list the files gc would remove')
+args = parser.parse_args()
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+
+if __name__ == '__main__':
+    cache = ArtifactCache(args.cache_dir)
+    if args.command == 'ls':
+        entries = cache.ls()
+        print('{:<28}{:<14}{:>10}  {:<18}{:<18}'.format('name', 'key', 'size (MB)', 'created', 'last used'))
+        for entry in entries:
+            print('{:<28}{:<14}{:>10.1f}  {:<18}{:<18}'.format(entry['name'], entry['key'][:12],
+                                                                entry.get('size', 0) / 2 ** 20,
+                                                                format_time(entry.get('created', 0)),
+                                                                format_time(entry.get('last_used', 0))))
+        print('{} versions, {:.1f} MB.'.format(len(entries), sum(e.get('size', 0) for e in entries) / 2 ** 20))
+    else:
+        removed = cache.gc(args.keep, args.dry_run)
+        for file_name in removed:
+            print(('Would remove ' if args.dry_run else 'Removed ') + file_name)
+        print('{} files {}.'.format(len(removed), 'to remove' if args.dry_run else 'removed'))
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import time
+
+from utils.evaluation import evaluate_archives
+from utils.mocap_dataset import MocapDataset
+
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+parser = argparse.ArgumentParser(description='Offline evaluation of generated gestures')
+parser.add_argument('--pred', type=str, default=os.path.join(base_path, 'quat_pred.npz'), metavar='P',
+                    help='npz archive of the predicted rotations (default: quat_pred.npz)')
+parser.add_argument('--gt', type=str, default=os.path.join(base_path, 'quat_gt.npz'), metavar='G',
+                    help='npz archive of the ground-truth rotations (default: quat_gt.npz)')
+parser.add_argument('--lengths', type=str, default=os.path.join(base_path, 'gesture_lengths.npz'), metavar='L',
+                    help='npz archive of the valid number of frames of each sequence (default: gesture_lengths.npz)')
+parser.add_argument('--labels', type=str, default=None, metavar='LB',
+                    help='optional npz archive with the emotion labels of the sequences')
+parser.add_argument('--skeleton', type=str, default=None, metavar='S',
+                    help='bvh file to read the skeleton from, needed for the positional metrics')
+parser.add_argument('--chunk-size', type=int, default=8, metavar='CS',
+                    help='number of sequences evaluated together (default: 8)')
+parser.add_argument('--num-workers', type=int, default=None, metavar='W',
+                    help='number of worker processes, 0 to evaluate in this process (default: number of cpus)')
+parser.add_argument('--output', type=str, default='evaluation.json', metavar='O',
+                    help='file to write the json report to (default: evaluation.json)')
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    joint_names, joint_parents, joint_offsets = None, None, None
+    if args.skeleton is not None:
+        joint_names, joint_parents, joint_offsets, _, _, _ = MocapDataset.load_bvh(
+            args.skeleton, {'Xrotation': 'x', 'Yrotation': 'y', 'Zrotation': 'z'})
+
+    start_time = time.time()
+    report = evaluate_archives(args.pred, args.gt, args.lengths, labels_file=args.labels,
+                               parents=joint_parents, offsets=joint_offsets, joint_names=joint_names,
+                               chunk_size=args.chunk_size, num_workers=args.num_workers)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('Evaluated {} sequences, {} frames in {:.2f}s.'.format(report['sequences'], report['frames'],
+                                                                time.time() - start_time))
+    for metric in ['angle_error', 'position_error']:
+        if metric in report.keys():
+            print('{}: {:.6f}'.format(metric, report[metric]['mean']))
+    for metric in ['speed', 'jerk']:
+        if metric in report.keys():
+            print('{}: pred {:.6f}, gt {:.6f}'.format(metric, report[metric]['pred']['mean'],
+                                                      report[metric]['gt']['mean']))
+    print('diversity: pred {:.6f}, gt {:.6f}'.format(report['diversity']['pred'], report['diversity']['gt']))
+    print('Report saved to {}.'.format(args.output))
@@ -1,14 +1,20 @@
-import argparse
 import os
 import random
+import subprocess
+import sys
 import warnings
 
-import matplotlib.pyplot as plt
 import numpy as np
-import torch
 
-from utils import loader, processor as processor
-from utils.visualizations import display_animations
+from utils.arguments import get_parser
+from utils.lazy_import import lazy_import
+
+# the heavy modules are only imported once the arguments are parsed, so that --help returns at once
+plt = lazy_import('matplotlib.pyplot')
+torch = lazy_import('torch')
+gpu = lazy_import('torchlight.torchlight.gpu')
+loader = lazy_import('utils.loader')
+processor = lazy_import('utils.processor')
 
 warnings.filterwarnings('ignore')
 
@@ -20,85 +26,32 @@ model_path = os.path.join(base_path, 'models')
 if not os.path.exists(model_path):
     os.mkdir(model_path)
 
-parser = argparse.ArgumentParser(description='Text to Emotive Gestures Generation')
-parser.add_argument('--dataset', type=str, default='mpi', metavar='D',
-                    help='dataset to train or evaluate method (default: mpi)')
-parser.add_argument('--frame-drop', type=int, default=2, metavar='FD',
-                    help='frame down-sample rate (default: 2)')
-parser.add_argument('--add-mirrored', type=bool, default=False, metavar='AM',
-                    help='perform data augmentation by mirroring all the sequences (default: False)')
-parser.add_argument('--train', type=bool, default=False, metavar='T',
-                    help='train the model (default: True)')
-parser.add_argument('--use-multiple-gpus', type=bool, default=True, metavar='T',
-                    help='use multiple GPUs if available (default: True)')
-parser.add_argument('--load-last-best', type=bool, default=True, metavar='LB',
-                    help='load the most recent best model (default: True)')
-parser.add_argument('--batch-size', type=int, default=8, metavar='B',
-                    help='input batch size for training (default: 32)')
-parser.add_argument('--num-worker', type=int, default=4, metavar='W',
-                    help='number of threads? (default: 4)')
-parser.add_argument('--start-epoch', type=int, default=0, metavar='SE',
-                    help='starting epoch of training (default: 0)')
-parser.add_argument('--num-epoch', type=int, default=5000, metavar='NE',
-                    help='number of epochs to train (default: 1000)')
-# parser.add_argument('--window-length', type=int, default=1, metavar='WL',
-#                     help='max number of past time steps to take as input to transformer decoder (default: 60)')
-parser.add_argument('--optimizer', type=str, default='Adam', metavar='O',
-                    help='optimizer (default: Adam)')
-parser.add_argument('--base-lr', type=float, default=5e-3, metavar='LR',
-                    help='base learning rate (default: 1e-3)')
-parser.add_argument('--base-tr', type=float, default=1., metavar='TR',
-                    help='base teacher rate (default: 1.0)')
-parser.add_argument('--step', type=list, default=0.05 * np.arange(20), metavar='[S]',
-                    help='fraction of steps when learning rate will be decreased (default: [0.5, 0.75, 0.875])')
-parser.add_argument('--lr-decay', type=float, default=0.999, metavar='LRD',
-                    help='learning rate decay (default: 0.999)')
-parser.add_argument('--tf-decay', type=float, default=0.995, metavar='TFD',
-                    help='teacher forcing ratio decay (default: 0.995)')
-parser.add_argument('--gradient-clip', type=float, default=0.5, metavar='GC',
-                    help='gradient clip threshold (default: 0.1)')
-parser.add_argument('--nesterov', action='store_true', default=True,
-                    help='use nesterov')
-parser.add_argument('--momentum', type=float, default=0.9, metavar='M',
-                    help='momentum (default: 0.9)')
-parser.add_argument('--weight-decay', type=float, default=5e-4, metavar='D',
-                    help='Weight decay (default: 5e-4)')
-parser.add_argument('--upper-body-weight', type=float, default=1., metavar='UBW',
-                    help='loss weight on the upper body joint motions (default: 2.05)')
-parser.add_argument('--affs-reg', type=float, default=0.8, metavar='AR',
-                    help='regularization for affective features loss (default: 0.01)')
-parser.add_argument('--quat-norm-reg', type=float, default=0.1, metavar='QNR',
-                    help='regularization for unit norm constraint (default: 0.01)')
-parser.add_argument('--quat-reg', type=float, default=1.2, metavar='QR',
-                    help='regularization for quaternion loss (default: 0.01)')
-parser.add_argument('--recons-reg', type=float, default=1.2, metavar='RCR',
-                    help='regularization for reconstruction loss (default: 1.2)')
-parser.add_argument('--eval-interval', type=int, default=1, metavar='EI',
-                    help='interval after which model is evaluated (default: 1)')
-parser.add_argument('--log-interval', type=int, default=100, metavar='LI',
-                    help='interval after which log is printed (default: 100)')
-parser.add_argument('--save-interval', type=int, default=10, metavar='SI',
-                    help='interval after which model is saved (default: 10)')
-parser.add_argument('--no-cuda', action='store_true', default=False,
-                    help='disables CUDA training')
-parser.add_argument('--pavi-log', action='store_true', default=False,
-                    help='pavi log')
-parser.add_argument('--print-log', action='store_true', default=True,
-                    help='print log')
-parser.add_argument('--save-log', action='store_true', default=True,
-                    help='save log')
-# TO ADD: save_result
-
-args = parser.parse_args()
+args = get_parser().parse_args()
 randomized = False
 
 args.work_dir = os.path.join(model_path, args.dataset)
 if not os.path.exists(args.work_dir):
     os.mkdir(args.work_dir)
 
+# Launch the local processes the same way torchrun does, by re-running this script with the rank
+# and the world size in the environment. Multi-node runs can be started with torchrun directly.
+if args.num_processes > 1 and 'WORLD_SIZE' not in os.environ:
+    processes = []
+    for rank in range(args.num_processes):
+        env = dict(os.environ,
+                   RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(args.num_processes),
+                   MASTER_ADDR='127.0.0.1', MASTER_PORT=str(args.dist_port))
+        processes.append(subprocess.Popen([sys.executable] + sys.argv, env=env))
+    sys.exit(max([process.wait() for process in processes]))
+rank = int(os.environ.get('RANK', 0))
+if int(os.environ.get('WORLD_SIZE', 1)) > 1:
+    if torch.cuda.is_available():
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)) % torch.cuda.device_count())
+    torch.distributed.init_process_group(backend=args.dist_backend, init_method='env://')
+device = gpu.setup_device(not args.no_cuda, args.num_threads, args.num_interop_threads, args.deterministic)
+
 data_dict, tag_categories, text_length, num_frames = loader.load_data(data_path, args.dataset,
-                                                                      frame_drop=args.frame_drop,
-                                                                      add_mirrored=args.add_mirrored)
+                                                                      frame_drop=args.frame_drop)
 data_dict_train, data_dict_eval = loader.split_data_dict(data_dict, randomized=False, fill=6)
 any_dict_key = list(data_dict)[0]
 
@@ -142,9 +95,7 @@ age_dim = 1
 handedness_dim = data_dict[any_dict_key]['Handedness'].shape[-1]
 native_tongue_dim = data_dict[any_dict_key]['Native tongue'].shape[-1]
 
-
-plot_aff = True
-if plot_aff:
+if args.plot_affs and rank == 0:
     os.makedirs('plots', exist_ok=True)
     aff_by_emotion = [[] for _ in range(intended_emotion_dim)]
     affs_dim_to_plot = affs_dim
@@ -184,7 +135,7 @@ pr = processor.Processor(args, data_path, data_loader, text_length, num_frames +
                          intended_emotion_dim, intended_polarity_dim,
                          acting_task_dim, gender_dim, age_dim, handedness_dim, native_tongue_dim,
                          joint_names, joint_parents,
-                         generate_while_train=False, save_path=base_path)
+                         generate_while_train=False, save_path=base_path, device=device)
 
 # idx = 1302
 # display_animations(np.swapaxes(np.reshape(
@@ -217,4 +168,11 @@ joint_offsets = torch.from_numpy(data_loader['test'][index]['joints_dict']['join
 # text_valid_idx = torch.zeros(self.Z)
 # text_valid_idx[:text_length] = 1
 
-pr.generate_motion(samples_to_generate=len(data_loader['test']), randomized=randomized)
+if rank == 0:
+    if args.export_dir is not None:
+        pr.export(args.export_dir)
+    if args.quantize:
+        pr.quantize()
+    if args.benchmark_fan_out:
+        pr.benchmark_fan_out()
+    pr.generate_motion(samples_to_generate=len(data_loader['test']), randomized=randomized)
@@ -6,7 +6,7 @@ from utils import loader, processor_new as processor
 from utils.visualizations import display_animations
 
 import torch
-from torchlight.torchlight import ngpu
+from torchlight.torchlight import ngpu, setup_device
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -22,8 +22,9 @@ if not os.path.exists(model_path):
 parser = argparse.ArgumentParser(description='Text to Emotive Gestures Generation')
 parser.add_argument('--dataset', type=str, default='mpi', metavar='D',
                     help='dataset to train or evaluate method (default: mpi)')
-parser.add_argument('--frame-drop', type=int, default=5, metavar='FD',
-                    help='frame down-sample rate (default: 2)')
+parser.add_argument('--frame-drop', type=float, default=5, metavar='FD',
+                    help='frame down-sample rate, keeping one frame every FD frames of the captures, '
+                         'resampled on the fly from the full rate data (default: 5)')
 parser.add_argument('--add-mirrored', type=bool, default=False, metavar='AM',
                     help='perform data augmentation by mirroring all the sequences (default: False)')
 parser.add_argument('--train', type=bool, default=True, metavar='T',
@@ -76,6 +77,12 @@ parser.add_argument('--log-interval', type=int, default=100, metavar='LI',
                     help='interval after which log is printed (default: 100)')
 parser.add_argument('--save-interval', type=int, default=10, metavar='SI',
                     help='interval after which model is saved (default: 10)')
+parser.add_argument('--num-threads', type=int, default=0, metavar='NT',
+                    help='number of intra-op cpu threads, 0 for the torch default (default: 0)')
+parser.add_argument('--num-interop-threads', type=int, default=0, metavar='NIT',
+                    help='number of inter-op cpu threads, 0 for the torch default (default: 0)')
+parser.add_argument('--deterministic', action='store_true', default=False,
+                    help='use deterministic algorithms only, for reproducible runs')
 parser.add_argument('--no-cuda', action='store_true', default=False,
                     help='disables CUDA training')
 parser.add_argument('--pavi-log', action='store_true', default=False,
@@ -87,7 +94,7 @@ parser.add_argument('--save-log', action='store_true', default=True,
 # TO ADD: save_result
 
 args = parser.parse_args()
-device = 'cuda:0'
+device = setup_device(not args.no_cuda, args.num_threads, args.num_interop_threads, args.deterministic)
 randomized = False
 
 args.work_dir = os.path.join(model_path, args.dataset + '_new')
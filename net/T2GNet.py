@@ -3,12 +3,12 @@ from torch.nn import TransformerDecoder, TransformerDecoderLayer
 from utils.common import *
 from utils.Quaternions_torch import qmul, qeuler, euler_to_quaternion
 
-import cv2
 import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.utils.rnn as rnn
+import torch.utils.checkpoint as checkpoint
 
 torch.manual_seed(1234)
 
@@ -27,8 +27,8 @@ class PositionalEncoding(nn.Module):
         pe = pe.unsqueeze(0).transpose(0, 1)
         self.register_buffer('pe', pe)
 
-    def forward(self, x):
-        x = x + self.pe[:x.size(0), :]
+    def forward(self, x, indices=None):
+        x = x + (self.pe[:x.size(0), :] if indices is None else self.pe[indices])
         return self.dropout(x)
 
 
@@ -45,6 +45,8 @@ class T2GNet(nn.Module):
         self.quat_channels = quat_channels
         self.text_mask = None
         self.quat_mask = None
+        self.encoder_cache = None
+        self.checkpoint_activations = False
         self.text_embedding = nn.Embedding(num_tokens, text_dim)
         self.text_pos_encoder = PositionalEncoding(text_dim, dropout)
         encoder_layers = TransformerEncoderLayer(text_dim, num_heads_enc, num_hidden_units_enc, dropout)
@@ -116,11 +118,59 @@ class T2GNet(nn.Module):
         # self.z_fc5 = nn.Linear(o_z_rs_fc4_size, Z)
         # self.rs_fc5 = nn.Linear(o_z_rs_fc4_size, RS)
 
-    def _generate_square_subsequent_mask(self, sz):
-        mask = (torch.triu(torch.ones(sz, sz)) == 1).transpose(0, 1)
+    def _generate_square_subsequent_mask(self, sz, device=None):
+        mask = (torch.triu(torch.ones(sz, sz, device=device)) == 1).transpose(0, 1)
         mask = mask.float().masked_fill(mask == 0, float('-inf')).masked_fill(mask == 1, float(0.0))
         return mask
 
+    @staticmethod
+    def linear_with_static_inputs(layer, x, static):
+        """
+        Same as layer(torch.cat((x, static repeated over time), dim=-1)), without copying static over time:
+        the static inputs are projected once per sample and broadcast over the time steps.
+        Arguments (where T = number of time steps, B = batch size):
+         -- layer: nn.Linear taking the features of x followed by those of static.
+         -- x: (T, B, D_x) tensor, or (T, 1, D_x) to share it across the batch.
+         -- static: (B, D_s) tensor.
+        """
+        if not isinstance(layer, nn.Linear):
+            # e.g. quantized layers, whose weights cannot be sliced
+            return layer(torch.cat((x.expand(-1, static.shape[0], -1),
+                                    static.unsqueeze(0).expand(x.shape[0], -1, -1)), dim=-1))
+        x_dim = x.shape[-1]
+        return F.linear(x, layer.weight[:, :x_dim]) + \
+            F.linear(static, layer.weight[:, x_dim:], layer.bias).unsqueeze(0)
+
+    def encode_tokens(self, text):
+        """
+        Transformer encoder output of the token ids, before the conditioning.
+        Arguments (where B = batch size, S = text length):
+         -- text: (B, S) tensor of the token ids.
+        Returns the (S, B, text_dim) encoder output.
+        """
+        if self.text_mask is None or self.text_mask.size(0) != text.shape[1]:
+            self.text_mask = self._generate_square_subsequent_mask(text.shape[1], text.device)
+
+        text_embed = self.text_embedding(text) * math.sqrt(self.text_dim)
+        text_pos_enc = self.text_pos_encoder(text_embed)
+        # the masks are causal, passing the hint skips comparing them against a causal mask on the host
+        return self.transformer_encoder(text_pos_enc.permute(1, 0, 2), self.text_mask, is_causal=True)
+
+    def embed_conditioning(self, text_latent, conditioning):
+        return self.linear_with_static_inputs(self.text_embed, text_latent, conditioning)
+
+    def decode(self, tgt, memory):
+        if not (self.checkpoint_activations and self.training and torch.is_grad_enabled()):
+            return self.transformer_decoder(tgt, memory, tgt_mask=self.quat_mask, tgt_is_causal=True)
+        # only the inputs of every layer are kept for the backward pass, the layers are run again to get
+        # their activations, with the same dropout masks
+        for layer in self.transformer_decoder.layers:
+            tgt = checkpoint.checkpoint(layer, tgt, memory, tgt_mask=self.quat_mask, tgt_is_causal=True,
+                                        use_reentrant=False)
+        if self.transformer_decoder.norm is not None:
+            tgt = self.transformer_decoder.norm(tgt)
+        return tgt
+
     def init_weights(self):
         initrange = 0.1
         self.text_embedding.weight.data.uniform_(-initrange, initrange)
@@ -175,42 +225,50 @@ class T2GNet(nn.Module):
 
     def forward(self, text, intended_emotion=None, intended_polarity=None,
                 acting_task=None, gender=None, age=None, handedness=None, native_tongue=None,
-                quat=None, offset_lengths=None, only_encoder=False, only_decoder=False):
+                quat=None, offset_lengths=None, only_encoder=False, only_decoder=False, sample_indices=None):
         if not only_decoder:
-            if self.text_mask is None or self.text_mask.size(0) != text.shape[1]:
-                self.text_mask = self._generate_square_subsequent_mask(text.shape[1]).to(text.device)
-
-            text_embed = self.text_embedding(text) * math.sqrt(self.text_dim)
-            text_pos_enc = self.text_pos_encoder(text_embed)
-            text_latent = self.transformer_encoder(text_pos_enc.permute(1, 0, 2), self.text_mask)
-            time_steps = text_latent.shape[0]
-            mask = self.text_mask.detach().cpu().numpy()
-            mask[mask == -np.inf] = 255
-            text_latent = self.text_embed(torch.cat((
-                text_latent,
-                intended_emotion.unsqueeze(0).repeat(time_steps, 1, 1),
-                intended_polarity.unsqueeze(0).repeat(time_steps, 1, 1),
-                acting_task.unsqueeze(0).repeat(time_steps, 1, 1),
-                gender.unsqueeze(0).repeat(time_steps, 1, 1),
-                age.unsqueeze(0).repeat(time_steps, 1, 1),
-                handedness.unsqueeze(0).repeat(time_steps, 1, 1),
-                native_tongue.unsqueeze(0).repeat(time_steps, 1, 1)), dim=-1))
+            conditioning = torch.cat((intended_emotion, intended_polarity, acting_task,
+                                      gender, age, handedness, native_tongue), dim=-1)
+            if self.encoder_cache is not None and not self.training:
+                text_latent = self.encoder_cache(self, text, conditioning)
+            else:
+                text_latent = self.embed_conditioning(self.encode_tokens(text), conditioning)
             if only_encoder:
                 return text_latent
         else:
             text_latent = text
 
-        offset_lengths = offset_lengths.unsqueeze(0).repeat(text_latent.shape[0], 1, 1)
-        gestures_latent = self.text_offsets_to_gestures(torch.cat((text_latent, offset_lengths), dim=-1))
+        gestures_latent = self.linear_with_static_inputs(self.text_offsets_to_gestures, text_latent, offset_lengths)
         if self.quat_mask is None or self.quat_mask.size(0) != quat.shape[1]:
-            self.quat_mask = self._generate_square_subsequent_mask(quat.shape[1]).to(quat.device)
+            self.quat_mask = self._generate_square_subsequent_mask(quat.shape[1], quat.device)
 
-        quat_pos_enc = self.quat_pos_encoder(quat)
-        quat_pred_pre_norm = self.transformer_decoder(quat_pos_enc.permute(1, 0, 2),
-                                                      gestures_latent, tgt_mask=self.quat_mask).permute(1, 0, 2)
+        quat_pos_enc = self.quat_pos_encoder(quat, sample_indices)
+        quat_pred_pre_norm = self.decode(quat_pos_enc.permute(1, 0, 2), gestures_latent).permute(1, 0, 2)
         if quat_pred_pre_norm.shape[1] == self.T:
             for smoothing_layer in self.temporal_smoothing:
                 quat_pred_pre_norm = smoothing_layer(quat_pred_pre_norm)
         quat_pred = quat_pred_pre_norm.contiguous().view(-1, self.quat_channels)
         quat_pred = F.normalize(quat_pred, dim=1).view(quat_pred_pre_norm.shape)
         return quat_pred, quat_pred_pre_norm
+
+    def fan_out(self, text, intended_emotion, intended_polarity, acting_task, gender, age, handedness,
+                native_tongue, quat, offset_lengths):
+        """
+        Same as forward for one text under N conditionings, e.g. every intended emotion, running the transformer
+        encoder once: only the conditioning projection is computed per conditioning, and all of them are decoded
+        as one batch. Each conditioning gets the outputs of forward on the text alone, in a batch of size one.
+        Arguments (where N = number of conditionings, S = text length):
+         -- text: (1, S) tensor of the token ids.
+         -- intended_emotion, ..., native_tongue: (N, K_i) tensors of the tags of each conditioning.
+         -- quat: (1, T, Q) decoder input, as in forward.
+         -- offset_lengths: (1, J) tensor, as in forward.
+        Returns the (N, T, Q) quat_pred and quat_pred_pre_norm.
+        """
+        conditioning = torch.cat((intended_emotion, intended_polarity, acting_task,
+                                  gender, age, handedness, native_tongue), dim=-1)
+        num_conditionings = conditioning.shape[0]
+        # the (S, 1, text_dim) encoder output is broadcast over the conditionings by the projection
+        text_latent = self.embed_conditioning(self.encode_tokens(text), conditioning)
+        return self(text_latent, quat=quat.expand(num_conditionings, -1, -1),
+                    offset_lengths=offset_lengths.expand(num_conditionings, -1), only_decoder=True,
+                    sample_indices=torch.zeros(num_conditionings, dtype=torch.long, device=quat.device))
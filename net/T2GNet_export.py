@@ -0,0 +1,183 @@
+import copy
+import math
+import os
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from typing import List, Tuple
+
+
+def split_heads(x, num_heads: int):
+    # (B, L, E) -> (B, H, L, E / H)
+    return x.view(x.shape[0], x.shape[1], num_heads, -1).transpose(1, 2)
+
+
+def merge_heads(x):
+    # (B, H, L, E / H) -> (B, L, E)
+    return x.transpose(1, 2).reshape(x.shape[0], x.shape[2], -1)
+
+
+def check_layers(layers):
+    for layer in layers:
+        if layer.norm_first or layer.activation is not F.relu:
+            raise ValueError('Only post-norm transformer layers with relu activations can be exported.')
+        for attention in [layer.self_attn, getattr(layer, 'multihead_attn', layer.self_attn)]:
+            if not attention._qkv_same_embed_dim or attention.in_proj_bias is None or attention.bias_k is not None:
+                raise ValueError('Only attention layers with biased, same-sized projections can be exported.')
+
+
+class T2GNetEncoder(nn.Module):
+    """
+    Text encoder of a T2GNet, returning the cross-attention keys and values of every decoder layer,
+    which stay the same for all the decoding steps.
+    Inputs (where B = batch size, S = text length, L = number of decoder layers, H = number of heads):
+     -- text: (B, S) long tensor of the token indices.
+     -- tags: (B, K) tensor of the concatenated intended emotion, intended polarity, acting task, gender, age,
+        handedness and native tongue, in this order.
+     -- offset_lengths: (B, J) tensor of the joint offset lengths, divided by the longest one.
+    Returns two (L, B, H, S, E / H) tensors, the memory keys and values.
+    """
+
+    def __init__(self, model):
+        super(T2GNetEncoder, self).__init__()
+        check_layers(model.transformer_encoder.layers)
+        check_layers(model.transformer_decoder.layers)
+        self.text_dim = model.text_dim
+        self.text_scale = math.sqrt(model.text_dim)
+        self.intermediate_dim = model.text_embed.out_features
+        self.num_heads_enc = model.transformer_encoder.layers[0].self_attn.num_heads
+        self.num_heads_dec = model.transformer_decoder.layers[0].multihead_attn.num_heads
+        self.text_embedding = model.text_embedding
+        self.register_buffer('text_pe', model.text_pos_encoder.pe[:, 0].clone())
+        self.encoder_layers = model.transformer_encoder.layers
+        self.text_embed = model.text_embed
+        self.text_offsets_to_gestures = model.text_offsets_to_gestures
+        self.decoder_layers = model.transformer_decoder.layers
+
+    def forward(self, text, tags, offset_lengths) -> Tuple[torch.Tensor, torch.Tensor]:
+        text_length = text.shape[1]
+        # T2GNet adds its positional encodings along the first dimension of its batch-first inputs,
+        # so each sample gets one encoding for all its time steps
+        x = self.text_embedding(text) * self.text_scale + self.text_pe[:text.shape[0]].unsqueeze(1)
+        mask = torch.triu(torch.full((text_length, text_length), float('-inf'), dtype=x.dtype, device=x.device),
+                          diagonal=1)
+        for layer in self.encoder_layers:
+            q, k, v = F.linear(x, layer.self_attn.in_proj_weight, layer.self_attn.in_proj_bias).chunk(3, dim=-1)
+            attention = F.scaled_dot_product_attention(split_heads(q, self.num_heads_enc),
+                                                       split_heads(k, self.num_heads_enc),
+                                                       split_heads(v, self.num_heads_enc), attn_mask=mask)
+            x = layer.norm1(x + layer.self_attn.out_proj(merge_heads(attention)))
+            x = layer.norm2(x + layer.linear2(F.relu(layer.linear1(x))))
+
+        # the tags and offsets are the same for all the time steps, see T2GNet.linear_with_static_inputs
+        text_latent = F.linear(x, self.text_embed.weight[:, :self.text_dim]) + \
+            F.linear(tags, self.text_embed.weight[:, self.text_dim:], self.text_embed.bias).unsqueeze(1)
+        gestures_latent = F.linear(text_latent, self.text_offsets_to_gestures.weight[:, :self.intermediate_dim]) + \
+            F.linear(offset_lengths, self.text_offsets_to_gestures.weight[:, self.intermediate_dim:],
+                     self.text_offsets_to_gestures.bias).unsqueeze(1)
+
+        keys: List[torch.Tensor] = []
+        values: List[torch.Tensor] = []
+        embed_dim = gestures_latent.shape[-1]
+        for layer in self.decoder_layers:
+            weight = layer.multihead_attn.in_proj_weight
+            bias = layer.multihead_attn.in_proj_bias
+            keys.append(split_heads(F.linear(gestures_latent, weight[embed_dim:2 * embed_dim],
+                                             bias[embed_dim:2 * embed_dim]), self.num_heads_dec))
+            values.append(split_heads(F.linear(gestures_latent, weight[2 * embed_dim:],
+                                               bias[2 * embed_dim:]), self.num_heads_dec))
+        return torch.stack(keys), torch.stack(values)
+
+
+class T2GNetDecoderStep(nn.Module):
+    """
+    One step of the T2GNet gesture decoder, with an explicit cache of the self-attention keys and values.
+    Inputs (where B = batch size, t = number of previous steps, L = number of decoder layers, H = number of heads):
+     -- quat: (B, 1, J * 4) tensor of the previous frame, the start pose quats_sos at the first step.
+     -- memory_keys, memory_values: outputs of T2GNetEncoder.
+     -- self_keys, self_values: (L, B, H, t, E / H) caches returned by the previous step, empty at the first step.
+    Returns the (B, 1, J * 4) predicted frame, its value before normalization and the caches for the next step.
+    """
+
+    def __init__(self, model, quats_sos):
+        super(T2GNetDecoderStep, self).__init__()
+        self.quat_channels = model.quat_channels
+        self.num_layers = len(model.transformer_decoder.layers)
+        self.num_heads = model.transformer_decoder.layers[0].self_attn.num_heads
+        self.max_frames = model.T
+        self.register_buffer('quat_pe', model.quat_pos_encoder.pe[:, 0].clone())
+        self.register_buffer('quats_sos', quats_sos.reshape(1, 1, -1).clone())
+        self.decoder_layers = model.transformer_decoder.layers
+
+    def forward(self, quat, memory_keys, memory_values, self_keys, self_values) \
+            -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        # one positional encoding per sample, as in T2GNetEncoder
+        x = quat + self.quat_pe[:quat.shape[0]].unsqueeze(1)
+        embed_dim = x.shape[-1]
+        keys: List[torch.Tensor] = []
+        values: List[torch.Tensor] = []
+        for i, layer in enumerate(self.decoder_layers):
+            q, k, v = F.linear(x, layer.self_attn.in_proj_weight, layer.self_attn.in_proj_bias).chunk(3, dim=-1)
+            # the new frame attends to all the previous ones, no causal mask is needed
+            keys.append(torch.cat((self_keys[i], split_heads(k, self.num_heads)), dim=2))
+            values.append(torch.cat((self_values[i], split_heads(v, self.num_heads)), dim=2))
+            attention = F.scaled_dot_product_attention(split_heads(q, self.num_heads), keys[i], values[i])
+            x = layer.norm1(x + layer.self_attn.out_proj(merge_heads(attention)))
+
+            weight = layer.multihead_attn.in_proj_weight
+            bias = layer.multihead_attn.in_proj_bias
+            q = F.linear(x, weight[:embed_dim], bias[:embed_dim])
+            attention = F.scaled_dot_product_attention(split_heads(q, self.num_heads),
+                                                       memory_keys[i], memory_values[i])
+            x = layer.norm2(x + layer.multihead_attn.out_proj(merge_heads(attention)))
+            x = layer.norm3(x + layer.linear2(F.relu(layer.linear1(x))))
+        quat_pred = F.normalize(x.view(x.shape[0], 1, -1, self.quat_channels), dim=-1).view(x.shape)
+        return quat_pred, x, torch.stack(keys), torch.stack(values)
+
+    @torch.jit.export
+    def empty_cache(self, memory_keys) -> torch.Tensor:
+        return memory_keys.new_zeros((self.num_layers, memory_keys.shape[1], self.num_heads, 0,
+                                      memory_keys.shape[-1]))
+
+
+class T2GNetSmoothing(nn.Module):
+    """
+    Temporal smoothing and normalization of a full sequence of decoded frames before normalization,
+    the smoothing being only defined for sequences of the maximum length, as in T2GNet.
+    """
+
+    def __init__(self, model):
+        super(T2GNetSmoothing, self).__init__()
+        self.max_frames = model.T
+        self.quat_channels = model.quat_channels
+        self.temporal_smoothing = model.temporal_smoothing
+
+    def forward(self, quat_pred_pre_norm):
+        if quat_pred_pre_norm.shape[1] == self.max_frames:
+            for smoothing_layer in self.temporal_smoothing:
+                quat_pred_pre_norm = smoothing_layer(quat_pred_pre_norm)
+        quat_pred = quat_pred_pre_norm.contiguous().view(-1, self.quat_channels)
+        return F.normalize(quat_pred, dim=1).view(quat_pred_pre_norm.shape)
+
+
+def export_t2gnet(model, quats_sos, export_dir):
+    """
+    Save the encoder, the decoder step and the smoothing of a T2GNet as TorchScript files, which can be run
+    with torch alone. The model is not modified.
+    Arguments:
+     -- model: T2GNet.
+     -- quats_sos: (J, 4) tensor of the start pose fed to the first decoding step.
+     -- export_dir: directory to save encoder.pt, decoder.pt and smoothing.pt to.
+    Returns the list of saved files.
+    """
+    model = copy.deepcopy(model).cpu().float().eval()
+    modules = {'encoder': T2GNetEncoder(model),
+               'decoder': T2GNetDecoderStep(model, quats_sos.cpu().float()),
+               'smoothing': T2GNetSmoothing(model)}
+    os.makedirs(export_dir, exist_ok=True)
+    file_names = []
+    for name, module in modules.items():
+        file_names.append(os.path.join(export_dir, name + '.pt'))
+        torch.jit.script(module.eval()).save(file_names[-1])
+    return file_names
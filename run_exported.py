@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+start_time = time.time()
+
+import numpy as np
+import torch
+
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+parser = argparse.ArgumentParser(description='Generate gestures from text with a model exported by main.py')
+parser.add_argument('--export-dir', type=str, default=os.path.join(base_path, 'exported'), metavar='ED',
+                    help='directory of the exported model (default: exported)')
+parser.add_argument('--text', type=str, nargs='+', required=True, metavar='TX',
+                    help='texts to generate gestures for, generated together with the same tags')
+parser.add_argument('--emotion', type=str, default=None, metavar='E',
+                    help='intended emotion, one of the exported categories (default: the first one)')
+parser.add_argument('--polarity', type=str, default=None, metavar='P',
+                    help='intended polarity, one of the exported categories (default: the first one)')
+parser.add_argument('--acting-task', type=str, default=None, metavar='AT',
+                    help='acting task, one of the exported categories (default: the first one)')
+parser.add_argument('--gender', type=str, default=None, metavar='G',
+                    help='gender, one of the exported categories (default: the first one)')
+parser.add_argument('--age', type=float, default=30., metavar='A',
+                    help='age in years (default: 30)')
+parser.add_argument('--handedness', type=str, default=None, metavar='H',
+                    help='handedness, one of the exported categories (default: the first one)')
+parser.add_argument('--native-tongue', type=str, default=None, metavar='NT',
+                    help='native tongue, one of the exported categories (default: the first one)')
+parser.add_argument('--num-frames', type=int, default=None, metavar='NF',
+                    help='number of frames to generate (default: the maximum length of the model)')
+parser.add_argument('--skeleton', type=str, default=None, metavar='S',
+                    help='json file of the skeleton to animate (default: the exported skeleton)')
+parser.add_argument('--output', type=str, default='generated.npz', metavar='O',
+                    help='npz archive to save the rotations and positions to (default: generated.npz)')
+parser.add_argument('--benchmark', action='store_true', default=False,
+                    help='report the startup time and memory, and those of importing the training stack')
+args = parser.parse_args()
+
+
+def numericalize(text, vocabulary):
+    # the training texts are numericalized one character at a time by the text processor, see
+    # Processor.fill_batch, and padded with zeros to the text length
+    stoi = {token: i for i, token in enumerate(vocabulary['tokens'])}
+    tokens = [vocabulary['sos']] + [stoi.get(c, vocabulary['unk']) for c in text] + [vocabulary['eos']]
+    tokens = tokens[:vocabulary['text_length']]
+    return tokens + [0] * (vocabulary['text_length'] - len(tokens))
+
+
+def get_tags(vocabulary):
+    tags = []
+    for name, value in [('emotion', args.emotion), ('polarity', args.polarity),
+                        ('acting_task', args.acting_task), ('gender', args.gender), ('age', args.age),
+                        ('handedness', args.handedness), ('native_tongue', args.native_tongue)]:
+        if name == 'age':
+            tags.append([value / 100.])
+            continue
+        categories = vocabulary['tags'][name]
+        if value is not None and value not in categories:
+            raise ValueError('Unknown {} {}, expected one of {}.'.format(name, value, ', '.join(categories)))
+        tags.append(np.eye(len(categories))[0 if value is None else categories.index(value)])
+    return np.concatenate(tags)
+
+
+def qmul(q, r):
+    w1, x1, y1, z1 = np.moveaxis(q, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(r, -1, 0)
+    return np.stack((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2), axis=-1)
+
+
+def qrot(q, v):
+    uv = np.cross(q[..., 1:], v)
+    return v + 2. * (q[..., :1] * uv + np.cross(q[..., 1:], uv))
+
+
+def forward_kinematics(rotations, parents, offsets):
+    # same as MocapDataset.forward_kinematics, with the root at the origin
+    rotations_world = [rotations[..., 0, :]]
+    positions_world = [np.zeros(rotations.shape[:-2] + (3,))]
+    for j in range(1, len(parents)):
+        positions_world.append(qrot(rotations_world[parents[j]], offsets[j]) + positions_world[parents[j]])
+        rotations_world.append(qmul(rotations_world[parents[j]], rotations[..., j, :]))
+    return np.stack(positions_world, axis=-2)
+
+
+def get_peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+if __name__ == '__main__':
+    with open(os.path.join(args.export_dir, 'vocabulary.json')) as f:
+        vocabulary = json.load(f)
+    with open(args.skeleton or os.path.join(args.export_dir, 'skeleton.json')) as f:
+        skeleton = json.load(f)
+    encoder = torch.jit.load(os.path.join(args.export_dir, 'encoder.pt'))
+    decoder = torch.jit.load(os.path.join(args.export_dir, 'decoder.pt'))
+    smoothing = torch.jit.load(os.path.join(args.export_dir, 'smoothing.pt'))
+    startup_time = time.time() - start_time
+
+    num_samples = len(args.text)
+    num_frames = decoder.max_frames if args.num_frames is None else args.num_frames
+    parents = skeleton['joint_parents']
+    offsets = np.array(skeleton['joint_offsets'])
+    offset_lengths = np.linalg.norm(offsets[1:], axis=-1)
+    text = torch.tensor([numericalize(t, vocabulary) for t in args.text])
+    tags = torch.from_numpy(np.tile(get_tags(vocabulary), (num_samples, 1))).float()
+    offset_lengths = torch.from_numpy(np.tile(offset_lengths / np.max(offset_lengths), (num_samples, 1))).float()
+
+    generation_start_time = time.time()
+    with torch.inference_mode():
+        memory_keys, memory_values = encoder(text, tags, offset_lengths)
+        self_keys, self_values = decoder.empty_cache(memory_keys), decoder.empty_cache(memory_keys)
+        quat = decoder.quats_sos.expand(num_samples, -1, -1)
+        quat_pred_pre_norm = []
+        for _ in range(num_frames):
+            quat, quat_pre_norm, self_keys, self_values = decoder(quat, memory_keys, memory_values,
+                                                                  self_keys, self_values)
+            quat_pred_pre_norm.append(quat_pre_norm)
+        quat_pred = smoothing(torch.cat(quat_pred_pre_norm, dim=1)).numpy()
+    positions = forward_kinematics(quat_pred.reshape(num_samples, num_frames, -1, 4), parents, offsets)
+    generation_time = time.time() - generation_start_time
+
+    # the rotations are stored like quat_pred.npz, so that evaluate.py can read them
+    np.savez_compressed(args.output, quat=quat_pred, positions=positions)
+    print('Generated {} x {} frames in {:.2f}s, saved to {}.'.format(num_samples, num_frames, generation_time,
+                                                                      args.output))
+
+    if args.benchmark:
+        print('Startup: {:.2f}s, peak memory: {:.1f} MB.'.format(startup_time, get_peak_memory_mb()))
+        # importing the training stack alone, without loading any data or model, is a lower bound of its startup
+        full_stack = subprocess.run([sys.executable, '-c',
+                                     'import resource, time\n'
+                                     'start_time = time.time()\n'
+                                     'import utils.processor\n'
+                                     'print(time.time() - start_time, '
+                                     'resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)'],
+                                    cwd=base_path, capture_output=True, text=True)
+        if full_stack.returncode == 0:
+            full_stack_time, full_stack_memory = [float(v) for v in full_stack.stdout.split()[-2:]]
+            print('Importing the training stack: {:.2f}s, peak memory: {:.1f} MB.'.format(full_stack_time,
+                                                                                         full_stack_memory))
+        else:
+            print('Could not import the training stack: {}'.format(full_stack.stderr.strip().splitlines()[-1]))
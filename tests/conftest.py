@@ -0,0 +1,30 @@
+import os
+import pytest
+import sys
+
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, repo_path)
+
+from utils import synthetic_data
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    # the scripts read text_processor.pt and samples_valid.txt from the working directory
+    monkeypatch.chdir(repo_path)
+    return repo_path
+
+
+@pytest.fixture
+def make_processor(tmp_path):
+    """
+    Factory of processors over a few synthetic samples, the last two being the test samples.
+    """
+    def make(num_samples=10, seed=0, **kwargs):
+        data_dict, tag_categories = synthetic_data.get_data_dict(num_samples, seed=seed)
+        keys = list(data_dict)
+        data_dict_train = {k: data_dict[k] for k in keys[:-2]}
+        data_dict_eval = {str(i).zfill(6): data_dict[k] for i, k in enumerate(keys[-2:])}
+        args = synthetic_data.get_args(str(tmp_path / 'work'), **kwargs)
+        return synthetic_data.get_processor(args, str(tmp_path), data_dict_train, data_dict_eval, tag_categories)
+    return make
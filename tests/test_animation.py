@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from utils import synthetic_data
+from utils.motion import Animation
+from utils.Quaternions import Quaternions
+
+
+def get_animation(num_frames=50, seed=0):
+    rng = np.random.RandomState(seed)
+    num_joints = len(synthetic_data.joint_parents)
+    rotations = rng.randn(num_frames, num_joints, 4)
+    rotations /= np.linalg.norm(rotations, axis=-1, keepdims=True)
+    positions = np.tile(synthetic_data.joint_offsets, (num_frames, 1, 1))
+    positions[:, 0] = rng.randn(num_frames, 3) * 10.
+    return Animation.Animation(Quaternions(rotations), positions, Quaternions.id(num_joints),
+                               synthetic_data.joint_offsets.copy(), synthetic_data.joint_parents.copy())
+
+
+def get_transforms_global_of_matrices(anim):
+    # the previous transforms_global, chaining (F, J, 4, 4) matrices in the joint order
+    locals = Animation.transforms_local(anim)
+    globals = Animation.transforms_blank(anim)
+    globals[:, 0] = locals[:, 0]
+    for i in range(1, anim.shape[1]):
+        globals[:, i] = Animation.transforms_multiply(globals[:, anim.parents[i]], locals[:, i])
+    return globals
+
+
+def get_rotations_global_per_joint(anim):
+    # the previous rotations_global, one joint at a time in the joint order
+    globals = Quaternions.id(anim.shape)
+    globals[:, 0] = anim.rotations[:, 0]
+    for i in range(1, anim.shape[1]):
+        globals[:, i] = globals[:, anim.parents[i]] * anim.rotations[:, i]
+    return globals
+
+
+def test_global_quaternions_match_the_matrix_pipeline():
+    anim = get_animation()
+    expected = get_transforms_global_of_matrices(anim)
+    rotations, positions = Animation.transforms_global_quaternions(anim)
+    np.testing.assert_allclose(rotations.transforms(), expected[:, :, :3, :3], rtol=0., atol=1e-12)
+    np.testing.assert_allclose(positions, expected[:, :, :3, 3], rtol=0., atol=1e-10)
+    np.testing.assert_allclose(Animation.transforms_global(anim), expected, rtol=0., atol=1e-10)
+    np.testing.assert_allclose(Animation.positions_global(anim), expected[:, :, :3, 3], rtol=0., atol=1e-10)
+    np.testing.assert_allclose(Animation.rotations_global(anim).qs, get_rotations_global_per_joint(anim).qs,
+                               rtol=0., atol=1e-12)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_global_quaternions_do_not_depend_on_the_joint_order(seed):
+    anim = get_animation()
+    # reorder the joints at random, so that children may come before their parents
+    order = np.random.RandomState(seed).permutation(anim.shape[1])
+    inverse_order = np.argsort(order)
+    parents = np.array([-1 if p == -1 else inverse_order[p] for p in anim.parents[order]])
+    shuffled = Animation.Animation(anim.rotations[:, order], anim.positions[:, order], anim.orients[order],
+                                   anim.offsets[order], parents)
+    rotations, positions = Animation.transforms_global_quaternions(anim)
+    shuffled_rotations, shuffled_positions = Animation.transforms_global_quaternions(shuffled)
+    np.testing.assert_allclose(shuffled_rotations.qs[:, inverse_order], rotations.qs, rtol=0., atol=1e-12)
+    np.testing.assert_allclose(shuffled_positions[:, inverse_order], positions, rtol=0., atol=1e-10)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import torch
+
+from utils.dtw import dtw, warp_splits
+
+
+def in_band(i, j, x_length, y_length, band, width):
+    # the band holds the rows start .. start + width - 1 of the anti-diagonal i + j, see get_band_starts
+    start = int(np.floor((i + j) * (x_length - 1) / max(x_length + y_length - 2, 1))) - band
+    start = max(min(start, x_length - width), 0)
+    return start <= i < start + width
+
+
+def get_dtw_brute_force(x, y, band=None):
+    # O(nm) dynamic time warping over the full cost matrix, with the cells outside the band left infinite
+    n, m = len(x), len(y)
+    costs = np.linalg.norm(x[:, None] - y[None], axis=-1)
+    accumulated = np.full((n, m), np.inf)
+    for i in range(n):
+        for j in range(m):
+            if band is not None and not in_band(i, j, n, m, band, min(2 * band + 1, n)):
+                continue
+            if i == 0 and j == 0:
+                accumulated[i, j] = costs[i, j]
+                continue
+            previous = [accumulated[i - 1, j - 1] if i > 0 and j > 0 else np.inf,
+                        accumulated[i - 1, j] if i > 0 else np.inf,
+                        accumulated[i, j - 1] if j > 0 else np.inf]
+            accumulated[i, j] = costs[i, j] + min(previous)
+    path = [(n - 1, m - 1)]
+    i, j = n - 1, m - 1
+    while (i, j) != (0, 0):
+        previous = [(i - 1, j - 1), (i - 1, j), (i, j - 1)]
+        i, j = min([(a, b) for a, b in previous if a >= 0 and b >= 0], key=lambda cell: accumulated[cell])
+        path.append((i, j))
+    return accumulated[-1, -1], np.array(path[::-1])
+
+
+@pytest.mark.parametrize('band', [None, 0, 3, 8])
+def test_dtw_matches_the_brute_force_alignment(band):
+    rng = np.random.RandomState(0)
+    x_lengths, y_lengths = np.array([30, 17, 30, 25]), np.array([30, 30, 12, 25])
+    x, y = rng.randn(4, 30, 5), rng.randn(4, 30, 5)
+    # the last pair is the first one warped, with a short pause
+    y[3, :25] = x[3, np.minimum(np.maximum(np.arange(25) - 3, 0), 24)]
+    distances, paths = dtw(torch.from_numpy(x), torch.from_numpy(y), torch.from_numpy(x_lengths),
+                           torch.from_numpy(y_lengths), band=band)
+    normalized_distances, no_paths = dtw(torch.from_numpy(x), torch.from_numpy(y), torch.from_numpy(x_lengths),
+                                         torch.from_numpy(y_lengths), band=band, return_path=False, normalize=True)
+    assert no_paths is None
+    for s in range(len(x)):
+        distance, path = get_dtw_brute_force(x[s, :x_lengths[s]], y[s, :y_lengths[s]], band)
+        np.testing.assert_allclose(distances[s].item(), distance, rtol=1e-12)
+        np.testing.assert_array_equal(paths[s], path)
+        np.testing.assert_allclose(normalized_distances[s].item(), distance / len(path), rtol=1e-12)
+    assert distances[3] < distances[0]
+
+
+def test_warp_splits_follows_the_warp_path():
+    # x holds every frame of y twice
+    path = np.array([[0, 0], [1, 0], [2, 1], [3, 1], [4, 2], [5, 2], [6, 3], [7, 3]])
+    np.testing.assert_array_equal(warp_splits(path, [0, 1, 3, 4]), [0, 2, 6, 8])
+    rng = np.random.RandomState(1)
+    y = rng.randn(1, 12, 3)
+    x = torch.from_numpy(np.repeat(y, 2, axis=1))
+    _, paths = dtw(x, torch.from_numpy(y))
+    np.testing.assert_array_equal(warp_splits(paths[0], [0, 6, 12]), [0, 12, 24])
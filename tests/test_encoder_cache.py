@@ -0,0 +1,51 @@
+import torch
+from torch.ao.quantization import quantize_dynamic
+
+from utils.encoder_cache import EncoderCache, hash_state_dict
+
+
+def get_inputs(model, batch_size=8, text_length=12):
+    generator = torch.Generator().manual_seed(0)
+    text = torch.randint(0, model.text_embedding.num_embeddings, (batch_size, text_length), generator=generator)
+    conditioning = torch.rand(batch_size, model.text_embed.in_features - model.text_dim, generator=generator)
+    return text, conditioning
+
+
+def test_cached_encodings_match_the_encoder(make_processor):
+    model = make_processor().model.eval()
+    text, conditioning = get_inputs(model)
+    cache = EncoderCache(2 ** 26)
+    with torch.inference_mode():
+        expected = model.embed_conditioning(model.encode_tokens(text), conditioning)
+        assert torch.equal(cache(model, text, conditioning), expected)
+        # all hits
+        assert torch.equal(cache(model, text, conditioning), expected)
+        # half of the samples hit, the others are computed at the size of the batch
+        other_text = text.clone()
+        other_text[::2] = torch.flip(text[::2], dims=[1])
+        other_expected = model.embed_conditioning(model.encode_tokens(other_text), conditioning)
+        assert torch.equal(cache(model, other_text, conditioning), other_expected)
+        # new tags for all the samples, only text_embed runs
+        other_conditioning = torch.flip(conditioning, dims=[0])
+        assert torch.equal(cache(model, other_text, other_conditioning),
+                           model.embed_conditioning(model.encode_tokens(other_text), other_conditioning))
+        # the same texts in a smaller batch are other entries
+        assert torch.equal(cache(model, text[:4], conditioning[:4]),
+                           model.embed_conditioning(model.encode_tokens(text[:4]), conditioning[:4]))
+    stats = cache.stats()
+    assert stats['latent']['hits'] == 8 + 4
+    assert stats['encoder']['hits'] == 4 + 8
+
+
+def test_the_namespace_identifies_the_weights(make_processor):
+    model = make_processor().model.eval()
+    namespace = hash_state_dict(model)
+    other_model = make_processor().model
+    assert hash_state_dict(other_model) != namespace
+    other_model.load_state_dict(model.state_dict())
+    assert hash_state_dict(other_model) == namespace
+    quantized_model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    assert hash_state_dict(quantized_model) != namespace
+    with torch.no_grad():
+        model.text_embed.bias[0] += 1e-6
+    assert hash_state_dict(model) != namespace
@@ -0,0 +1,106 @@
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+import torch
+
+from utils import synthetic_data
+from utils.evaluation import evaluate_archives
+from utils.mocap_dataset import MocapDataset
+
+
+def test_evaluate_reads_the_skeleton_of_a_bvh_file(repo_dir, tmp_path, monkeypatch):
+    # save_as_bvh writes render/bvh/<dataset> under the working directory
+    monkeypatch.chdir(tmp_path)
+    sample = synthetic_data.get_data_dict(1)[0]['000000']
+    MocapDataset.save_as_bvh(dict(joint_names=synthetic_data.joint_names,
+                                  joint_parents=synthetic_data.joint_parents,
+                                  joint_offsets=torch.from_numpy(synthetic_data.joint_offsets[1:])[None],
+                                  positions=torch.from_numpy(sample['positions'])[None],
+                                  rotations=torch.from_numpy(sample['rotations'])[None]), dataset_name='mpi')
+    subprocess.run([sys.executable, os.path.join(repo_dir, 'evaluate.py'),
+                    '--skeleton', os.path.join('render', 'bvh', 'mpi', '000000', 'root.bvh'),
+                    '--num-workers', '0', '--output', 'evaluation.json'], check=True, stdout=subprocess.DEVNULL)
+    with open('evaluation.json') as f:
+        report = json.load(f)
+    assert report['position_error']['mean'] > 0.
+    assert report['speed']['gt']['mean'] > 0.
+
+
+def save_archives(directory, quat_pred, quat_gt, lengths, labels=None):
+    files = [os.path.join(directory, name) for name in ['quat_pred.npz', 'quat_gt.npz', 'lengths.npz']]
+    np.savez(files[0], quat=quat_pred)
+    np.savez(files[1], quat=quat_gt)
+    np.savez(files[2], lengths=lengths)
+    if labels is not None:
+        files.append(os.path.join(directory, 'labels.npz'))
+        np.savez(files[3], labels=labels)
+    return files
+
+
+def get_values(report):
+    # the numbers of a report in a fixed order
+    if isinstance(report, dict):
+        return [v for k in sorted(report) for v in get_values(report[k])]
+    if isinstance(report, list):
+        return [v for item in report for v in get_values(item)]
+    return [report] if isinstance(report, (int, float)) else []
+
+
+def get_keys(report):
+    return {k: get_keys(v) for k, v in report.items()} if isinstance(report, dict) else None
+
+
+def test_report_does_not_depend_on_the_chunks_and_workers(tmp_path):
+    rng = np.random.RandomState(0)
+    num_joints = len(synthetic_data.joint_parents)
+    quat_gt = rng.randn(7, 20, num_joints * 4).astype(np.float32)
+    quat_pred = quat_gt + rng.randn(*quat_gt.shape).astype(np.float32) * 0.1
+    labels = np.array(['a', 'b', 'a', 'c', 'b', 'a', 'a'])
+    files = save_archives(tmp_path, quat_pred, quat_gt, rng.randint(5, 21, 7), labels)
+    reports = {(chunk_size, num_workers): evaluate_archives(
+        *files, parents=synthetic_data.joint_parents, offsets=synthetic_data.joint_offsets,
+        joint_names=synthetic_data.joint_names, chunk_size=chunk_size, num_workers=num_workers)
+        for chunk_size in [1, 3, 7] for num_workers in [0, 2]}
+    expected = reports[(7, 0)]
+    assert set(expected.keys()) == {'sequences', 'frames', 'angle_error', 'position_error', 'speed', 'jerk',
+                                    'affective_features', 'diversity'}
+    assert sorted(expected['affective_features']) == ['a', 'b', 'c']
+    for (chunk_size, num_workers), report in reports.items():
+        # the chunks are merged in order, so the workers do not change the sums
+        assert report == reports[(chunk_size, 0)]
+        # other chunks only add up the same values in another order
+        assert get_keys(report) == get_keys(expected)
+        np.testing.assert_allclose(get_values(report), get_values(expected), rtol=1e-12, atol=1e-12)
+
+
+def test_errors_of_a_hand_built_case(tmp_path):
+    # a root and one child one unit away along x, the ground truth rotates the root about z
+    parents = np.array([-1, 0])
+    offsets = np.array([[0., 0., 0.], [1., 0., 0.]])
+    angles = np.array([[0.1, 0.4, 1.2, 3.], [0.5, 2., 3., 3.]])
+    lengths = np.array([3, 2])
+    quat_pred = np.zeros((2, 4, 2, 4))
+    quat_pred[..., 0] = 1.
+    quat_gt = quat_pred.copy()
+    quat_gt[:, :, 0, 0] = np.cos(angles / 2.)
+    quat_gt[:, :, 0, 3] = np.sin(angles / 2.)
+    # the error does not depend on the sign of the quaternions
+    quat_gt[1, 1] *= -1.
+    files = save_archives(tmp_path, quat_pred.reshape(2, 4, 8), quat_gt.reshape(2, 4, 8), lengths)
+    report = evaluate_archives(*files, parents=parents, offsets=offsets, chunk_size=1, num_workers=0)
+    valid_angles = np.array([0.1, 0.4, 1.2, 0.5, 2.])
+    assert report['sequences'] == 2
+    assert report['frames'] == 5
+    np.testing.assert_allclose(report['angle_error']['per_joint_mean'], [np.mean(valid_angles), 0.], atol=1e-12)
+    np.testing.assert_allclose(report['angle_error']['per_joint_std'], [np.std(valid_angles), 0.], atol=1e-12)
+    np.testing.assert_allclose(report['angle_error']['mean'], np.mean(valid_angles) / 2., atol=1e-12)
+    # the child moves along the chord of the rotation, the root stays at the origin
+    chords = 2. * np.sin(valid_angles / 2.)
+    np.testing.assert_allclose(report['position_error']['per_joint_mean'], [0., np.mean(chords)], atol=1e-12)
+    np.testing.assert_allclose(report['position_error']['mean'], np.mean(chords) / 2., atol=1e-12)
+    # the predicted child never moves, and the ground-truth one moves between the consecutive valid frames
+    np.testing.assert_allclose(report['speed']['pred']['per_joint_mean'], [0., 0.], atol=1e-12)
+    gt_speeds = 2. * np.sin(np.abs(np.array([0.3, 0.8, 1.5])) / 2.)
+    np.testing.assert_allclose(report['speed']['gt']['per_joint_mean'], [0., np.mean(gt_speeds)], atol=1e-12)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import timeit
+import torch
+
+from utils import synthetic_data
+from utils.mocap_dataset import MocapDataset
+
+
+def build_speed_and_phase_track_per_sample(positions_world):
+    # the previous implementation of MocapDataset.build_speed_and_phase_track, for one sequence
+    lf = 4
+    rf = 8
+    l_speed = np.linalg.norm(np.diff(positions_world[:, lf], axis=0), axis=1)
+    r_speed = np.linalg.norm(np.diff(positions_world[:, rf], axis=0), axis=1)
+    root_speed = np.linalg.norm(np.diff(positions_world[:, 0], axis=0), axis=1)
+    displacements = np.cumsum(root_speed)
+    left_contact = l_speed[0] < r_speed[0]
+    epsilon = 0.1
+    cooldown = 3
+    accumulator = np.pi if left_contact else 0
+    phase_points = [(0, accumulator)]
+    disp_points = [(0, displacements[0])]
+    i = cooldown
+    while i < len(l_speed):
+        if left_contact and l_speed[i] > r_speed[i] + epsilon:
+            left_contact = False
+            accumulator += np.pi
+            phase_points.append((i, accumulator))
+            disp_points.append((i, displacements[i] - displacements[disp_points[-1][0]]))
+            i += cooldown
+        elif not left_contact and r_speed[i] > l_speed[i] + epsilon:
+            left_contact = True
+            accumulator += np.pi
+            phase_points.append((i, accumulator))
+            disp_points.append((i, displacements[i] - displacements[disp_points[-1][0]]))
+            i += cooldown
+        else:
+            i += 1
+
+    phase = np.zeros(l_speed.shape[0])
+    end_idx = 0
+    for i in range(len(phase_points) - 1):
+        start_idx = phase_points[i][0]
+        end_idx = phase_points[i + 1][0]
+        phase[start_idx:end_idx] = np.linspace(phase_points[i][1], phase_points[i + 1][1], end_idx - start_idx,
+                                               endpoint=False)
+    phase[end_idx:] = phase_points[-1][1]
+    last_point = (phase[-1] - phase[-2]) + phase[-1]
+    phase = np.concatenate((phase, [last_point]))
+    root_speed = np.concatenate(([0], root_speed))
+    return root_speed, phase, len(phase_points) - 1
+
+
+def get_recorded_positions(num_frames):
+    # the recorded rotations of quat_gt.npz on the synthetic skeleton, moving along a random root trajectory
+    rotations = torch.from_numpy(np.load('quat_gt.npz')['quat'][:, :num_frames]).double()
+    rotations = rotations.view(rotations.shape[0], num_frames, -1, 4)
+    rotations = rotations / torch.norm(rotations, dim=-1, keepdim=True)
+    root_positions = torch.cumsum(torch.from_numpy(np.random.RandomState(0).randn(
+        rotations.shape[0], num_frames, 3)), dim=1)
+    return MocapDataset.forward_kinematics(rotations, root_positions, synthetic_data.joint_parents,
+                                           torch.from_numpy(synthetic_data.joint_offsets)[None]).numpy()
+
+
+@pytest.mark.parametrize('num_frames', [3, 10, 240])
+def test_batched_footsteps_match_the_per_sample_implementation(num_frames):
+    positions = get_recorded_positions(num_frames)
+    root_speed, phase = MocapDataset.build_speed_and_phase_track(positions)
+    num_steps = 0
+    for s in range(len(positions)):
+        root_speed_sample, phase_sample, num_steps_sample = build_speed_and_phase_track_per_sample(positions[s])
+        np.testing.assert_array_equal(root_speed[s], root_speed_sample)
+        np.testing.assert_allclose(phase[s], phase_sample, rtol=0., atol=1e-12)
+        # a single sequence gives the same results as in a batch
+        single_root_speed, single_phase = MocapDataset.build_speed_and_phase_track(positions[s])
+        np.testing.assert_array_equal(single_root_speed, root_speed[s])
+        np.testing.assert_array_equal(single_phase, phase[s])
+        num_steps += num_steps_sample
+    if num_frames > 10:
+        assert num_steps > 0
+
+
+def test_footsteps_are_not_slower_than_the_per_sample_implementation():
+    positions = get_recorded_positions(240)
+    for batch in [positions[:1], positions]:
+        def run_batched():
+            MocapDataset.build_speed_and_phase_track(batch[0] if len(batch) == 1 else batch)
+
+        def run_per_sample():
+            for sample in batch:
+                build_speed_and_phase_track_per_sample(sample)
+
+        # best of several runs, with a margin for the noise of the shared test machines
+        batched_time = min(timeit.repeat(run_batched, number=5, repeat=5))
+        per_sample_time = min(timeit.repeat(run_per_sample, number=5, repeat=5))
+        assert batched_time < 3. * per_sample_time, (len(batch), batched_time, per_sample_time)
@@ -0,0 +1,117 @@
+import numpy as np
+import torch
+
+from utils import synthetic_data
+from utils.inverse_kinematics import JacobianInverseKinematics, get_contact_targets, get_foot_contacts
+from utils.mocap_dataset import MocapDataset
+from utils.Quaternions_torch import expmap_to_quaternion, qmul
+
+# the toes and the ankles of the synthetic skeleton
+feet = [18, 22, 17, 21]
+
+
+def get_motion(num_samples=2, num_frames=6, seed=0):
+    rng = np.random.RandomState(seed)
+    rotations = torch.from_numpy(rng.randn(num_samples, num_frames, len(synthetic_data.joint_parents), 4) * 0.1)
+    rotations[..., 0] += 1.
+    rotations = rotations / torch.norm(rotations, dim=-1, keepdim=True)
+    root_positions = torch.from_numpy(rng.randn(num_samples, num_frames, 3))
+    offsets = torch.from_numpy(synthetic_data.joint_offsets).expand(num_samples, 1, -1, -1)
+    return rotations, root_positions, offsets
+
+
+def get_foot_contacts_per_frame(positions, feet, velocity_threshold):
+    contacts = torch.zeros(positions.shape[:2] + (len(feet),), dtype=torch.bool)
+    for s in range(positions.shape[0]):
+        for t in range(positions.shape[1]):
+            for f, foot in enumerate(feet):
+                previous, current = (0, 1) if t == 0 else (t - 1, t)
+                speed = torch.norm(positions[s, current, foot] - positions[s, previous, foot])
+                contacts[s, t, f] = speed < velocity_threshold
+    return contacts
+
+
+def get_contact_targets_per_frame(positions, contacts):
+    targets = torch.zeros_like(positions)
+    for s in range(positions.shape[0]):
+        for f in range(positions.shape[2]):
+            start = 0
+            for t in range(positions.shape[1]):
+                if contacts[s, t, f] and (t == 0 or not contacts[s, t - 1, f]):
+                    start = t
+                targets[s, t, f] = positions[s, start, f]
+    return targets
+
+
+def solve_per_frame(ik, rotations, root_positions, offsets, targets, masks):
+    # damped least squares one frame at a time, with the Jacobians of the forward kinematics by autograd and
+    # the (3M x 3M) normal equations J^T J + damping^2 I of the M movable joints
+    effectors = list(targets.keys())
+    movable = np.nonzero(ik.weights)[0]
+    weights = torch.from_numpy(ik.weights[movable]).repeat_interleave(3)
+    eye = torch.eye(3 * len(movable), dtype=rotations.dtype)
+    rotations = rotations.clone()
+    for s in range(rotations.shape[0]):
+        for t in range(rotations.shape[1]):
+            target = torch.stack([targets[e][s, t] for e in effectors]).reshape(-1)
+            mask = torch.stack([masks[e][s, t] for e in effectors]).to(rotations.dtype).repeat_interleave(3)
+            for _ in range(ik.iterations):
+                def get_effector_positions(update):
+                    # rotating each movable joint by the (1, update / 2) quaternion has the derivative at 0 of
+                    # rotating it by the exponential map of the update
+                    frame = rotations[s, t].clone()
+                    frame[movable] = qmul(frame[movable].contiguous(), torch.cat(
+                        (torch.ones_like(update.view(-1, 3)[:, :1]), 0.5 * update.view(-1, 3)), dim=-1))
+                    return MocapDataset.forward_kinematics(frame[None, None], root_positions[s:s + 1, t:t + 1],
+                                                           ik.parents, offsets[s:s + 1])[0, 0, effectors].reshape(-1)
+
+                update = torch.zeros(3 * len(movable), dtype=rotations.dtype)
+                jacobian = torch.autograd.functional.jacobian(get_effector_positions, update)
+                jacobian = jacobian * mask.unsqueeze(-1) * weights
+                error = (target - get_effector_positions(update)) * mask
+                update = torch.linalg.solve(jacobian.T @ jacobian + ik.damping ** 2 * eye, jacobian.T @ error)
+                rotations[s, t, movable] = qmul(rotations[s, t, movable].contiguous(),
+                                                expmap_to_quaternion((update * weights).view(-1, 3)))
+    return rotations / torch.norm(rotations, dim=-1, keepdim=True)
+
+
+def test_foot_contacts_and_targets_match_the_per_frame_loops():
+    rotations, root_positions, offsets = get_motion(num_samples=3, num_frames=40)
+    positions = MocapDataset.forward_kinematics(rotations, root_positions, synthetic_data.joint_parents, offsets)
+    # one threshold per sample, as in Processor.clean_up_foot_contacts, at the median speed of its feet
+    speeds = torch.norm(positions[:, 1:, feet] - positions[:, :-1, feet], dim=-1)
+    thresholds = torch.median(speeds.reshape(len(speeds), -1), dim=1).values
+    contacts = get_foot_contacts(positions, feet, thresholds.view(-1, 1, 1))
+    expected_contacts = [get_foot_contacts_per_frame(positions[s:s + 1], feet, thresholds[s])
+                         for s in range(len(positions))]
+    assert torch.equal(contacts, torch.cat(expected_contacts))
+    assert 0 < contacts.sum() < contacts.numel()
+    targets = get_contact_targets(positions[:, :, feet], contacts)
+    expected_targets = get_contact_targets_per_frame(positions[:, :, feet], contacts)
+    assert torch.equal(targets[contacts], expected_targets[contacts])
+
+
+def test_inverse_kinematics_matches_the_per_frame_solver():
+    rotations, root_positions, offsets = get_motion()
+    # reachable targets, the feet of the same motion with slightly different leg rotations
+    rng = np.random.RandomState(1)
+    target_rotations = rotations.clone()
+    target_rotations[:, :, 15:] += torch.from_numpy(rng.randn(*rotations.shape[:2], 8, 4) * 0.02)
+    target_rotations = target_rotations / torch.norm(target_rotations, dim=-1, keepdim=True)
+    positions = MocapDataset.forward_kinematics(target_rotations, root_positions, synthetic_data.joint_parents,
+                                                offsets)
+    targets = {foot: positions[:, :, foot] for foot in feet}
+    masks = {foot: torch.from_numpy(rng.rand(*positions.shape[:2]) < 0.7) for foot in feet}
+    ik = JacobianInverseKinematics(synthetic_data.joint_parents, iterations=3)
+    torch.testing.assert_close(ik(rotations, root_positions, offsets, targets, masks),
+                               solve_per_frame(ik, rotations, root_positions, offsets, targets, masks),
+                               rtol=0., atol=1e-9)
+    # the root orientations are kept and the masked targets are reached
+    solved = JacobianInverseKinematics(synthetic_data.joint_parents)(rotations, root_positions, offsets, targets,
+                                                                     masks)
+    torch.testing.assert_close(solved[:, :, 0], rotations[:, :, 0], rtol=0., atol=1e-12)
+    solved_positions = MocapDataset.forward_kinematics(solved, root_positions, synthetic_data.joint_parents,
+                                                       offsets)
+    for foot in feet:
+        torch.testing.assert_close(solved_positions[:, :, foot][masks[foot]], targets[foot][masks[foot]],
+                                   rtol=0., atol=1e-6)
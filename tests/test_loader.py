@@ -0,0 +1,97 @@
+import numpy as np
+import os
+import pytest
+
+from utils import loader, synthetic_data
+from utils.artifact_cache import ArtifactCache
+from utils.mocap_dataset import MocapDataset
+
+
+def get_full_rate_data_dict(num_samples=4):
+    data_dict, _ = synthetic_data.get_data_dict(num_samples, min_frames=30, max_frames=50, fill=1)
+    return data_dict
+
+
+@pytest.mark.parametrize('frame_drop', [2, 3, 5.])
+def test_integer_frame_drops_match_the_slicing_of_the_captures(frame_drop):
+    for sample in get_full_rate_data_dict().values():
+        # the captures start with the rest pose, which the earlier versions dropped with [1::frame_drop]
+        captured_positions = np.concatenate((np.zeros_like(sample['positions'][:1]), sample['positions']))
+        captured_rotations = np.concatenate((np.zeros_like(sample['rotations'][:1]), sample['rotations']))
+        resampled = loader.resample_sample(sample, frame_drop)
+        positions = captured_positions[1::int(frame_drop)]
+        assert np.array_equal(resampled['positions'], positions)
+        assert np.array_equal(resampled['rotations'], captured_rotations[1::int(frame_drop)])
+        assert np.array_equal(resampled['affective_features'], MocapDataset.get_mpi_affective_features(positions))
+        assert np.shares_memory(resampled['positions'], sample['positions'])
+        assert len(positions) == loader.get_num_resampled_frames(len(sample['positions']), frame_drop)
+
+
+def test_interpolated_frames_match_the_full_rate_frames_at_integer_times():
+    for sample in get_full_rate_data_dict().values():
+        resampled = loader.resample_sample(sample, 1.5)
+        assert len(resampled['positions']) == loader.get_num_resampled_frames(len(sample['positions']), 1.5)
+        # every other frame falls on a full rate frame, at times 0, 3, 6, ...
+        full_rate_frames = np.arange(0, len(sample['positions']), 3)
+        rotations = resampled['rotations'][::2]
+        np.testing.assert_allclose(np.abs(np.sum(rotations * sample['rotations'][full_rate_frames], axis=-1)), 1.,
+                                   rtol=0., atol=1e-10)
+        # the positions are recomputed in float32, as by MocapDataset.load_bvh
+        np.testing.assert_allclose(resampled['positions'][::2], sample['positions'][full_rate_frames],
+                                   rtol=0., atol=1e-4)
+        assert np.array_equal(resampled['affective_features'],
+                              MocapDataset.get_mpi_affective_features(resampled['positions']))
+        # and the roots of the other frames, at times 1.5, 4.5, ..., halfway between their neighbours
+        previous_frames = np.arange(len(resampled['positions'][1::2])) * 3 + 1
+        np.testing.assert_allclose(resampled['positions'][1::2, 0], 0.5 * (sample['positions'][previous_frames, 0] +
+                                                                          sample['positions'][previous_frames + 1, 0]),
+                                   rtol=0., atol=1e-4)
+
+
+@pytest.mark.parametrize('frame_drop', [0.1, 0.5, 0.7, 1.5, 2, 3, 2.7])
+def test_gesture_splits_keep_the_frames_of_every_word(frame_drop):
+    sample = {'positions': np.zeros((100, 1, 3)), 'rotations': np.zeros((100, 1, 4)),
+              'affective_features': np.zeros((100, 1)), 'gesture_splits': [0, 3, 7, 21, 42, 61, 100]}
+    if not float(frame_drop).is_integer():
+        sample = dict(synthetic_data.get_data_dict(1, min_frames=100, max_frames=100)[0]['000000'],
+                      gesture_splits=sample['gesture_splits'])
+    resampled = loader.resample_sample(sample, frame_drop)
+    times = np.arange(loader.get_num_resampled_frames(100, frame_drop)) * frame_drop
+    splits, resampled_splits = sample['gesture_splits'], resampled['gesture_splits']
+    # every resampled frame is in the word of its time at the full rate, the last split being past the last frame
+    for word in range(len(splits) - 1):
+        in_word = (times >= splits[word] - 1e-9) & (times < splits[word + 1] - 1e-9)
+        expected = np.arange(resampled_splits[word], min(resampled_splits[word + 1], len(times)))
+        assert np.array_equal(np.nonzero(in_word)[0], expected)
+
+
+def test_the_split_is_resampled_when_read():
+    data_dict = loader.ResampledDataDict(get_full_rate_data_dict(10), 2)
+    data_dict_train, data_dict_eval = loader.split_data_dict(data_dict, eval_size=0.2, fill=1)
+    assert len(data_dict.resampled) == 0
+    assert isinstance(data_dict_train, loader.ResampledDataDict) and len(data_dict_train.resampled) == 0
+    assert len(data_dict_train) == 8 and len(data_dict_eval) == 2
+    full_rate_samples = [id(sample) for sample in data_dict.data_dict.values()]
+    for split in [data_dict_train, data_dict_eval]:
+        for key, sample in split.items():
+            assert id(split.data_dict[key]) in full_rate_samples
+            assert np.array_equal(sample['positions'], split.data_dict[key]['positions'][::2])
+    assert data_dict_train.max_time_steps <= data_dict.max_time_steps
+
+
+def test_the_legacy_full_rate_data_dict_is_imported_once(tmp_path, capsys):
+    # data_dict_drop_1.npz as saved by the earlier versions, which holds the data at the full frame rate
+    data_dict = get_full_rate_data_dict()
+    os.makedirs(tmp_path / 'mpi')
+    # the older numpy versions saved the lists of categories of different lengths as an object array
+    np.savez_compressed(tmp_path / 'mpi' / 'data_dict_drop_1.npz', data_dict=data_dict,
+                        tag_categories=np.array(synthetic_data.tag_categories, dtype=object), max_text_length=5,
+                        max_time_steps=50)
+    for _ in range(2):
+        resampled, tag_categories, max_text_length, max_time_steps = loader.load_data(str(tmp_path), 'mpi', 2)
+        assert list(resampled) == list(data_dict) and tag_categories == synthetic_data.tag_categories
+        assert max_text_length == 5 and max_time_steps == resampled.max_time_steps
+        for key, sample in resampled.items():
+            assert np.array_equal(sample['positions'], data_dict[key]['positions'][::2])
+    assert capsys.readouterr().out.count('Building data_dict_mpi') == 1
+    assert [entry['name'] for entry in ArtifactCache(str(tmp_path / 'cache')).ls()] == ['data_dict_mpi']
@@ -0,0 +1,40 @@
+import numpy as np
+import torch
+
+from utils.mocap_dataset import MocapDataset
+
+
+def forward_kinematics(processor, joint_offsets, pos, quat):
+    # positions of the rotations of a batch on its skeleton, at its root positions
+    return MocapDataset.forward_kinematics(
+        quat.view(quat.shape[0], quat.shape[1], processor.V, processor.D), pos[:, :, 0], processor.joint_parents,
+        torch.cat((torch.zeros_like(joint_offsets[:, 0:1]), joint_offsets), dim=1).unsqueeze(1))
+
+
+def test_mirrored_positions_match_the_mirrored_rotations(make_processor):
+    processor = make_processor(batch_size=6, mirror_probability=0.5)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    batch = next(processor.yield_batch(6, processor.data_loader['train']))
+    mirrored_batch = processor.mirror_batch(batch)
+    num_valid_frames = torch.sum(batch[5], dim=-1).long()
+    was_mirrored = [not torch.equal(b, m) for b, m in zip(batch[3], mirrored_batch[3])]
+    assert 0 < sum(was_mirrored) < len(was_mirrored)
+    for b in [batch, mirrored_batch]:
+        joint_offsets, pos, affs, quat = b[:4]
+        pos_fk = forward_kinematics(processor, joint_offsets, pos, quat)
+        for s, num_frames in enumerate(num_valid_frames):
+            torch.testing.assert_close(pos_fk[s, :num_frames], pos[s, :num_frames], rtol=0., atol=1e-4)
+            # the affective features of the data are computed in float64, those of the batch in float32
+            torch.testing.assert_close(affs[s, :num_frames],
+                                       MocapDataset.get_mpi_affective_features(pos[s:s + 1, :num_frames])[0],
+                                       rtol=1e-3, atol=1e-4)
+    for s, num_frames in enumerate(num_valid_frames):
+        pos, mirrored_pos = batch[1][s, :num_frames], mirrored_batch[1][s, :num_frames]
+        if was_mirrored[s]:
+            # the rotations of the start and end of sequence poses are kept
+            assert torch.equal(mirrored_batch[3][s, [0, num_frames - 1]], batch[3][s, [0, num_frames - 1]])
+            torch.testing.assert_close(mirrored_pos[1:-1, processor.mirrored_joints],
+                                       pos[1:-1] * pos.new_tensor([-1., 1., 1.]))
+        else:
+            assert torch.equal(mirrored_pos, pos)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from utils import synthetic_data
+from utils.mocap_dataset import MocapDataset
+from utils.Quaternions import Quaternions
+
+
+def get_positions_and_transformations_per_frame(dataset, raw_data, mirrored=False):
+    # the previous implementation of MocapDataset.get_positions_and_transformations, one frame at a time
+    data = np.swapaxes(np.squeeze(raw_data), -1, 0)
+    positions, root_x, root_z, root_r = data[:, :-3], data[:, -3], data[:, -2], data[:, -1]
+    num_frames = len(positions)
+    positions_local = positions.reshape((num_frames, -1, 3))
+    if mirrored:
+        positions_local[:, dataset.joints_left], positions_local[:, dataset.joints_right] = \
+            positions_local[:, dataset.joints_right], positions_local[:, dataset.joints_left]
+        positions_local[:, :, [0, 2]] = -positions_local[:, :, [0, 2]]
+    positions_world = np.zeros_like(positions_local)
+    num_joints = positions_world.shape[1]
+
+    trajectory = np.empty((num_frames, 3))
+    orientations = np.empty(num_frames)
+    rotations = np.zeros((num_frames, num_joints - 1, 4))
+    cum_rotations = np.zeros((num_frames, 4))
+    rotations_euler = np.zeros((num_frames, num_joints - 1, 3))
+    cum_rotations_euler = np.zeros((num_frames, 3))
+    translations = np.zeros((num_frames, num_joints, 3))
+    cum_translations = np.zeros((num_frames, 3))
+    offsets = []
+
+    for t in range(num_frames):
+        positions_world[t, :, :] = (Quaternions(cum_rotations[t - 1]) if t > 0 else Quaternions.id(1)) * \
+                                   positions_local[t]
+        positions_world[t, :, 0] = positions_world[t, :, 0] + (cum_translations[t - 1, 0] if t > 0 else 0)
+        positions_world[t, :, 2] = positions_world[t, :, 2] + (cum_translations[t - 1, 2] if t > 0 else 0)
+        trajectory[t] = positions_world[t, 0]
+        limbs = positions_world[t, 1:] - positions_world[t, dataset.joint_parents[1:]]
+        rotations[t] = Quaternions.between(dataset.joint_offsets[1:], limbs)
+        rotations_euler[t] = Quaternions(rotations[t]).euler('yzx')
+        orientations[t] = -root_r[t]
+        cum_rotations[t] = (Quaternions.from_angle_axis(orientations[t], np.array([0, 1, 0])) *
+                            (Quaternions(cum_rotations[t - 1]) if t > 0 else Quaternions.id(1))).qs
+        cum_rotations_euler[t] = Quaternions(cum_rotations[t]).euler('yzx')
+        offsets.append(Quaternions(cum_rotations[t]) * np.array([0, 0, 1]))
+        translations[t, 0] = Quaternions(cum_rotations[t]) * np.array([root_x[t], 0, root_z[t]])
+        cum_translations[t] = (cum_translations[t - 1] if t > 0 else np.zeros((1, 3))) + translations[t, 0]
+    return positions_local, positions_world, trajectory, orientations, rotations, rotations_euler, \
+        translations, cum_rotations, cum_rotations_euler, cum_translations, np.stack(offsets)
+
+
+def get_edin_dataset():
+    # the default skeleton of MocapDataset, with 21 modelled joints
+    joints_dict = synthetic_data.get_data_dict(1)[0]['000000']['joints_dict']
+    return MocapDataset(21, 3, joints_dict)
+
+
+@pytest.mark.parametrize('mirrored', [False, True])
+def test_positions_and_transformations_match_the_per_frame_implementation(mirrored):
+    dataset = get_edin_dataset()
+    rng = np.random.RandomState(0)
+    raw_data = rng.randn(21 * 3 + 3, 50)
+    raw_data[:-3] *= 5.
+    raw_data[-1] *= 0.05
+    outputs = dataset.get_positions_and_transformations(raw_data.copy(), mirrored=mirrored)
+    expected = get_positions_and_transformations_per_frame(dataset, raw_data.copy(), mirrored=mirrored)
+    names = ['positions_local', 'positions_world', 'trajectory', 'orientations', 'rotations', 'rotations_euler',
+             'translations', 'cum_rotations', 'cum_rotations_euler', 'cum_translations', 'offsets']
+    for name, output, expected_output in zip(names, outputs, expected):
+        np.testing.assert_allclose(np.reshape(output, np.shape(expected_output)), expected_output,
+                                   rtol=0., atol=1e-9, err_msg=name)
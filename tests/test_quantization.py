@@ -0,0 +1,21 @@
+import numpy as np
+import torch
+
+from utils.encoder_cache import hash_state_dict
+
+
+def test_quantize_keeps_the_float_model_on_its_device(make_processor):
+    processor = make_processor(calibration_samples=4, benchmark_batch_sizes=[2], quantize_convs=True)
+    processor.model.eval()
+    weights = hash_state_dict(processor.model)
+    processor.quantize(load_saved_model=False)
+    assert processor.get_model_device(processor.model) == processor.device
+    assert processor.get_model_device(processor.quantized_model) == torch.device('cpu')
+    assert hash_state_dict(processor.model) == weights
+    _, batch = next(processor.yield_eval_batch(2, processor.data_loader['test'], shard=False))
+    with torch.inference_mode():
+        quat_fp32 = processor.predict_rotations(processor.model, batch)
+        quat_int8 = processor.predict_rotations(processor.quantized_model, batch)
+    assert quat_int8.device == quat_fp32.device
+    # the int8 rotations only differ from the float ones by the quantization error
+    assert np.mean(np.abs(quat_int8.numpy() - quat_fp32.numpy())) < 0.05
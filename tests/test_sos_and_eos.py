@@ -0,0 +1,53 @@
+import numpy as np
+import os
+import torch
+
+from utils import synthetic_data
+from utils.mocap_dataset import MocapDataset
+
+
+def test_training_sequences_are_padded_with_the_sos_and_eos_poses(make_processor):
+    processor = make_processor()
+    data_dict, _ = synthetic_data.get_data_dict(10)
+    for key, sample in processor.data_loader['train'].items():
+        positions = data_dict[key]['positions']
+        assert len(sample['positions']) == len(positions) + 2
+        assert len(sample['affective_features']) == len(positions) + 2
+        np.testing.assert_allclose(sample['positions'][1:-1], positions)
+        for token, frame, quats in [('sos', 0, processor.quats_sos), ('eos', -1, processor.quats_eos)]:
+            expected = MocapDataset.forward_kinematics(
+                quats[None], torch.from_numpy(positions[None, frame:frame + 1 or None, 0]),
+                synthetic_data.joint_parents, torch.from_numpy(synthetic_data.joint_offsets)[None])[0, 0].numpy()
+            np.testing.assert_allclose(sample['positions'][frame], expected, atol=1e-10)
+            np.testing.assert_allclose(sample['affective_features'][frame],
+                                       MocapDataset.get_mpi_affective_features(expected[None])[0], atol=1e-10)
+
+
+def test_sos_and_eos_are_computed_again_for_other_data(make_processor, tmp_path):
+    quats_sos = make_processor(seed=0).quats_sos
+    assert torch.equal(make_processor(seed=0).quats_sos, quats_sos)
+    assert len(os.listdir(tmp_path / 'cache' / 'quats_sos_and_eos')) == 2
+    assert not torch.equal(make_processor(seed=1).quats_sos, quats_sos)
+    assert len(os.listdir(tmp_path / 'cache' / 'quats_sos_and_eos')) == 4
+
+
+def test_the_sos_and_eos_of_the_legacy_file_are_kept(make_processor, tmp_path):
+    # quats_sos_and_eos.npz as saved by the earlier versions, with the rotations of the pretrained models
+    rng = np.random.RandomState(0)
+    quats = rng.randn(2, len(synthetic_data.joint_parents), 4)
+    quats /= np.linalg.norm(quats, axis=-1, keepdims=True)
+    np.savez_compressed(tmp_path / 'quats_sos_and_eos.npz', quats_sos=quats[0], quats_eos=quats[1])
+    processor = make_processor()
+    np.testing.assert_array_equal(processor.quats_sos[0].numpy(), quats[0])
+    np.testing.assert_array_equal(processor.quats_eos[0].numpy(), quats[1])
+    data_dict, _ = synthetic_data.get_data_dict(10)
+    for key, sample in processor.data_loader['train'].items():
+        expected = MocapDataset.forward_kinematics(
+            torch.from_numpy(quats[None]), torch.from_numpy(data_dict[key]['positions'][None, [0, -1], 0]),
+            synthetic_data.joint_parents, torch.from_numpy(synthetic_data.joint_offsets)[None])[0].numpy()
+        np.testing.assert_allclose(sample['positions'][[0, -1]], expected, atol=1e-10)
+
+    # a file saved for other training samples is not used
+    np.savez_compressed(tmp_path / 'quats_sos_and_eos.npz', quats_sos=quats[0], quats_eos=quats[1],
+                        keys=np.array(['999999']))
+    assert not np.array_equal(make_processor().quats_sos[0].numpy(), quats[0])
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import torch
+
+from utils import synthetic_data
+from utils.mocap_dataset import MocapDataset
+from utils.spline import Spline, Spline_AS, Spline_AS_Stream
+
+
+def get_splines(closed):
+    # random walks on the ground of different lengths, one of them shorter than one unit
+    rng = np.random.RandomState(0)
+    scales = np.array([0.02, 0.2, 0.5, 1.])[:, None, None]
+    points = np.cumsum(rng.randn(len(scales), 30, 2), axis=1) * scales
+    angles = np.cumsum(rng.randn(len(scales), 30) * 0.2, axis=1)
+    directions = np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+    amplitudes = rng.rand(len(scales), 30, 3)
+    splines = []
+    for s in range(len(points)):
+        spline = Spline(points[s], closed=closed)
+        spline.add_track('direction', directions[s], interp_mode='circular')
+        spline.add_track('amplitude', amplitudes[s], interp_mode='linear')
+        splines.append(spline)
+    spline_as = Spline_AS(torch.from_numpy(points), closed=closed)
+    spline_as.add_track('direction', torch.from_numpy(directions), interp_mode='circular')
+    spline_as.add_track('amplitude', torch.from_numpy(amplitudes), interp_mode='linear')
+    return splines, spline_as
+
+
+@pytest.mark.parametrize('closed', [False, True])
+def test_batched_re_parametrize_matches_the_per_sample_splines(closed):
+    splines, spline_as = get_splines(closed)
+    # the second pass re-parametrizes splines of different numbers of points
+    for _ in range(2):
+        splines = [spline.re_parametrize(5, 0.5) for spline in splines]
+        spline_as = spline_as.re_parametrize(5, 0.5)
+        for s, spline in enumerate(splines):
+            num_points = spline.size()
+            assert spline_as.num_points[s].item() == num_points
+            np.testing.assert_allclose(spline_as.points[s, :num_points].numpy(), spline.points, rtol=0., atol=1e-10)
+            np.testing.assert_allclose(spline_as.length()[s].item(), spline.length(), rtol=1e-12)
+            for track in ['tangent', 'curvature', 'direction', 'amplitude']:
+                np.testing.assert_allclose(spline_as.get_track(track)[s, :num_points].numpy(),
+                                           spline.get_track(track), rtol=0., atol=1e-10)
+    assert len(set(spline.size() for spline in splines)) > 1
+    distances = np.linspace(-1., 3., 17)
+    for s, spline in enumerate(splines):
+        np.testing.assert_allclose(spline_as.interpolate(torch.from_numpy(distances), 'direction')[s].numpy(),
+                                   spline.interpolate(distances, 'direction'), rtol=0., atol=1e-10)
+
+
+def get_last_spline_features_per_sample(positions, orientations):
+    # the previous implementation of MocapDataset.get_predicted_features, one sample at a time
+    features = []
+    for s in range(len(positions)):
+        data = dict(positions_world=positions[s], trajectory=positions[s, :, 0], orientations=orientations[s])
+        data['trans_and_controls'] = MocapDataset.compute_translations_and_controls(data)
+        features.append(Spline.extract_spline_features(MocapDataset.compute_splines(data))[0][-1:])
+    return np.stack(features)
+
+
+def test_spline_stream_matches_the_per_sample_features():
+    data_dict, _ = synthetic_data.get_data_dict(4, min_frames=60, max_frames=60)
+    positions = np.stack([sample['positions'] for sample in data_dict.values()])
+    orientations = np.cumsum(np.random.RandomState(0).randn(*positions.shape[:2], 1) * 0.1, axis=1)
+    num_past_frames = 5
+    stream = Spline_AS_Stream(torch.from_numpy(positions[:, :num_past_frames]),
+                              torch.from_numpy(orientations[:, :num_past_frames]))
+    for t in range(num_past_frames, positions.shape[1]):
+        # frames appended one at a time, as in the autoregressive rollouts
+        stream.append(torch.from_numpy(positions[:, t:t + 1]), torch.from_numpy(orientations[:, t:t + 1]))
+        np.testing.assert_allclose(stream.get_features().numpy(),
+                                   get_last_spline_features_per_sample(positions[:, :t + 1],
+                                                                       orientations[:, :t + 1, 0]),
+                                   rtol=0., atol=1e-10)
@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+
+# budget of the total import time of main.py --help, about 0.1s when measured
+import_time_budget = 0.5
+heavy_modules = ['torch', 'matplotlib', 'torchtext', 'nltk', 'pyttsx3', 'cv2']
+
+
+def test_help_stays_within_the_import_time_budget(repo_dir):
+    result = subprocess.run([sys.executable, '-X', 'importtime', 'main.py', '--help'], cwd=repo_dir,
+                            capture_output=True, text=True, check=True)
+    assert 'usage: main.py' in result.stdout
+    # every line is 'import time: self [us] | cumulative | module', the self times add up to the total
+    self_times = [int(line.split(':', 1)[1].split('|')[0]) for line in result.stderr.splitlines()
+                  if line.startswith('import time:') and 'self [us]' not in line]
+    assert len(self_times) > 0
+    assert sum(self_times) / 1e6 < import_time_budget
+
+
+def test_help_does_not_import_the_heavy_modules(repo_dir):
+    script = ('import json, runpy, sys\n'
+              'sys.argv = ["main.py", "--help"]\n'
+              'try:\n'
+              '    runpy.run_path("main.py", run_name="__main__")\n'
+              'except SystemExit:\n'
+              '    pass\n'
+              'sys.stderr.write(json.dumps(sorted(sys.modules)))\n')
+    result = subprocess.run([sys.executable, '-c', script], cwd=repo_dir, capture_output=True, text=True,
+                            check=True)
+    modules = json.loads(result.stderr)
+    assert 'argparse' in modules
+    for module in heavy_modules:
+        assert not any(m == module or m.startswith(module + '.') for m in modules), module
@@ -0,0 +1,20 @@
+from torchlight.torchlight.gpu import SyncAudit
+
+
+def test_training_step_has_no_host_syncs(make_processor):
+    processor = make_processor(sync_audit=True, batch_size=4)
+    # the audit holds the counts of the last training step of the epoch
+    processor.per_train()
+    assert processor.sync_audit.total == 0, dict(processor.sync_audit.counts)
+
+
+def test_sync_audit_counts_host_reads():
+    import torch
+
+    x = torch.randn(5)
+    audit = SyncAudit('cpu')
+    with audit:
+        x.sum().item()
+        x[x > 0]
+        x.sum() * 2
+    assert audit.total == 2
@@ -0,0 +1,38 @@
+import pytest
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+
+from net.T2GNet import T2GNet
+
+
+def linear_with_repeated_inputs(layer, x, static):
+    # the layer applied to the static inputs concatenated to x at every time step
+    return layer(torch.cat((x.expand(-1, static.shape[0], -1),
+                            static.unsqueeze(0).expand(x.shape[0], -1, -1)), dim=-1))
+
+
+@pytest.mark.parametrize('shared_x', [False, True])
+def test_linear_with_static_inputs_matches_the_concatenated_inputs(shared_x):
+    torch.manual_seed(0)
+    layer = nn.Linear(16 + 5, 12).double()
+    x = torch.randn(7, 1 if shared_x else 4, 16, dtype=torch.float64)
+    static = torch.randn(4, 5, dtype=torch.float64)
+    output = T2GNet.linear_with_static_inputs(layer, x, static)
+    assert output.shape == (7, 4, 12)
+    torch.testing.assert_close(output, linear_with_repeated_inputs(layer, x, static), rtol=0., atol=1e-12)
+
+
+@pytest.mark.parametrize('shared_x', [False, True])
+def test_linear_with_static_inputs_of_a_quantized_layer(shared_x):
+    torch.manual_seed(0)
+    layer = nn.Linear(16 + 5, 12)
+    quantized_layer = quantize_dynamic(nn.Sequential(layer), {nn.Linear}, dtype=torch.qint8)[0]
+    assert not isinstance(quantized_layer, nn.Linear)
+    x = torch.randn(7, 1 if shared_x else 4, 16)
+    static = torch.randn(4, 5)
+    output = T2GNet.linear_with_static_inputs(quantized_layer, x, static)
+    # the fallback concatenates the inputs, so it matches the quantized layer exactly
+    torch.testing.assert_close(output, linear_with_repeated_inputs(quantized_layer, x, static), rtol=0., atol=0.)
+    # and the float layer up to the quantization error
+    torch.testing.assert_close(output, T2GNet.linear_with_static_inputs(layer, x, static), rtol=0., atol=0.05)
@@ -0,0 +1,46 @@
+import pytest
+import torch
+
+from net.T2GNet import T2GNet
+from net.T2GNet_export import export_t2gnet
+
+# intended emotion, intended polarity, acting task, gender, age, handedness and native tongue
+tag_dims = [4, 3, 2, 2, 1, 2, 3]
+
+
+def get_model(num_joints=5, max_frames=8):
+    torch.manual_seed(0)
+    return T2GNet(num_tokens=20, max_time_steps=max_frames, text_dim=16, quat_dim=num_joints * 4, quat_channels=4,
+                  offsets_dim=num_joints, intended_emotion_dim=tag_dims[0], intended_polarity_dim=tag_dims[1],
+                  acting_task_dim=tag_dims[2], gender_dim=tag_dims[3], age_dim=tag_dims[4],
+                  handedness_dim=tag_dims[5], native_tongue_dim=tag_dims[6], num_heads_enc=2, num_heads_dec=2,
+                  num_hidden_units_enc=32, num_hidden_units_dec=32, num_layers_enc=2, num_layers_dec=2).eval()
+
+
+@pytest.mark.parametrize('num_frames', [5, 8])
+def test_exported_step_decoder_matches_the_teacher_forced_model(tmp_path, num_frames):
+    model = get_model()
+    batch_size, num_joints = 3, model.quat_dim // 4
+    text = torch.randint(0, 20, (batch_size, 6))
+    tags = [torch.rand(batch_size, dim) for dim in tag_dims]
+    offset_lengths = torch.rand(batch_size, num_joints)
+    quats_sos = torch.nn.functional.normalize(torch.randn(num_joints, 4), dim=-1)
+    ground_truth = torch.nn.functional.normalize(torch.randn(batch_size, num_frames, num_joints, 4), dim=-1)
+    # the decoder inputs, the start pose followed by the ground truth frames but the last
+    quat = torch.cat((quats_sos.expand(batch_size, 1, -1, -1), ground_truth[:, :-1]), dim=1).flatten(2)
+    with torch.inference_mode():
+        quat_pred, _ = model(text, *tags, quat=quat, offset_lengths=offset_lengths)
+
+    encoder, decoder, smoothing = [torch.jit.load(f) for f in export_t2gnet(model, quats_sos, str(tmp_path))]
+    with torch.inference_mode():
+        memory_keys, memory_values = encoder(text, torch.cat(tags, dim=-1), offset_lengths)
+        self_keys = self_values = decoder.empty_cache(memory_keys)
+        frames_pre_norm = []
+        for t in range(num_frames):
+            # teacher forcing, every step is fed the ground truth frame instead of the previous prediction
+            step_quat = decoder.quats_sos.expand(batch_size, -1, -1) if t == 0 else quat[:, t:t + 1]
+            _, x, self_keys, self_values = decoder(step_quat, memory_keys, memory_values, self_keys, self_values)
+            frames_pre_norm.append(x)
+        assert self_keys.shape[3] == num_frames
+        exported_quat_pred = smoothing(torch.cat(frames_pre_norm, dim=1))
+    torch.testing.assert_close(exported_quat_pred, quat_pred, rtol=0., atol=1e-5)
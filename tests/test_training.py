@@ -0,0 +1,95 @@
+import torch
+import torch.nn as nn
+
+
+def get_batch(processor, batch_size):
+    return tuple(b.clone() for b in next(processor.yield_batch(batch_size, processor.data_loader['train'])))
+
+
+def split_batch(batch, sizes):
+    starts = [sum(sizes[:i]) for i in range(len(sizes))]
+    return [tuple(b[start:start + size] for b in batch) for start, size in zip(starts, sizes)]
+
+
+def get_gradients(model):
+    return {name: p.grad.clone() for name, p in model.named_parameters() if p.grad is not None}
+
+
+def make_deterministic(model):
+    # without dropout, and without the positional encodings, which T2GNet picks by the position of the sample
+    # in its batch, every sample gets the same outputs in any batch
+    for module in model.modules():
+        if isinstance(module, nn.Dropout):
+            module.p = 0.
+        elif isinstance(module, nn.MultiheadAttention):
+            module.dropout = 0.
+    model.text_pos_encoder.pe.zero_()
+    model.quat_pos_encoder.pe.zero_()
+
+
+def get_step_gradients(processor, monkeypatch, batches):
+    # the gradients of every optimizer step of an epoch over the given batches, without updating the weights
+    gradients = []
+    monkeypatch.setattr(processor, 'yield_batch', lambda batch_size, dataset, start_pass=0: iter(batches[start_pass:]))
+    monkeypatch.setattr(processor.optimizer, 'step', lambda: gradients.append(get_gradients(processor.model)))
+    processor.per_train()
+    return gradients
+
+
+def test_accumulated_gradients_match_those_of_the_larger_batches(make_processor, monkeypatch):
+    # 8 training samples in batches of 2, 3 batches per step: the last step of the epoch only has one batch
+    processor = make_processor(batch_size=2, accumulation_steps=3)
+    make_deterministic(processor.model)
+    batch = get_batch(processor, 8)
+    accumulated = get_step_gradients(processor, monkeypatch, split_batch(batch, [2, 2, 2, 2]))
+    processor.args.batch_size = 6
+    processor.args.accumulation_steps = 1
+    expected = get_step_gradients(processor, monkeypatch, split_batch(batch, [6, 2]))
+    assert len(accumulated) == len(expected) == 2
+    for step_gradients, expected_step_gradients in zip(accumulated, expected):
+        assert len(step_gradients) > 0 and step_gradients.keys() == expected_step_gradients.keys()
+        for name, gradient in step_gradients.items():
+            torch.testing.assert_close(gradient, expected_step_gradients[name], rtol=1e-4, atol=1e-6)
+
+
+def test_checkpointed_activations_keep_the_loss_and_the_gradients(make_processor):
+    processor = make_processor()
+    processor.model.train()
+    batch = get_batch(processor, 4)
+    results = []
+    for checkpoint_activations in [False, True]:
+        processor.args.checkpoint_activations = checkpoint_activations
+        processor.model.checkpoint_activations = checkpoint_activations
+        processor.model.zero_grad()
+        # the same dropout masks, which the recomputed activations are run again with
+        torch.manual_seed(0)
+        loss = processor.forward_pass(*batch)
+        loss.backward()
+        results.append((loss.detach(), get_gradients(processor.model)))
+    (loss, gradients), (checkpointed_loss, checkpointed_gradients) = results
+    torch.testing.assert_close(checkpointed_loss, loss, rtol=0., atol=0.)
+    assert len(gradients) > 0 and checkpointed_gradients.keys() == gradients.keys()
+    for name, gradient in gradients.items():
+        torch.testing.assert_close(checkpointed_gradients[name], gradient, rtol=1e-5, atol=1e-7)
+
+
+def test_training_resumes_between_optimizer_steps(make_processor, monkeypatch):
+    # 4 passes of 2 samples, in optimizer steps of 3 and 1 passes
+    processor = make_processor(batch_size=2, accumulation_steps=3, checkpoint_interval=1)
+    initial_state = processor.get_training_state(0)
+    states = []
+    monkeypatch.setattr(processor, 'save_training_state', lambda file_name, resume_epoch, resume_pass=0,
+                        epoch_progress=(0., 0.): states.append(
+                            processor.get_training_state(resume_epoch, resume_pass, epoch_progress)))
+    processor.per_train()
+    assert [state['resume_pass'] for state in states] == [3, 4]
+    trained_weights = processor.model.state_dict()
+
+    # the epoch again from its start, then from the state saved after the first step
+    for state, start_pass in [(initial_state, 0), (states[0], 3)]:
+        torch.save(state, processor.args.work_dir + '/resume_test.pth.tar')
+        _, resume_pass, epoch_progress = processor.load_training_state('resume_test.pth.tar')
+        assert resume_pass == start_pass
+        processor.per_train(start_pass=resume_pass, epoch_progress=epoch_progress)
+        for name, value in processor.model.state_dict().items():
+            assert torch.equal(value, trained_weights[name]), name
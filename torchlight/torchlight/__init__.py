@@ -6,3 +6,5 @@ from .io import import_class
 from .gpu import visible_gpu
 from .gpu import occupy_gpu
 from .gpu import ngpu
+from .gpu import setup_device
+from .gpu import SyncAudit
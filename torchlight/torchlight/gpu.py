@@ -1,5 +1,11 @@
+import collections
+import contextlib
 import os
 import torch
+import traceback
+import warnings
+
+from torch.overrides import TorchFunctionMode
 
 
 def visible_gpu(gpus):
@@ -33,3 +39,156 @@ def occupy_gpu(gpus=None):
         gpus = [gpus] if isinstance(gpus, int) else list(gpus)
         for g in gpus:
             torch.zeros(1).cuda(g)
+
+
+def setup_device(use_cuda=True, num_threads=None, num_interop_threads=None, deterministic=False):
+    """
+        choose the device to run on and configure torch for it.
+
+        falls back to the cpu if cuda is not requested or not available.
+        num_threads and num_interop_threads set the intra-op and inter-op thread pools
+        used on the cpu, and must be set before any parallel work is done.
+        deterministic makes repeated runs produce the same results, at some cost in speed.
+
+        return the torch.device to use
+    """
+    if num_threads is not None and num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None and num_interop_threads > 0:
+        torch.set_num_interop_threads(num_interop_threads)
+    if deterministic:
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+        if hasattr(torch, 'use_deterministic_algorithms'):
+            os.environ.setdefault('CUBLAS_WORKSPACE_CONFIG', ':4096:8')
+            torch.use_deterministic_algorithms(True)
+    if use_cuda and torch.cuda.is_available():
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device('cpu')
+
+
+class SyncAudit(TorchFunctionMode):
+    """
+        count the implicit device to host transfers made inside the context.
+
+        every call that reads the values of a tensor on the audited device from python
+        (item, tolist, numpy, cpu, conversions to python scalars or bools, ...) or whose
+        output size depends on those values (nonzero, boolean mask indexing, ...) is
+        recorded with the line of code that made it. on cuda the synchronizations made
+        inside the kernels are also recorded through the cuda sync debug mode.
+        on the cpu every such read is recorded, so that regressions can be caught
+        without a gpu, except those of torch.optim, whose step counts are kept on the
+        host whatever the device of the parameters.
+
+        counts maps each recorded 'function at file:line' to its number of calls.
+    """
+
+    syncing_functions = {'item', 'tolist', 'numpy', 'cpu', '__bool__', '__int__', '__float__', '__index__',
+                         'nonzero', 'masked_select', 'unique', 'unique_consecutive', 'repeat_interleave'}
+
+    def __init__(self, device):
+        super(SyncAudit, self).__init__()
+        self.device = torch.device(device)
+        self.counts = collections.Counter()
+        self._cuda_warnings = None
+
+    def __enter__(self):
+        self.counts.clear()
+        if self.device.type == 'cuda':
+            self._cuda_warnings = warnings.catch_warnings(record=True)
+            self._recorded_warnings = self._cuda_warnings.__enter__()
+            warnings.simplefilter('always')
+            torch.cuda.set_sync_debug_mode('warn')
+        return super(SyncAudit, self).__enter__()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        super(SyncAudit, self).__exit__(exc_type, exc_value, exc_traceback)
+        if self._cuda_warnings is not None:
+            torch.cuda.set_sync_debug_mode('default')
+            for w in self._recorded_warnings:
+                if 'synchronizing' in str(w.message):
+                    self.counts['cuda synchronization at {}:{}'.format(w.filename, w.lineno)] += 1
+            self._cuda_warnings.__exit__(exc_type, exc_value, exc_traceback)
+            self._cuda_warnings = None
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = {} if kwargs is None else kwargs
+        name = getattr(func, '__name__', str(func))
+        tensor = args[0] if len(args) > 0 and torch.is_tensor(args[0]) else None
+        if tensor is not None and tensor.device.type == self.device.type and self._is_syncing(name, args, kwargs) \
+                and not self._is_optimizer_call():
+            self.counts['{} at {}'.format(name, self._caller())] += 1
+        return func(*args, **kwargs)
+
+    def _is_syncing(self, name, args, kwargs):
+        if name in self.syncing_functions:
+            return True
+        if name == 'to':
+            devices = [a for a in list(args[1:]) + list(kwargs.values()) if isinstance(a, (str, torch.device))]
+            return any(torch.device(d).type == 'cpu' for d in devices) and self.device.type != 'cpu'
+        if name in ('__getitem__', '__setitem__'):
+            indices = args[1] if isinstance(args[1], tuple) else (args[1],)
+            return any(torch.is_tensor(i) and i.dtype == torch.bool for i in indices)
+        return False
+
+    @staticmethod
+    def _is_optimizer_call():
+        optim_path = os.path.join(os.path.dirname(torch.__file__), 'optim')
+        for frame in reversed(traceback.extract_stack()[:-2]):
+            if frame.filename != __file__:
+                return frame.filename.startswith(optim_path)
+        return False
+
+    @staticmethod
+    def _caller():
+        torch_path = os.path.dirname(torch.__file__)
+        for frame in reversed(traceback.extract_stack()[:-1]):
+            if not frame.filename.startswith(torch_path) and frame.filename != __file__:
+                return '{}:{}'.format(frame.filename, frame.lineno)
+        return 'unknown'
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+class MemoryReport(object):
+    """
+        record the peak memory of the stages of the training steps.
+
+        every stage run inside stage(name) records the bytes of the activations saved
+        for the backward pass while it runs, which is what activation checkpointing
+        trades for recomputation, and on cuda the peak bytes allocated on the device
+        while it runs. the parameters saved for the backward pass are not counted.
+
+        saved_bytes and peak_bytes map each stage name to its largest value since the
+        last clear, in the order the stages were first run.
+    """
+
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.saved_bytes = collections.OrderedDict()
+        self.peak_bytes = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        storages = {}
+
+        def pack(tensor):
+            if not (tensor.is_leaf and tensor.requires_grad):
+                storage = tensor.untyped_storage()
+                storages[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            yield
+        self.saved_bytes[name] = max(self.saved_bytes.get(name, 0), sum(storages.values()))
+        if self.device.type == 'cuda':
+            self.peak_bytes[name] = max(self.peak_bytes.get(name, 0),
+                                        torch.cuda.max_memory_allocated(self.device))
+
+    def clear(self):
+        self.saved_bytes.clear()
+        self.peak_bytes.clear()
@@ -7,7 +7,6 @@ import time
 import warnings
 import pickle
 from collections import OrderedDict
-import yaml
 import numpy as np
 # torch
 import torch
@@ -15,10 +14,6 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.autograd import Variable
 
-with warnings.catch_warnings():
-    warnings.filterwarnings("ignore",category=FutureWarning)
-    import h5py
-
 class IO():
     def __init__(self, work_dir, save_log=True, print_log=True):
         self.work_dir = work_dir
@@ -94,6 +89,9 @@ class IO():
             pickle.dump(result, f)
 
     def save_h5(self, result, filename):
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore",category=FutureWarning)
+            import h5py
         with h5py.File('{}/{}'.format(self.work_dir, filename), 'w') as f:
             for k in result.keys():
                 f[k] = result[k]
@@ -107,6 +105,7 @@ class IO():
         self.print_log('The model has been saved as {}.'.format(model_path))
 
     def save_arg(self, arg):
+        import yaml
 
         self.session_file = '{}/config.yaml'.format(self.work_dir)
 
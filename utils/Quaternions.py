@@ -19,8 +19,14 @@ class Quaternions:
     The Quaternions class has been designed such that it
     should support broadcasting and slicing in all of the
     usual ways.
+
+    Only the wrapped array is stored, so wrapping is cheap,
+    and the arithmetic keeps the floating point type of its
+    inputs, e.g. float32 stays float32.
     """
-    
+
+    __slots__ = ['qs']
+
     def __init__(self, qs):
         if isinstance(qs, np.ndarray):
         
@@ -35,6 +41,13 @@ class Quaternions:
             
         raise TypeError('Quaternions must be constructed from iterable, numpy array, or Quaternions, not %s' % type(qs))
     
+    @classmethod
+    def _wrap(cls, qs):
+        """ Wrap an array that already has the quaternion axis last, skipping the checks in __init__ """
+        q = cls.__new__(cls)
+        q.qs = qs
+        return q
+
     def __str__(self): return "Quaternions(" + str(self.qs) + ")"
 
     def __repr__(self): return "Quaternions(" + repr(self.qs) + ")"
@@ -98,31 +111,12 @@ class Quaternions:
         
         """ If Quaternions type do Quaternions * Quaternions """
         if isinstance(other, Quaternions):
-            
-            sqs, oqs = Quaternions._broadcast(self.qs, other.qs)
-            
-            q0 = sqs[..., 0]
-            q1 = sqs[..., 1]
-            q2 = sqs[..., 2]
-            q3 = sqs[..., 3]
-
-            r0 = oqs[..., 0]
-            r1 = oqs[..., 1]
-            r2 = oqs[..., 2]
-            r3 = oqs[..., 3]
-
-            qs = np.empty(sqs.shape)
-            qs[..., 0] = r0 * q0 - r1 * q1 - r2 * q2 - r3 * q3
-            qs[..., 1] = r0 * q1 + r1 * q0 - r2 * q3 + r3 * q2
-            qs[..., 2] = r0 * q2 + r1 * q3 + r2 * q0 - r3 * q1
-            qs[..., 3] = r0 * q3 - r1 * q2 + r2 * q1 + r3 * q0
-            
-            return Quaternions(qs)
+            return Quaternions._wrap(Quaternions.multiply(self.qs, other.qs))
         
         """ If array type do Quaternions * Vectors """
         if isinstance(other, np.ndarray) and other.shape[-1] == 3:
-            vs = Quaternions(np.concatenate([np.zeros(other.shape[:-1] + (1,)), other], axis=-1))
-            return (self * (vs * -self)).imaginaries
+            # a single vector is promoted like a single quaternion is in __init__
+            return Quaternions.rotate(self.qs, other[np.newaxis] if other.ndim == 1 else other)
         
         """ If float do Quaternions * Scalars """
         if isinstance(other, np.ndarray) or isinstance(other, float):
@@ -130,6 +124,49 @@ class Quaternions:
         
         raise TypeError('Cannot multiply/add Quaternions with type %s' % str(type(other)))
         
+    @staticmethod
+    def multiply(sqs, oqs, out=None):
+        """
+        Quaternion product of two broadcastable arrays of quaternions,
+        optionally written into a preallocated out array.
+        """
+        if sqs.ndim != oqs.ndim:
+            raise TypeError('Quaternions cannot broadcast together shapes %s and %s' % (sqs.shape, oqs.shape))
+
+        q0, q1, q2, q3 = sqs[..., 0], sqs[..., 1], sqs[..., 2], sqs[..., 3]
+        r0, r1, r2, r3 = oqs[..., 0], oqs[..., 1], oqs[..., 2], oqs[..., 3]
+
+        if out is None:
+            out = np.empty(np.broadcast_shapes(sqs.shape, oqs.shape), dtype=np.result_type(sqs, oqs))
+        out[..., 0] = r0 * q0 - r1 * q1 - r2 * q2 - r3 * q3
+        out[..., 1] = r0 * q1 + r1 * q0 - r2 * q3 + r3 * q2
+        out[..., 2] = r0 * q2 + r1 * q3 + r2 * q0 - r3 * q1
+        out[..., 3] = r0 * q3 - r1 * q2 + r2 * q1 + r3 * q0
+        return out
+
+    @staticmethod
+    def rotate(qs, vs, out=None):
+        """
+        Rotate an array of 3D vectors by a broadcastable array of quaternions, i.e. q * v * -q,
+        optionally written into a preallocated out array.
+        """
+        if qs.ndim != vs.ndim:
+            raise TypeError('Quaternions cannot broadcast together shapes %s and %s' % (qs.shape, vs.shape))
+
+        w, x, y, z = qs[..., 0], qs[..., 1], qs[..., 2], qs[..., 3]
+        vx, vy, vz = vs[..., 0], vs[..., 1], vs[..., 2]
+
+        # q * v * -q expanded, which also keeps the scaling by |q|^2 of non-unit quaternions
+        scale = w * w - x * x - y * y - z * z
+        dot2 = 2. * (x * vx + y * vy + z * vz)
+        w2 = 2. * w
+        if out is None:
+            out = np.empty(np.broadcast_shapes(qs.shape[:-1] + (3,), vs.shape), dtype=np.result_type(qs, vs))
+        out[..., 0] = scale * vx + dot2 * x + w2 * (y * vz - z * vy)
+        out[..., 1] = scale * vy + dot2 * y + w2 * (z * vx - x * vz)
+        out[..., 2] = scale * vz + dot2 * z + w2 * (x * vy - y * vx)
+        return out
+
     def __div__(self, other):
         """
         When a Quaternion type is supplied, division is defined
@@ -154,7 +191,7 @@ class Quaternions:
     
     def __neg__(self):
         """ Invert Quaternions """
-        return Quaternions(self.qs * np.array([[1, -1, -1, -1]]))
+        return Quaternions._wrap(self.qs * np.array([1, -1, -1, -1], dtype=self.qs.dtype))
     
     def __abs__(self):
         """ Unify Quaternions To Single Pole """
@@ -191,7 +228,7 @@ class Quaternions:
         return Quaternions(self.qs.repeat(n, **kwargs))
     
     def normalized(self):
-        return Quaternions(self.qs / self.lengths[..., np.newaxis])
+        return Quaternions._wrap(self.qs / self.lengths[..., np.newaxis])
     
     def log(self):
         norm = abs(self.normalized())
@@ -234,14 +271,14 @@ class Quaternions:
     def interpolate(self, ws):
         return Quaternions.exp(np.average(abs(self).log, axis=0, weights=ws))
     
-    def euler(self, order='xyz', epsilon=0):
+    def euler(self, order='xyz', epsilon=0, out=None):
         
-        q = self.normalized().qs
+        q = self.qs / self.lengths[..., np.newaxis]
         q0 = q[..., 0]
         q1 = q[..., 1]
         q2 = q[..., 2]
         q3 = q[..., 3]
-        es = np.zeros(self.shape + (3,))
+        es = np.empty(self.shape + (3,), dtype=q.dtype) if out is None else out
 
         if order == 'xyz':
             es[..., 0] = np.arctan2(2 * (q0 * q1 - q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2))
@@ -386,15 +423,15 @@ class Quaternions:
         return self.qs.ravel()
 
     @classmethod
-    def id(cls, n):
+    def id(cls, n, dtype=np.float64):
         
         if isinstance(n, tuple):
-            qs = np.zeros(n + (4,))
+            qs = np.zeros(n + (4,), dtype=dtype)
             qs[..., 0] = 1.0
             return Quaternions(qs)
         
         if isinstance(n, int):
-            qs = np.zeros((n, 4))
+            qs = np.zeros((n, 4), dtype=dtype)
             qs[:, 0] = 1.0
             return Quaternions(qs)
         
@@ -155,10 +155,11 @@ def qfix(q):
 
     if len(q.shape) == 3:
         if torch.is_tensor(q):
-            result = q.clone()
+            # flip with a sign instead of boolean indexing, which needs the mask on the host
             dot_products = torch.sum(q[1:] * q[:-1], dim=-1)
             mask = dot_products < 0
-            mask = (torch.cumsum(mask, dim=0) % 2).type(torch.bool)
+            signs = 1. - 2. * (torch.cumsum(mask, dim=0) % 2).unsqueeze(-1).type(q.dtype)
+            return torch.cat((q[:1], q[1:] * signs), dim=0)
         elif isinstance(q, np.ndarray):
             result = q.copy()
             dot_products = np.sum(q[1:] * q[:-1], axis=-1)
@@ -171,10 +172,10 @@ def qfix(q):
         return result
     if len(q.shape) == 4:
         if torch.is_tensor(q):
-            result = q.clone()
             dot_products = torch.sum(q[:, 1:] * q[:, :-1], dim=-1)
             mask = dot_products < 0
-            mask = (torch.cumsum(mask, dim=1) % 2).type(torch.bool)
+            signs = 1. - 2. * (torch.cumsum(mask, dim=1) % 2).unsqueeze(-1).type(q.dtype)
+            return torch.cat((q[:, :1], q[:, 1:] * signs), dim=1)
         elif isinstance(q, np.ndarray):
             result = q.copy()
             dot_products = np.sum(q[:, 1:] * q[:, :-1], axis=-1)
@@ -0,0 +1,151 @@
+import argparse
+import numpy as np
+
+
+def get_parser():
+    """
+    Parser of the arguments of main.py, also used to build the arguments of the tests and benchmarks
+    from its defaults.
+    """
+    parser = argparse.ArgumentParser(description='Text to Emotive Gestures Generation')
+    parser.add_argument('--dataset', type=str, default='mpi', metavar='D',
+                        help='dataset to train or evaluate method (default: mpi)')
+    parser.add_argument('--frame-drop', type=float, default=2, metavar='FD',
+                        help='frame down-sample rate, keeping one frame every FD frames of the captures, '
+                             'resampled on the fly from the full rate data (default: 2)')
+    parser.add_argument('--add-mirrored', type=bool, default=False, metavar='AM',
+                        help='perform data augmentation by mirroring the training sequences (default: False)')
+    parser.add_argument('--mirror-probability', type=float, default=0.5, metavar='MP',
+                        help='probability of mirroring every training sequence with --add-mirrored (default: 0.5)')
+    parser.add_argument('--train', type=bool, default=False, metavar='T',
+                        help='train the model (default: True)')
+    parser.add_argument('--use-multiple-gpus', type=bool, default=True, metavar='T',
+                        help='use multiple GPUs if available (default: True)')
+    parser.add_argument('--load-last-best', type=bool, default=True, metavar='LB',
+                        help='load the most recent best model (default: True)')
+    parser.add_argument('--batch-size', type=int, default=8, metavar='B',
+                        help='input batch size for training (default: 32)')
+    parser.add_argument('--accumulation-steps', type=int, default=1, metavar='AS',
+                        help='number of batches whose gradients are accumulated for every optimizer step, '
+                             'the effective batch size being batch-size x accumulation-steps x num-processes '
+                             '(default: 1)')
+    parser.add_argument('--checkpoint-activations', action='store_true', default=False,
+                        help='recompute the activations of the decoder layers, the forward kinematics and the losses '
+                             'in the backward pass instead of keeping them, to train on longer sequences or larger '
+                             'batches at the cost of speed (default: False)')
+    parser.add_argument('--memory-report', action='store_true', default=False,
+                        help='log the memory saved for the backward pass by every stage of the training steps, '
+                             'and their peak memory on cuda (default: False)')
+    parser.add_argument('--num-worker', type=int, default=4, metavar='W',
+                        help='number of threads? (default: 4)')
+    parser.add_argument('--start-epoch', type=int, default=0, metavar='SE',
+                        help='starting epoch of training (default: 0)')
+    parser.add_argument('--num-epoch', type=int, default=5000, metavar='NE',
+                        help='number of epochs to train (default: 1000)')
+    # parser.add_argument('--window-length', type=int, default=1, metavar='WL',
+    #                     help='max number of past time steps to take as input to transformer decoder (default: 60)')
+    parser.add_argument('--optimizer', type=str, default='Adam', metavar='O',
+                        help='optimizer (default: Adam)')
+    parser.add_argument('--base-lr', type=float, default=5e-3, metavar='LR',
+                        help='base learning rate (default: 1e-3)')
+    parser.add_argument('--base-tr', type=float, default=1., metavar='TR',
+                        help='base teacher rate (default: 1.0)')
+    parser.add_argument('--step', type=list, default=0.05 * np.arange(20), metavar='[S]',
+                        help='fraction of steps when learning rate will be decreased (default: [0.5, 0.75, 0.875])')
+    parser.add_argument('--lr-decay', type=float, default=0.999, metavar='LRD',
+                        help='learning rate decay (default: 0.999)')
+    parser.add_argument('--tf-decay', type=float, default=0.995, metavar='TFD',
+                        help='teacher forcing ratio decay (default: 0.995)')
+    parser.add_argument('--gradient-clip', type=float, default=0.5, metavar='GC',
+                        help='gradient clip threshold (default: 0.1)')
+    parser.add_argument('--nesterov', action='store_true', default=True,
+                        help='use nesterov')
+    parser.add_argument('--momentum', type=float, default=0.9, metavar='M',
+                        help='momentum (default: 0.9)')
+    parser.add_argument('--weight-decay', type=float, default=5e-4, metavar='D',
+                        help='Weight decay (default: 5e-4)')
+    parser.add_argument('--upper-body-weight', type=float, default=1., metavar='UBW',
+                        help='loss weight on the upper body joint motions (default: 2.05)')
+    parser.add_argument('--affs-reg', type=float, default=0.8, metavar='AR',
+                        help='regularization for affective features loss (default: 0.01)')
+    parser.add_argument('--quat-norm-reg', type=float, default=0.1, metavar='QNR',
+                        help='regularization for unit norm constraint (default: 0.01)')
+    parser.add_argument('--quat-reg', type=float, default=1.2, metavar='QR',
+                        help='regularization for quaternion loss (default: 0.01)')
+    parser.add_argument('--recons-reg', type=float, default=1.2, metavar='RCR',
+                        help='regularization for reconstruction loss (default: 1.2)')
+    parser.add_argument('--eval-interval', type=int, default=1, metavar='EI',
+                        help='interval after which model is evaluated (default: 1)')
+    parser.add_argument('--log-interval', type=int, default=100, metavar='LI',
+                        help='interval after which log is printed (default: 100)')
+    parser.add_argument('--save-interval', type=int, default=10, metavar='SI',
+                        help='interval after which model is saved (default: 10)')
+    parser.add_argument('--checkpoint-interval', type=int, default=0, metavar='CI',
+                        help='number of optimizer steps after which the full training state is saved for resuming '
+                             'mid-epoch, 0 to only save at the end of every epoch (default: 0)')
+    parser.add_argument('--detect-anomaly', action='store_true', default=False,
+                        help='run the forward and backward passes with autograd anomaly detection, '
+                             'slow and synchronizes the device on every operation (default: False)')
+    parser.add_argument('--sync-audit', action='store_true', default=False,
+                        help='count and log the device to host synchronizations made in every training step '
+                             '(default: False)')
+    parser.add_argument('--num-processes', type=int, default=1, metavar='NP',
+                        help='number of local training processes to launch, each training on its own share '
+                             'of every batch (default: 1)')
+    parser.add_argument('--dist-backend', type=str, default='gloo', metavar='DB',
+                        help='backend for distributed training, gloo also runs on cpu (default: gloo)')
+    parser.add_argument('--dist-port', type=int, default=29500, metavar='DP',
+                        help='port of the first process when launching local processes (default: 29500)')
+    parser.add_argument('--bucket-cap-mb', type=int, default=25, metavar='BC',
+                        help='size of the gradient buckets reduced across processes, in MB (default: 25)')
+    parser.add_argument('--num-threads', type=int, default=0, metavar='NT',
+                        help='number of intra-op cpu threads, 0 for the torch default (default: 0)')
+    parser.add_argument('--num-interop-threads', type=int, default=0, metavar='NIT',
+                        help='number of inter-op cpu threads, 0 for the torch default (default: 0)')
+    parser.add_argument('--deterministic', action='store_true', default=False,
+                        help='use deterministic algorithms only, for reproducible runs')
+    parser.add_argument('--ik-post-process', action='store_true', default=False,
+                        help='clean up the foot contacts of the generated motions with inverse kinematics')
+    parser.add_argument('--ik-iterations', type=int, default=10, metavar='IKI',
+                        help='number of inverse kinematics iterations (default: 10)')
+    parser.add_argument('--ik-contact-threshold', type=float, default=0.05, metavar='IKC',
+                        help='maximum displacement per frame of a planted foot, '
+                             'relative to the longest bone (default: 0.05)')
+    parser.add_argument('--eval-dtw', action='store_true', default=False,
+                        help='also report the dynamic time warping distance between the predicted and '
+                             'ground-truth joint positions when evaluating')
+    parser.add_argument('--dtw-band', type=int, default=10, metavar='DTWB',
+                        help='half width of the time warping band in frames, negative for no band (default: 10)')
+    parser.add_argument('--quantize', action='store_true', default=False,
+                        help='quantize the model to int8 and generate with it on the cpu, '
+                             'reporting its accuracy and latency against the float model')
+    parser.add_argument('--quantize-convs', action='store_true', default=False,
+                        help='also quantize the temporal smoothing convolutions statically')
+    parser.add_argument('--calibration-samples', type=int, default=256, metavar='CAS',
+                        help='number of training samples to calibrate the quantization on (default: 256)')
+    parser.add_argument('--benchmark-batch-sizes', type=int, nargs='+', default=[1, 8, 64], metavar='BBS',
+                        help='batch sizes to measure the latency of the quantized model at (default: 1 8 64)')
+    parser.add_argument('--encoder-cache-mb', type=float, default=0., metavar='ECM',
+                        help='memory budget of each level of the text encoder cache used when generating, '
+                             '0 to disable the cache (default: 0)')
+    parser.add_argument('--encoder-cache-dir', type=str, default=None, metavar='ECD',
+                        help='directory of the on-disk tier of the text encoder cache (default: memory only)')
+    parser.add_argument('--benchmark-fan-out', action='store_true', default=False,
+                        help='compare generating the first test sample under every intended emotion with one encoder '
+                             'pass against one call per emotion')
+    parser.add_argument('--export-dir', type=str, default=None, metavar='ED',
+                        help='directory to export the model, its vocabulary and the skeleton to, '
+                             'for run_exported.py (default: no export)')
+    parser.add_argument('--plot-affs', action='store_true', default=False,
+                        help='plot the affective features of all the samples by intended emotion '
+                             'to the plots directory')
+    parser.add_argument('--no-cuda', action='store_true', default=False,
+                        help='disables CUDA training')
+    parser.add_argument('--pavi-log', action='store_true', default=False,
+                        help='pavi log')
+    parser.add_argument('--print-log', action='store_true', default=True,
+                        help='print log')
+    parser.add_argument('--save-log', action='store_true', default=True,
+                        help='save log')
+    # TO ADD: save_result
+    return parser
@@ -0,0 +1,136 @@
+import glob
+import hashlib
+import inspect
+import json
+import numpy as np
+import os
+import time
+
+
+def save_npz(content, file_name):
+    np.savez_compressed(file_name, **content)
+
+
+def load_npz(file_name):
+    content = np.load(file_name, allow_pickle=True)
+    # the dicts and the other python objects are saved as 0-d object arrays
+    return {k: content[k].item() if content[k].dtype == object and content[k].ndim == 0 else content[k]
+            for k in content.files}
+
+
+def hash_arrays(*arrays):
+    """
+    Digest of the dtypes, shapes and values of numpy arrays, to key an artifact by data held in memory.
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode())
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    Directory of derived artifacts, e.g. the processed data dicts, each saved under a key hashing everything it is
+    built from: the paths, sizes and modification times (or contents) of its input files, its parameters and the
+    source code of the functions building it. An artifact is only built again when one of them changes, and the
+    versions built from different inputs are kept side by side, until removed by gc.
+    Every version <key>.<extension> is saved in the directory of its artifact with a <key>.json file of metadata.
+    Arguments:
+     -- cache_dir: directory of the cache, created on the first save.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def get_key(input_files=(), params=None, code=(), hash_contents=False):
+        digest = hashlib.sha1()
+        for file_name in sorted(input_files):
+            digest.update(os.path.abspath(file_name).encode())
+            if hash_contents:
+                with open(file_name, 'rb') as f:
+                    digest.update(hashlib.sha1(f.read()).digest())
+            else:
+                stat = os.stat(file_name)
+                digest.update('{} {}'.format(stat.st_size, stat.st_mtime_ns).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for obj in code:
+            digest.update(inspect.getsource(obj).encode())
+        return digest.hexdigest()
+
+    def get_path(self, name, key, extension):
+        return os.path.join(self.cache_dir, name, '{}.{}'.format(key, extension))
+
+    def get(self, name, build, save=save_npz, load=load_npz, input_files=(), params=None, code=(),
+            extension='npz', hash_contents=False):
+        """
+        Load the version of an artifact built from the given inputs, building and saving it if there is none.
+        Arguments:
+         -- name: name of the artifact, e.g. 'data_dict_mpi'.
+         -- build: function without arguments returning the artifact.
+         -- save, load: functions saving the artifact to a file name and loading it from a file name.
+         -- input_files: list of the files the artifact is built from.
+         -- params: json-serializable parameters the artifact is built with.
+         -- code: list of the functions, classes or modules building the artifact.
+         -- extension: extension of the artifact files.
+         -- hash_contents: hash the contents of the input files instead of their sizes and modification times.
+        """
+        key = self.get_key(input_files, params, code, hash_contents)
+        path = self.get_path(name, key, extension)
+        if os.path.isfile(path):
+            self.update_metadata(name, key, last_used=time.time())
+            return load(path)
+        print('Building {} for its current inputs.'.format(name))
+        artifact = build()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other processes may be loading the same artifact, write it under a temporary name first
+        temp_path = os.path.join(os.path.dirname(path), '{}.{}.tmp.{}'.format(key, os.getpid(), extension))
+        save(artifact, temp_path)
+        os.replace(temp_path, path)
+        self.update_metadata(name, key, file=os.path.basename(path), size=os.path.getsize(path),
+                             num_input_files=len(input_files), params=params, created=time.time(),
+                             last_used=time.time())
+        return artifact
+
+    def update_metadata(self, name, key, **values):
+        metadata_file = os.path.join(self.cache_dir, name, key + '.json')
+        try:
+            with open(metadata_file) as f:
+                metadata = json.load(f)
+        except (FileNotFoundError, ValueError):
+            metadata = dict(name=name, key=key)
+        metadata.update(values)
+        temp_file = '{}.{}.tmp'.format(metadata_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(metadata, f, default=str)
+        os.replace(temp_file, metadata_file)
+
+    def ls(self):
+        """
+        Metadata of all the versions of all the artifacts, by name and from the most recently used.
+        """
+        entries = []
+        for metadata_file in glob.glob(os.path.join(self.cache_dir, '*', '*.json')):
+            with open(metadata_file) as f:
+                entries.append(json.load(f))
+        return sorted(entries, key=lambda e: (e['name'], -e.get('last_used', 0)))
+
+    def gc(self, keep=1, dry_run=False):
+        """
+        Remove all but the keep most recently used versions of every artifact, and the temporary files left by
+        interrupted saves. Returns the list of removed files.
+        """
+        removed = glob.glob(os.path.join(self.cache_dir, '*', '*.tmp*'))
+        versions = dict()
+        for entry in self.ls():
+            versions.setdefault(entry['name'], []).append(entry)
+        for name, entries in versions.items():
+            for entry in entries[keep:]:
+                removed += glob.glob(os.path.join(self.cache_dir, name, entry['key'] + '.*'))
+        if not dry_run:
+            for file_name in removed:
+                os.remove(file_name)
+        return removed
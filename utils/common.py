@@ -1,13 +1,13 @@
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.optimize as opt
 import torch
 
-from mpl_toolkits.mplot3d import Axes3D
-from sklearn.decomposition import PCA
 from torch.autograd import Variable
+from utils.lazy_import import lazy_import
 from utils.Quaternions import Quaternions
 
+plt = lazy_import('matplotlib.pyplot')
+opt = lazy_import('scipy.optimize')
+
 
 def fleiss_kappa(M):
     """
@@ -34,6 +34,9 @@ def fleiss_kappa(M):
 
 
 def plot_features(features, labels, font_family='DejaVu Sans', font_size=30):
+    from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
+    from sklearn.decomposition import PCA
+
     pca = PCA(n_components=3)
     components = pca.fit_transform(features)
     data_viz = np.append(components, np.expand_dims(labels, axis=1), axis=1)
@@ -76,6 +79,8 @@ def to_var(x, volatile=False):
 
 def unit_vector(vector):
     """ Returns the unit vector of the vector.  """
+    if torch.is_tensor(vector):
+        return vector / torch.norm(vector + 1e-6, dim=-1)[..., None]
     return vector / np.linalg.norm(vector + 1e-6, axis=-1)[..., None]
 
 
@@ -92,20 +97,26 @@ def angle_between_points(p1, p2, p3):
     """
     u1 = unit_vector(p1 - p2)
     u2 = unit_vector(p3 - p2)
+    if torch.is_tensor(u1):
+        return torch.acos(torch.clamp(torch.sum(u1 * u2, dim=-1), -1.0, 1.0))
     return np.arccos(np.clip(np.einsum('...i,...i->...', u1, u2), -1.0, 1.0))
 
 
 def dist_between(v1, v2):
     """ Returns the l2-norm distance between vectors 'v1' and 'v2'::
     """
+    if torch.is_tensor(v1):
+        return torch.norm(v1 - v2, dim=-1)
     return np.linalg.norm(v1 - v2, axis=-1)
 
 
 def area_of_triangle(v1, v2, v3):
-    a = np.linalg.norm(v1 - v2, axis=-1)
-    b = np.linalg.norm(v2 - v3, axis=-1)
-    c = np.linalg.norm(v3 - v1, axis=-1)
+    a = dist_between(v1, v2)
+    b = dist_between(v2, v3)
+    c = dist_between(v3, v1)
     s = (a + b + c) / 2.
+    if torch.is_tensor(s):
+        return torch.sqrt(torch.abs(s * (s - a) * (s - b) * (s - c)) + 1e-6)
     return np.sqrt(np.abs(s * (s - a) * (s - b) * (s - c)) + 1e-6)
 
 
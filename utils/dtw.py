@@ -0,0 +1,138 @@
+import numpy as np
+import torch
+
+
+def get_band_starts(x_lengths, y_lengths, band, width):
+    """
+    First row of the band on every anti-diagonal of every cost matrix. The band follows the straight line from
+    (0, 0) to (n - 1, m - 1), so that sequences of different lengths can still be aligned end to end.
+    Arguments (where N = number of pairs, D = number of anti-diagonals):
+     -- x_lengths, y_lengths: (N) long tensors of the sequence lengths.
+     -- band: half width of the band, in frames of x.
+     -- width: number of rows stored per anti-diagonal.
+    Returns an (N, D) long tensor.
+    """
+    num_diagonals = int(torch.max(x_lengths + y_lengths).item()) - 1
+    diagonals = torch.arange(num_diagonals, device=x_lengths.device, dtype=torch.float64).unsqueeze(0)
+    slopes = (x_lengths - 1).double() / (x_lengths + y_lengths - 2).clamp(min=1).double()
+    starts = torch.floor(diagonals * slopes.unsqueeze(1)).long() - band
+    starts = torch.min(starts, (x_lengths - width).unsqueeze(1))
+    return starts.clamp(min=0)
+
+
+def dtw(x, y, x_lengths=None, y_lengths=None, band=None, return_path=True, normalize=False):
+    """
+    Dynamic time warping of a batch of sequence pairs inside a Sakoe-Chiba band.
+    The accumulated costs are computed one anti-diagonal at a time for all the pairs together, and only the rows
+    inside the band of each anti-diagonal are stored. Without the path only the last two anti-diagonals are kept,
+    so the memory is O(band) per pair; with the path one byte of back pointer is kept per band cell.
+    Arguments (where N = number of pairs, T_x, T_y = sequence lengths, F = number of features):
+     -- x: (N, T_x, F) tensor, e.g. predicted joint positions flattened per frame.
+     -- y: (N, T_y, F) tensor, e.g. ground-truth joint positions flattened per frame.
+     -- x_lengths, y_lengths: optional (N) tensors of the number of valid frames of each sequence.
+     -- band: half width of the band in frames, None for the unconstrained alignment.
+     -- return_path: whether to backtrack the warp paths.
+     -- normalize: whether to divide each distance by the length of its warp path.
+    Returns the (N) tensor of distances and the list of (L, 2) numpy arrays of the aligned frame indices of each
+    pair (or None if return_path is False).
+    """
+    num_pairs, max_x, max_y = x.shape[0], x.shape[1], y.shape[1]
+    if x_lengths is None:
+        x_lengths = torch.full((num_pairs,), max_x, dtype=torch.long, device=x.device)
+    if y_lengths is None:
+        y_lengths = torch.full((num_pairs,), max_y, dtype=torch.long, device=x.device)
+    x_lengths = x_lengths.to(x.device).long()
+    y_lengths = y_lengths.to(x.device).long()
+
+    if band is None:
+        band = max_x
+    width = min(2 * band + 1, max_x)
+    starts = get_band_starts(x_lengths, y_lengths, band, width)
+    num_diagonals = starts.shape[1]
+    last_diagonals = x_lengths + y_lengths - 2
+
+    pairs = torch.arange(num_pairs, device=x.device).unsqueeze(1)
+    offsets = torch.arange(width, device=x.device).unsqueeze(0)
+    inf = torch.tensor(float('inf'), dtype=x.dtype, device=x.device)
+    costs_prev = torch.full((num_pairs, width), float('inf'), dtype=x.dtype, device=x.device)
+    costs_prev2 = costs_prev.clone()
+    steps_prev = torch.zeros((num_pairs, width), dtype=torch.long, device=x.device)
+    steps_prev2 = steps_prev.clone()
+    distances = torch.zeros(num_pairs, dtype=x.dtype, device=x.device)
+    path_lengths = torch.zeros(num_pairs, dtype=torch.long, device=x.device)
+    pointers = torch.zeros((num_pairs, num_diagonals, width), dtype=torch.uint8, device=x.device) \
+        if return_path else None
+
+    def shifted(values, shifts, fill):
+        # values of the previous anti-diagonals at the rows of the current one moved by shifts
+        idx = offsets + shifts.unsqueeze(1)
+        valid = (idx >= 0) & (idx < width)
+        return torch.where(valid, torch.gather(values, 1, idx.clamp(0, width - 1)), fill), valid
+
+    for d in range(num_diagonals):
+        rows = starts[:, d:d + 1] + offsets
+        cols = d - rows
+        valid = (rows < x_lengths.unsqueeze(1)) & (cols >= 0) & (cols < y_lengths.unsqueeze(1))
+        local_costs = torch.norm(x[pairs, rows.clamp(max=max_x - 1)] - y[pairs, cols.clamp(0, max_y - 1)], dim=-1)
+
+        if d == 0:
+            best_costs = torch.where(rows == 0, torch.zeros_like(local_costs), inf)
+            best_steps = torch.zeros_like(rows)
+            choices = torch.zeros_like(rows)
+        else:
+            shift = starts[:, d] - starts[:, d - 1]
+            # (i - 1, j - 1), (i - 1, j) and (i, j - 1)
+            candidates = [shifted(costs_prev2, starts[:, d] - starts[:, max(d - 2, 0)] - 1, inf)[0]
+                          if d > 1 else torch.full_like(local_costs, float('inf')),
+                          shifted(costs_prev, shift - 1, inf)[0],
+                          shifted(costs_prev, shift, inf)[0]]
+            step_candidates = [shifted(steps_prev2, starts[:, d] - starts[:, max(d - 2, 0)] - 1, 0)[0],
+                               shifted(steps_prev, shift - 1, 0)[0],
+                               shifted(steps_prev, shift, 0)[0]]
+            best_costs, choices = torch.min(torch.stack(candidates, dim=-1), dim=-1)
+            best_steps = torch.gather(torch.stack(step_candidates, dim=-1), -1, choices.unsqueeze(-1)).squeeze(-1)
+
+        costs = torch.where(valid, best_costs + local_costs, inf)
+        steps = best_steps + 1
+        if return_path:
+            pointers[:, d] = choices.to(torch.uint8)
+
+        ends = last_diagonals == d
+        if torch.any(ends):
+            end_offsets = (x_lengths - 1 - starts[:, d]).clamp(0, width - 1)
+            distances = torch.where(ends, costs[pairs.squeeze(1), end_offsets], distances)
+            path_lengths = torch.where(ends, steps[pairs.squeeze(1), end_offsets], path_lengths)
+
+        costs_prev2, costs_prev = costs_prev, costs
+        steps_prev2, steps_prev = steps_prev, steps
+
+    if normalize:
+        distances = distances / path_lengths.to(x.dtype)
+    if not return_path:
+        return distances, None
+
+    pointers = pointers.cpu().numpy()
+    starts = starts.cpu().numpy()
+    paths = []
+    for s in range(num_pairs):
+        i, j = int(x_lengths[s]) - 1, int(y_lengths[s]) - 1
+        path = np.empty((int(path_lengths[s]), 2), dtype=int)
+        for k in range(len(path) - 1, -1, -1):
+            path[k] = i, j
+            choice = pointers[s, i + j, i - starts[s, i + j]]
+            i, j = i - (choice < 2), j - (choice != 1)
+        paths.append(path)
+    return distances, paths
+
+
+def warp_splits(path, splits):
+    """
+    Frames of x aligned with given frames of y through a warp path, e.g. the starts of the gestures of a generated
+    motion given the gesture_splits of its ground truth.
+    Arguments:
+     -- path: (L, 2) numpy array of the aligned frame indices of x and y, as returned by dtw.
+     -- splits: increasing frame indices of y, where the number of frames of y maps to the number of frames of x.
+    Returns the numpy array of the first frame of x aligned with each split or a later frame of y.
+    """
+    indices = np.searchsorted(path[:, 1], splits, side='left')
+    return np.where(indices < len(path), path[np.minimum(indices, len(path) - 1), 0], path[-1, 0] + 1)
@@ -0,0 +1,164 @@
+import collections
+import hashlib
+import numpy as np
+import os
+import torch
+
+
+def hash_state_dict(model):
+    """
+    Digest of the names and values of the parameters and buffers of a model, quantized ones included,
+    to identify its weights, e.g. as the namespace of an EncoderCache.
+    """
+    digest = hashlib.sha1()
+
+    def update(value):
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu()
+            if value.is_quantized:
+                update(value.int_repr())
+                if value.qscheme() in [torch.per_tensor_affine, torch.per_tensor_symmetric]:
+                    digest.update('{} {}'.format(value.q_scale(), value.q_zero_point()).encode())
+                else:
+                    update(value.q_per_channel_scales())
+                    update(value.q_per_channel_zero_points())
+                return
+            digest.update('{} {}'.format(value.dtype, tuple(value.shape)).encode())
+            digest.update(value.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+        elif isinstance(value, (tuple, list)):
+            for item in value:
+                update(item)
+        else:
+            digest.update(str(value).encode())
+
+    for name, value in model.state_dict().items():
+        digest.update(name.encode())
+        update(value)
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    """
+    Least recently used cache of tensors, bounded by the total number of bytes of the tensors.
+    Arguments:
+     -- max_bytes: memory budget, the least recently used tensors are evicted past it.
+     -- disk_dir: optional directory the evicted tensors are moved to, and looked up in on a memory miss.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.entries = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.pt')
+
+    def get(self, key, device=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.disk_dir is not None and os.path.isfile(self.get_disk_path(key)):
+            self.disk_hits += 1
+            value = torch.load(self.get_disk_path(key), map_location=device)
+            self.put(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key).nbytes
+        self.entries[key] = value
+        self.num_bytes += value.nbytes
+        while self.num_bytes > self.max_bytes and len(self.entries) > 0:
+            evicted_key, evicted_value = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_value.nbytes
+            if self.disk_dir is not None and not os.path.isfile(self.get_disk_path(evicted_key)):
+                torch.save(evicted_value.cpu(), self.get_disk_path(evicted_key))
+
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+        if self.disk_dir is not None:
+            for file_name in os.listdir(self.disk_dir):
+                if file_name.endswith('.pt'):
+                    os.remove(os.path.join(self.disk_dir, file_name))
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.num_bytes,
+                'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+
+
+class EncoderCache(object):
+    """
+    Two-level cache of the T2GNet text encoder outputs, used in eval mode.
+    The first level is keyed by the token ids and stores the transformer encoder outputs, the second level is also
+    keyed by the conditioning tags and stores the latents after text_embed, so that a text repeated with new tags
+    only runs text_embed. Since T2GNet adds one positional encoding per sample of the batch, the position of the
+    sample in the batch is part of both keys, and so is the batch size, which the rounding of the encoder depends on.
+    Arguments:
+     -- max_bytes: memory budget of each level.
+     -- disk_dir: optional directory of the on-disk tier, with one subdirectory per level.
+     -- namespace: identifier of the model weights, e.g. their hash_state_dict, so that the on-disk entries of
+        other weights are never used.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, namespace=''):
+        self.namespace = namespace
+        self.encoder_outputs = LRUCache(max_bytes, None if disk_dir is None else os.path.join(disk_dir, 'encoder'))
+        self.latents = LRUCache(max_bytes, None if disk_dir is None else os.path.join(disk_dir, 'latent'))
+
+    def get_key(self, *arrays):
+        key = hashlib.sha1(self.namespace.encode())
+        for array in arrays:
+            key.update(str(array.dtype).encode())
+            key.update(array.tobytes())
+        return key.hexdigest()
+
+    def __call__(self, model, text, conditioning):
+        """
+        Same as the encoder part of T2GNet.forward, text_latent = model.embed_conditioning(
+        model.encode_tokens(text), conditioning), reading the samples that are cached.
+        The missing samples are computed at the size of the batch, whose matrix products may round differently
+        from those of a smaller batch, so the latents are identical to those of the uncached forward.
+        Arguments (where B = batch size, S = text length):
+         -- model: T2GNet in eval mode.
+         -- text: (B, S) tensor of the token ids.
+         -- conditioning: (B, K) tensor of the concatenated tags.
+        Returns the (S, B, E) text latent.
+        """
+        text_np = text.cpu().numpy()
+        conditioning_np = conditioning.cpu().numpy()
+        batch_size = np.array(len(text_np))
+        token_keys = [self.get_key(batch_size, np.array(s), text_np[s]) for s in range(len(text_np))]
+        latent_keys = [self.get_key(batch_size, np.array(s), text_np[s], conditioning_np[s])
+                       for s in range(len(text_np))]
+        latents = [self.latents.get(k, text.device) for k in latent_keys]
+        missing = [s for s, latent in enumerate(latents) if latent is None]
+        if len(missing) > 0:
+            encoder_outputs = [self.encoder_outputs.get(token_keys[s], text.device) for s in range(len(text_np))]
+            to_encode = [s for s, encoder_output in enumerate(encoder_outputs) if encoder_output is None]
+            if len(to_encode) > 0:
+                encoded = model.encode_tokens(text)
+                for s in to_encode:
+                    self.encoder_outputs.put(token_keys[s], encoded[:, s].clone())
+                    encoder_outputs[s] = encoded[:, s]
+            embedded = model.embed_conditioning(torch.stack(encoder_outputs, dim=1), conditioning)
+            for s in missing:
+                self.latents.put(latent_keys[s], embedded[:, s].clone())
+                latents[s] = embedded[:, s]
+        return torch.stack(latents, dim=1)
+
+    def clear(self):
+        self.encoder_outputs.clear()
+        self.latents.clear()
+
+    def stats(self):
+        return {'encoder': self.encoder_outputs.stats(), 'latent': self.latents.stats()}
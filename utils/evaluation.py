@@ -0,0 +1,245 @@
+import numpy as np
+import os
+import scipy.spatial.distance as sp_distance
+import torch
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor
+from utils.mocap_dataset import MocapDataset
+
+
+def iterate_npz_chunks(file_name, key, chunk_size):
+    """
+    Stream an array stored in an npz archive along its first axis, without loading the whole array.
+    Arguments:
+     -- file_name: path to the (possibly compressed) npz archive.
+     -- key: name of the array inside the archive.
+     -- chunk_size: number of rows per chunk.
+    Yields the consecutive chunks as numpy arrays.
+    """
+    with zipfile.ZipFile(file_name) as archive, archive.open(key + '.npy') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran_order or dtype.hasobject:
+            raise ValueError('Only C-ordered numeric arrays can be streamed, {} in {} is not.'.format(key, file_name))
+        row_shape = shape[1:]
+        row_bytes = int(np.prod(row_shape, dtype=np.int64)) * dtype.itemsize
+        for start in range(0, shape[0], chunk_size):
+            num_rows = min(chunk_size, shape[0] - start)
+            yield np.frombuffer(f.read(num_rows * row_bytes), dtype=dtype).reshape((num_rows,) + row_shape)
+
+
+def get_angle_errors(quat_pred, quat_gt):
+    """
+    Geodesic angle between the predicted and ground-truth rotations, insensitive to the quaternion sign.
+    Arguments:
+     -- quat_pred, quat_gt: (..., 4) arrays of unit quaternions.
+    Returns the (...) array of angles in radians.
+    """
+    return 2. * np.arccos(np.clip(np.abs(np.sum(quat_pred * quat_gt, axis=-1)), 0., 1.))
+
+
+def get_masked_moments(values, masks):
+    """
+    Per-joint count, sum and sum of squares of the masked values.
+    Arguments (where N = number of sequences, T = sequence length, J = number of joints):
+     -- values: (N, T, J) array.
+     -- masks: (N, T) boolean array of the frames to count.
+    """
+    values = values[masks]
+    return {'count': len(values), 'sum': np.sum(values, axis=0), 'sum_sq': np.sum(values ** 2, axis=0)}
+
+
+def get_motion_statistics(positions, masks):
+    """
+    Speed and jerk moments of each joint, in units per frame.
+    Arguments (where N = number of sequences, T = sequence length, J = number of joints):
+     -- positions: (N, T, J, 3) array of joint positions.
+     -- masks: (N, T) boolean array of the valid frames, which must form a prefix of each sequence.
+    """
+    speeds = np.linalg.norm(positions[:, 1:] - positions[:, :-1], axis=-1)
+    jerks = np.linalg.norm(positions[:, 3:] - 3. * positions[:, 2:-1] + 3. * positions[:, 1:-2] - positions[:, :-3],
+                           axis=-1)
+    return {'speed': get_masked_moments(speeds, masks[:, 1:]),
+            'jerk': get_masked_moments(jerks, masks[:, 3:])}
+
+
+def get_descriptors(values, masks):
+    """
+    Per-sequence mean and standard deviation of the valid frames, used for the diversity metrics.
+    Arguments (where N = number of sequences, T = sequence length):
+     -- values: (N, T, ...) array.
+     -- masks: (N, T) boolean array of the valid frames.
+    Returns an (N, K) array.
+    """
+    values = values.reshape(values.shape[0], values.shape[1], -1)
+    weights = masks[..., None] / np.maximum(np.sum(masks, axis=1), 1)[:, None, None]
+    means = np.sum(values * weights, axis=1)
+    stds = np.sqrt(np.maximum(np.sum(values ** 2 * weights, axis=1) - means ** 2, 0.))
+    return np.concatenate((means, stds), axis=-1)
+
+
+def get_chunk_statistics(quat_pred, quat_gt, lengths, labels=None, parents=None, offsets=None):
+    """
+    Additive statistics of a chunk of predicted and ground-truth motions, all sequences being processed together.
+    Arguments (where N = number of sequences, T = sequence length, J = number of joints):
+     -- quat_pred, quat_gt: (N, T, J * 4) arrays of the local joint rotations.
+     -- lengths: (N) array of the number of valid frames of each sequence.
+     -- labels: optional (N) array of the emotion of each sequence, for the affective features.
+     -- parents: optional (J) array of the joint parents, needed for all the positional metrics.
+     -- offsets: optional (J, 3) array of the joint offsets, needed for all the positional metrics.
+    Returns a dict of statistics that can be combined with merge_statistics.
+    """
+    num_sequences, num_frames = quat_pred.shape[:2]
+    quat_pred = quat_pred.reshape(num_sequences, num_frames, -1, 4).astype(np.float64)
+    quat_gt = quat_gt.reshape(num_sequences, num_frames, -1, 4).astype(np.float64)
+    quat_pred /= np.maximum(np.linalg.norm(quat_pred, axis=-1, keepdims=True), 1e-8)
+    quat_gt /= np.maximum(np.linalg.norm(quat_gt, axis=-1, keepdims=True), 1e-8)
+    masks = np.arange(num_frames)[None] < np.asarray(lengths)[:, None]
+
+    statistics = {'sequences': num_sequences,
+                  'angle_error': get_masked_moments(get_angle_errors(quat_pred, quat_gt), masks)}
+
+    if parents is None or offsets is None:
+        statistics['descriptors'] = {'pred': [get_descriptors(quat_pred, masks)],
+                                     'gt': [get_descriptors(quat_gt, masks)]}
+        return statistics
+
+    root_positions = torch.zeros(num_sequences, num_frames, 3, dtype=torch.float64)
+    offsets = torch.from_numpy(np.asarray(offsets, dtype=np.float64)).view(1, 1, -1, 3)
+    pos_pred = MocapDataset.forward_kinematics(torch.from_numpy(quat_pred), root_positions,
+                                               parents, offsets).numpy()
+    pos_gt = MocapDataset.forward_kinematics(torch.from_numpy(quat_gt), root_positions,
+                                             parents, offsets).numpy()
+    statistics['position_error'] = get_masked_moments(np.linalg.norm(pos_pred - pos_gt, axis=-1), masks)
+    statistics['motion'] = {'pred': get_motion_statistics(pos_pred, masks),
+                            'gt': get_motion_statistics(pos_gt, masks)}
+    statistics['descriptors'] = {'pred': [get_descriptors(pos_pred, masks)],
+                                 'gt': [get_descriptors(pos_gt, masks)]}
+
+    # the affective features are defined on the 23 joints of the MPI skeleton
+    if pos_pred.shape[2] == 23:
+        labels = np.full(num_sequences, 'all') if labels is None else np.asarray(labels)
+        affs_pred = MocapDataset.get_mpi_affective_features(pos_pred)
+        affs_gt = MocapDataset.get_mpi_affective_features(pos_gt)
+        statistics['affective_features'] = {}
+        for label in np.unique(labels):
+            label_masks = masks & (labels == label)[:, None]
+            statistics['affective_features'][str(label)] = {'pred': get_masked_moments(affs_pred, label_masks),
+                                                            'gt': get_masked_moments(affs_gt, label_masks)}
+    return statistics
+
+
+def merge_statistics(statistics, other):
+    """
+    Combine the statistics of two chunks: counts and sums add up, descriptor lists are concatenated.
+    """
+    if statistics is None:
+        return other
+    merged = dict(statistics)
+    for k, v in other.items():
+        if k not in merged:
+            merged[k] = v
+        elif isinstance(v, dict):
+            merged[k] = merge_statistics(merged[k], v)
+        else:
+            merged[k] = merged[k] + v
+    return merged
+
+
+def get_moments_report(moments, names=None):
+    count = max(moments['count'], 1)
+    means = moments['sum'] / count
+    stds = np.sqrt(np.maximum(moments['sum_sq'] / count - means ** 2, 0.))
+    report = {'mean': float(np.sum(moments['sum']) / (count * len(means))),
+              'per_joint_mean': means.tolist(),
+              'per_joint_std': stds.tolist()}
+    if names is not None:
+        report['joints'] = list(names)
+    return report
+
+
+def get_report(statistics, joint_names=None):
+    """
+    Machine-readable report of the merged statistics. Angles are in radians, positions in the skeleton units,
+    speeds and jerks per frame.
+    """
+    report = {'sequences': statistics['sequences'],
+              'frames': statistics['angle_error']['count'],
+              'angle_error': get_moments_report(statistics['angle_error'], joint_names)}
+    if 'position_error' in statistics.keys():
+        report['position_error'] = get_moments_report(statistics['position_error'], joint_names)
+        for metric in ['speed', 'jerk']:
+            report[metric] = {source: get_moments_report(statistics['motion'][source][metric], joint_names)
+                              for source in ['pred', 'gt']}
+    if 'affective_features' in statistics.keys():
+        report['affective_features'] = {}
+        for label, moments in statistics['affective_features'].items():
+            report['affective_features'][label] = {}
+            for source in ['pred', 'gt']:
+                source_report = get_moments_report(moments[source])
+                report['affective_features'][label][source] = {'frames': moments[source]['count'],
+                                                               'mean': source_report['per_joint_mean'],
+                                                               'std': source_report['per_joint_std']}
+    # mean pairwise distance between the sequence descriptors
+    report['diversity'] = {}
+    for source in ['pred', 'gt']:
+        descriptors = np.concatenate(statistics['descriptors'][source], axis=0)
+        report['diversity'][source] = float(np.mean(sp_distance.pdist(descriptors))) \
+            if len(descriptors) > 1 else 0.
+    return report
+
+
+def init_worker():
+    # the chunks are already processed in parallel, avoid oversubscribing the cores
+    torch.set_num_threads(1)
+
+
+def evaluate_archives(pred_file, gt_file, lengths_file, labels_file=None, parents=None, offsets=None,
+                      joint_names=None, chunk_size=8, num_workers=None):
+    """
+    Evaluate saved predictions against the ground truth, streaming the archives in chunks processed in a pool.
+    Arguments:
+     -- pred_file, gt_file: npz archives with the (N, T, J * 4) 'quat' arrays, e.g. quat_pred.npz and quat_gt.npz.
+     -- lengths_file: npz archive with the 'lengths' array of the valid frames, e.g. gesture_lengths.npz.
+        Only the first N lengths are used.
+     -- labels_file: optional npz archive with the (N) 'labels' array of the emotion of each sequence.
+     -- parents, offsets, joint_names: optional skeleton, needed for all the positional metrics.
+     -- chunk_size: number of sequences per chunk.
+     -- num_workers: number of worker processes, 0 to evaluate in this process.
+    Returns the report of get_report.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    lengths = np.load(lengths_file)['lengths']
+    labels = None if labels_file is None else np.load(labels_file, allow_pickle=True)['labels']
+
+    def chunks():
+        start = 0
+        for quat_pred, quat_gt in zip(iterate_npz_chunks(pred_file, 'quat', chunk_size),
+                                      iterate_npz_chunks(gt_file, 'quat', chunk_size)):
+            stop = start + len(quat_pred)
+            if stop > len(lengths):
+                raise ValueError('{} has fewer lengths than the {} sequences.'.format(lengths_file, stop))
+            yield quat_pred, quat_gt, np.minimum(lengths[start:stop], quat_pred.shape[1]),\
+                None if labels is None else labels[start:stop], parents, offsets
+            start = stop
+
+    statistics = None
+    if num_workers == 0:
+        for chunk in chunks():
+            statistics = merge_statistics(statistics, get_chunk_statistics(*chunk))
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=init_worker) as executor:
+            # keep a bounded number of chunks in flight so the archives are never fully in memory
+            pending = []
+            for chunk in chunks():
+                pending.append(executor.submit(get_chunk_statistics, *chunk))
+                if len(pending) >= 2 * num_workers:
+                    statistics = merge_statistics(statistics, pending.pop(0).result())
+            for future in pending:
+                statistics = merge_statistics(statistics, future.result())
+    return get_report(statistics, joint_names)
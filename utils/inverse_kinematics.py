@@ -0,0 +1,134 @@
+import numpy as np
+import torch
+
+from utils.mocap_dataset import MocapDataset
+from utils.Quaternions_torch import expmap_to_quaternion, qmul, qrot
+
+
+def get_descendants(parents):
+    """
+    (J, J) boolean numpy array whose entry [j, k] is True when joint k is a strict descendant of joint j.
+    """
+    num_joints = len(parents)
+    descendants = np.zeros((num_joints, num_joints), dtype=bool)
+    for k in range(num_joints):
+        j = parents[k]
+        while j != -1:
+            descendants[j, k] = True
+            j = parents[j]
+    return descendants
+
+
+def get_foot_contacts(positions, feet, velocity_threshold):
+    """
+    Detect the frames where the feet are planted, i.e. move slower than the threshold.
+    Arguments (where N = batch size, L = sequence length, J = number of joints, F = number of feet joints):
+     -- positions: (N, L, J, 3) tensor of joint positions.
+     -- feet: list of F joint indices.
+     -- velocity_threshold: scalar or (N, 1, 1) tensor of the maximum displacement per frame of a planted foot.
+    Returns an (N, L, F) boolean tensor.
+    """
+    feet_positions = positions[:, :, feet]
+    speeds = torch.norm(feet_positions[:, 1:] - feet_positions[:, :-1], dim=-1)
+    speeds = torch.cat((speeds[:, :1], speeds), dim=1)
+    return speeds < velocity_threshold
+
+
+def get_contact_targets(positions, contacts):
+    """
+    Pin each foot at the position it had at the first frame of each of its contacts.
+    Arguments (where N = batch size, L = sequence length, F = number of feet joints):
+     -- positions: (N, L, F, 3) tensor of the feet positions.
+     -- contacts: (N, L, F) boolean tensor of the frames with the feet planted.
+    Returns an (N, L, F, 3) tensor of the targets, only meaningful where contacts is True.
+    """
+    frames = torch.arange(contacts.shape[1], device=contacts.device).view(1, -1, 1)
+    starts = contacts & ~torch.cat((torch.zeros_like(contacts[:, :1]), contacts[:, :-1]), dim=1)
+    start_frames, _ = torch.cummax(torch.where(starts, frames, torch.zeros_like(frames)), dim=1)
+    return torch.gather(positions, 1, start_frames.unsqueeze(-1).expand(positions.shape))
+
+
+class JacobianInverseKinematics:
+    """
+    Damped least squares inverse kinematics over the local joint rotations of a batch of motions.
+    All the frames of all the samples are solved together: each iteration runs one batched forward kinematics
+    pass, builds the Jacobians of the constrained joints analytically and solves the damped normal equations of
+    every frame with one batched Cholesky factorization, whose size only depends on the number of constraints.
+
+    Parameters
+    ----------
+    parents : (J) numpy array of the parent of each joint
+    iterations : number of Gauss-Newton iterations
+    damping : damping constant, higher values stay closer to the input motion
+    weights : optional (J) array of how freely each joint may rotate, 0 keeps a joint fixed.
+              Defaults to 1 for all the joints except the root, whose orientation is kept.
+    """
+
+    def __init__(self, parents, iterations=10, damping=0.1, weights=None):
+        self.parents = parents
+        self.iterations = iterations
+        self.damping = damping
+        self.descendants = get_descendants(parents)
+        if weights is None:
+            weights = np.ones(len(parents))
+            weights[np.asarray(parents) == -1] = 0.
+        # joints without descendants have no effect on any position
+        self.weights = np.asarray(weights, dtype=float) * np.any(self.descendants, axis=1)
+
+    def __call__(self, rotations, root_positions, offsets, targets, masks=None):
+        """
+        Arguments (where N = batch size, L = sequence length, J = number of joints):
+         -- rotations: (N, L, J, 4) tensor of the local joint rotations.
+         -- root_positions: (N, L, 3) tensor of the root positions.
+         -- offsets: joint offsets in any shape accepted by MocapDataset.forward_kinematics.
+         -- targets: {joint: (N, L, 3) tensor} of target positions, e.g. planted feet or hand targets.
+         -- masks: optional {joint: (N, L) boolean tensor} of the frames in which each target applies.
+        Returns the (N, L, J, 4) tensor of the solved local rotations.
+        """
+        num_samples, num_frames, num_joints = rotations.shape[:3]
+        effectors = list(targets.keys())
+        target_positions = torch.stack([targets[e] for e in effectors], dim=2)
+        if masks is None:
+            target_masks = torch.ones(target_positions.shape[:3], device=rotations.device, dtype=rotations.dtype)
+        else:
+            target_masks = torch.stack([masks[e].to(rotations.dtype) if e in masks.keys()
+                                        else torch.ones(target_positions.shape[:2], device=rotations.device,
+                                                        dtype=rotations.dtype)
+                                        for e in effectors], dim=2)
+
+        # (E, J) joints moving each effector, scaled by the joint weights
+        joint_scales = torch.from_numpy(self.descendants[:, effectors].T * self.weights).to(
+            rotations.device, rotations.dtype)
+        movable = np.nonzero(self.weights)[0]
+        joint_scales = joint_scales[:, movable]
+        axes = torch.eye(3, device=rotations.device, dtype=rotations.dtype)
+        eye = torch.eye(3 * len(effectors), device=rotations.device, dtype=rotations.dtype)
+
+        rotations = rotations.clone()
+        for _ in range(self.iterations):
+            positions, rotations_world = MocapDataset.forward_kinematics(rotations, root_positions, self.parents,
+                                                                         offsets, return_rotations=True)
+            rotations_world = torch.stack([rotations_world[j] for j in movable], dim=2)
+            # world axes of the local rotation updates of each movable joint: (N, L, M, 3 axes, 3)
+            world_axes = qrot(rotations_world.unsqueeze(-2).expand(-1, -1, -1, 3, -1).contiguous(),
+                              axes.expand(num_samples, num_frames, len(movable), 3, 3).contiguous())
+            # lever arms from each movable joint to each effector: (N, L, E, M, 3)
+            levers = positions[:, :, effectors].unsqueeze(3) - positions[:, :, movable].unsqueeze(2)
+            jacobian = torch.cross(world_axes.unsqueeze(2).expand(-1, -1, len(effectors), -1, -1, -1),
+                                   levers.unsqueeze(4).expand(-1, -1, -1, -1, 3, -1), dim=-1)
+            # (N, L, E, 3, M, 3) with the constraint rows first, masked and scaled
+            jacobian = jacobian.permute(0, 1, 2, 5, 3, 4) * \
+                (joint_scales.view(1, 1, len(effectors), 1, len(movable), 1) *
+                 target_masks.view(num_samples, num_frames, len(effectors), 1, 1, 1))
+            jacobian = jacobian.reshape(num_samples * num_frames, 3 * len(effectors), 3 * len(movable))
+            errors = ((target_positions - positions[:, :, effectors]) * target_masks.unsqueeze(-1)).reshape(
+                num_samples * num_frames, 3 * len(effectors), 1)
+
+            # minimize |J d - e|^2 + damping^2 |d|^2 through the smaller system (J J^T + damping^2 I) y = e
+            system = torch.bmm(jacobian, jacobian.transpose(1, 2)) + (self.damping ** 2) * eye
+            updates = torch.bmm(jacobian.transpose(1, 2), torch.cholesky_solve(errors, torch.linalg.cholesky(system)))
+            updates = updates.view(num_samples, num_frames, len(movable), 3) * \
+                joint_scales.new_tensor(self.weights[movable]).view(1, 1, -1, 1)
+            rotations[:, :, movable] = qmul(rotations[:, :, movable].contiguous(),
+                                            expmap_to_quaternion(updates.contiguous()))
+        return rotations / torch.norm(rotations, dim=-1, keepdim=True)
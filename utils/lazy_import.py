@@ -0,0 +1,38 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder of a module that is imported when one of its attributes is first used.
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+            # later accesses go straight to the module
+            self.__dict__.update(self._module.__dict__)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """
+    Defer the import of a module to its first use, so that the scripts start without paying for the heavy or
+    optional dependencies they do not use. The module is imported directly if it has already been imported.
+    Arguments:
+     -- name: full name of the module, e.g. 'matplotlib.pyplot'.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -1,39 +1,59 @@
 # sys
+import collections.abc
+import functools
 import glob
 import numpy as np
 import os
-import pyttsx3
+import torch
 
 import utils.constant as constant
 
-from nltk.stem.porter import PorterStemmer
-from scipy.io import wavfile
-from tqdm import tqdm
-
+from utils.artifact_cache import ArtifactCache, load_npz, save_npz
+from utils.lazy_import import lazy_import
 from utils.mocap_dataset import MocapDataset
+from utils.Quaternions import Quaternions
+from utils.Quaternions_torch import qfix
+
+# only needed to process the raw data, which is done once
+porter = lazy_import('nltk.stem.porter')
+pyttsx3 = lazy_import('pyttsx3')
+tqdm = lazy_import('tqdm')
+wavfile = lazy_import('scipy.io.wavfile')
 
 
 nrc_vad_lexicon_file = '../data/NRC-VAD-Lexicon-Aug2018Release/NRC-VAD-Lexicon.txt'
-nrc_vad_lexicon = {}
-with open(nrc_vad_lexicon_file, 'r') as nf:
-    heading = nf.readline()
-    lines = nf.readlines()
-    for line in lines:
-        line_split = line.split('\t')
-        lexeme = line_split[0]
-        v = float(line_split[1])
-        a = float(line_split[2])
-        d = float(line_split[3].split('\n')[0])
-        nrc_vad_lexicon[lexeme] = np.array([v, a, d])
-porter_stemmer = PorterStemmer()
 
 
-tts_engine = pyttsx3.init()
+@functools.lru_cache(maxsize=None)
+def get_nrc_vad_lexicon():
+    nrc_vad_lexicon = {}
+    with open(nrc_vad_lexicon_file, 'r') as nf:
+        heading = nf.readline()
+        lines = nf.readlines()
+        for line in lines:
+            line_split = line.split('\t')
+            lexeme = line_split[0]
+            v = float(line_split[1])
+            a = float(line_split[2])
+            d = float(line_split[3].split('\n')[0])
+            nrc_vad_lexicon[lexeme] = np.array([v, a, d])
+    return nrc_vad_lexicon
+
+
+@functools.lru_cache(maxsize=None)
+def get_porter_stemmer():
+    return porter.PorterStemmer()
+
+
+@functools.lru_cache(maxsize=None)
+def get_tts_engine():
+    return pyttsx3.init()
 
 
 def get_vad(lexeme_raw):
+    nrc_vad_lexicon = get_nrc_vad_lexicon()
     lexeme_lower = lexeme_raw.lower()
-    lexeme_stemmed = porter_stemmer.stem(lexeme_lower)
+    lexeme_stemmed = get_porter_stemmer().stem(lexeme_lower)
     if lexeme_lower in nrc_vad_lexicon.keys():
         return nrc_vad_lexicon[lexeme_lower]
     if lexeme_stemmed in nrc_vad_lexicon.keys():
@@ -42,6 +62,7 @@ def get_vad(lexeme_raw):
 
 
 def record_and_load_audio(audio_file, text, rate, trimmed=False):
+    tts_engine = get_tts_engine()
     tts_engine.setProperty('rate', rate)
     tts_engine.save_to_file(text, audio_file)
     tts_engine.runAndWait()
@@ -87,6 +108,10 @@ def get_gesture_splits(sentence, words, num_frames, fps):
 
 
 def split_data_dict(data_dict, eval_size=0.1, randomized=True, fill=1):
+    if isinstance(data_dict, ResampledDataDict):
+        # split the full rate samples, so that every sample is still only resampled when it is first read
+        return tuple(ResampledDataDict(d, data_dict.frame_drop)
+                     for d in split_data_dict(data_dict.data_dict, eval_size, randomized, fill))
     num_samples = len(data_dict)
     num_samples_valid = int(round(eval_size * num_samples))
     samples_all = np.array(list(data_dict.keys()), dtype=int)
@@ -112,131 +137,247 @@ def to_one_hot(categorical_value, categories):
     return one_hot_array
 
 
+def get_num_resampled_frames(num_frames, frame_drop):
+    return int(np.floor((num_frames - 1) / frame_drop + 1e-9)) + 1
+
+
+def resample_sample(sample, frame_drop):
+    """
+    A sample of a full frame rate data dict at one frame every frame_drop frames. An integer frame_drop keeps
+    every frame_drop-th frame, as views of the full rate arrays. Otherwise, the rotations are interpolated by
+    slerp and the root positions linearly, and the joint positions and the affective features are recomputed.
+    The gesture splits are rescaled to the new frame rate.
+    """
+    if frame_drop == 1:
+        return sample
+    resampled = dict(sample)
+    if float(frame_drop).is_integer():
+        frame_drop = int(frame_drop)
+        for key in ['positions', 'rotations', 'affective_features']:
+            resampled[key] = sample[key][::frame_drop]
+    else:
+        num_frames = len(sample['positions'])
+        times = np.arange(get_num_resampled_frames(num_frames, frame_drop)) * frame_drop
+        previous_frames = np.minimum(np.floor(times).astype(int), num_frames - 1)
+        next_frames = np.minimum(previous_frames + 1, num_frames - 1)
+        weights = (times - previous_frames)[:, np.newaxis]
+        rotations = Quaternions.slerp(Quaternions(sample['rotations'][previous_frames]),
+                                      Quaternions(sample['rotations'][next_frames]), weights).qs
+        resampled['rotations'] = qfix(torch.from_numpy(rotations)).numpy()
+        root_positions = (1. - weights) * sample['positions'][previous_frames, 0] + \
+            weights * sample['positions'][next_frames, 0]
+        # as computed by MocapDataset.load_bvh
+        joints_dict = sample['joints_dict']
+        resampled['positions'] = MocapDataset.forward_kinematics(
+            torch.from_numpy(resampled['rotations']).float().unsqueeze(0),
+            torch.from_numpy(root_positions).float().unsqueeze(0), joints_dict['joints_parents'],
+            torch.from_numpy(joints_dict['joints_offsets_all']).float()).squeeze(0).numpy()
+        resampled['affective_features'] = MocapDataset.get_mpi_affective_features(resampled['positions'])
+    if 'gesture_splits' in sample:
+        # the first resampled frame at or after every split, as in get_num_resampled_frames
+        resampled['gesture_splits'] = [int(np.ceil(split / frame_drop - 1e-9)) for split in sample['gesture_splits']]
+    return resampled
+
+
+class ResampledDataDict(collections.abc.Mapping):
+    """
+    Read-only view of a full frame rate data dict at one frame every frame_drop frames, frame_drop being any
+    positive number, lower than 1 to upsample. Every sample is resampled when it is first read, see
+    resample_sample, so that changing the frame rate does not need to ingest the data again.
+    """
+
+    def __init__(self, data_dict, frame_drop=1):
+        if frame_drop <= 0:
+            raise ValueError('The frame drop must be positive, got {}.'.format(frame_drop))
+        self.data_dict = data_dict
+        self.frame_drop = frame_drop
+        self.resampled = dict()
+
+    def __getitem__(self, key):
+        if key not in self.resampled:
+            self.resampled[key] = resample_sample(self.data_dict[key], self.frame_drop)
+        return self.resampled[key]
+
+    def __iter__(self):
+        return iter(self.data_dict)
+
+    def __len__(self):
+        return len(self.data_dict)
+
+    @property
+    def max_time_steps(self):
+        return max([get_num_resampled_frames(len(sample['positions']), self.frame_drop)
+                    for sample in self.data_dict.values()], default=0)
+
+
+def get_data_files(data_path, *other_files):
+    """
+    The raw files the data dicts are ingested from, whose sizes and modification times key their cached versions.
+    """
+    data_files = [os.path.join(data_path, 'tag_names.txt')] + \
+        sorted(glob.glob(os.path.join(data_path, 'tags/*.txt'))) + \
+        sorted(glob.glob(os.path.join(data_path, 'bvh/*.bvh'))) + list(other_files)
+    return [f for f in data_files if os.path.isfile(f)]
+
+
+def get_legacy_data_dict_files(data_path, prefix):
+    """
+    The data dict saved by the earlier versions for a frame drop of 1, which holds the data at the full frame rate,
+    as a list of at most one file.
+    """
+    legacy_file = os.path.join(data_path, prefix + 'drop_1.npz')
+    return [legacy_file] if os.path.isfile(legacy_file) else []
+
+
+def save_data_dict(content, file_name):
+    # the categories of the tags have different lengths, they are saved as an array of lists
+    tag_categories = np.empty(len(content['tag_categories']), dtype=object)
+    for category, categories in enumerate(content['tag_categories']):
+        tag_categories[category] = categories
+    save_npz(dict(content, tag_categories=tag_categories), file_name)
+
+
 def load_data(_path, dataset, frame_drop=1, add_mirrored=False):
+    """
+    Load the data at one frame every frame_drop frames. The data is ingested and cached once at the full frame
+    rate of the captures, and resampled on the fly, see ResampledDataDict.
+    """
+    data_dict, tag_categories, max_text_length, _ = load_full_rate_data(_path, dataset)
+    data_dict = ResampledDataDict(data_dict, frame_drop)
+    return data_dict, tag_categories, max_text_length, data_dict.max_time_steps
+
+
+def load_full_rate_data(_path, dataset):
+    """
+    Load the data at the full frame rate of the captures, ingested once for every version of the raw data and of
+    the code ingesting it, see ArtifactCache.
+    """
     data_path = os.path.join(_path, dataset)
-    data_dict_file = os.path.join(data_path, 'data_dict_drop_' + str(frame_drop) + '.npz')
-    try:
-        data_dict = np.load(data_dict_file, allow_pickle=True)['data_dict'].item()
-        tag_categories = list(np.load(data_dict_file, allow_pickle=True)['tag_categories'])
-        max_text_length = np.load(data_dict_file, allow_pickle=True)['max_text_length'].item()
-        max_time_steps = np.load(data_dict_file, allow_pickle=True)['max_time_steps'].item()
-        print('Data file found. Returning data.')
-    except FileNotFoundError:
-        data_dict = []
-        tag_categories = []
-        max_text_length = 0.
-        max_time_steps = 0.
-        if dataset == 'mpi':
-            channel_map = {
-                'Xrotation': 'x',
-                'Yrotation': 'y',
-                'Zrotation': 'z'
-            }
-            data_dict = dict()
-            tag_names = []
-            with open(os.path.join(data_path, 'tag_names.txt')) as names_file:
-                for line in names_file.readlines():
+    # the data dict of data_dict_drop_1.npz is imported once instead of ingesting the data again, and is part of the
+    # key, as the legacy quats_sos_and_eos.npz of the processor
+    legacy_files = get_legacy_data_dict_files(data_path, 'data_dict_')
+    content = ArtifactCache(os.path.join(_path, 'cache')).get(
+        'data_dict_' + dataset,
+        lambda: load_npz(legacy_files[0]) if len(legacy_files) > 0 else ingest_full_rate_data(data_path, dataset),
+        save=save_data_dict, input_files=get_data_files(data_path, nrc_vad_lexicon_file, *legacy_files),
+        code=[ingest_full_rate_data, get_nrc_vad_lexicon, get_vad, get_gesture_splits, to_one_hot,
+              MocapDataset.load_bvh, MocapDataset.get_mpi_affective_features])
+    return content['data_dict'], [list(c) for c in content['tag_categories']],\
+        np.asarray(content['max_text_length']).item(), np.asarray(content['max_time_steps']).item()
+
+
+def ingest_full_rate_data(data_path, dataset):
+    data_dict = dict()
+    tag_categories = []
+    max_text_length = 0.
+    max_time_steps = 0.
+    if dataset == 'mpi':
+        channel_map = {
+            'Xrotation': 'x',
+            'Yrotation': 'y',
+            'Zrotation': 'z'
+        }
+        data_dict = dict()
+        tag_names = []
+        with open(os.path.join(data_path, 'tag_names.txt')) as names_file:
+            for line in names_file.readlines():
+                line = line[:-1]
+                tag_names.append(line)
+        id = tag_names.index('ID')
+        relevant_tags = ['Intended emotion', 'Intended polarity',
+                         'Perceived category', 'Perceived polarity',
+                         'Acting task', 'Gender', 'Age', 'Handedness', 'Native tongue', 'Text']
+        tag_categories = [[] for _ in range(len(relevant_tags) - 1)]
+        tag_files = glob.glob(os.path.join(data_path, 'tags/*.txt'))
+        num_files = len(tag_files)
+        for tag_file in tag_files:
+            tag_data = []
+            with open(tag_file) as f:
+                for line in f.readlines():
                     line = line[:-1]
-                    tag_names.append(line)
-            id = tag_names.index('ID')
-            relevant_tags = ['Intended emotion', 'Intended polarity',
-                             'Perceived category', 'Perceived polarity',
-                             'Acting task', 'Gender', 'Age', 'Handedness', 'Native tongue', 'Text']
-            tag_categories = [[] for _ in range(len(relevant_tags) - 1)]
-            tag_files = glob.glob(os.path.join(data_path, 'tags/*.txt'))
-            num_files = len(tag_files)
-            for tag_file in tag_files:
-                tag_data = []
-                with open(tag_file) as f:
-                    for line in f.readlines():
-                        line = line[:-1]
-                        tag_data.append(line)
-                for category in range(len(tag_categories)):
-                    tag_to_append = relevant_tags[category]
-                    if tag_data[tag_names.index(tag_to_append)] not in tag_categories[category]:
-                        tag_categories[category].append(tag_data[tag_names.index(tag_to_append)])
-
-            for data_counter, tag_file in enumerate(tag_files):
-                tag_data = []
-                with open(tag_file) as f:
-                    for line in f.readlines():
-                        line = line[:-1]
-                        tag_data.append(line)
-                bvh_file = os.path.join(data_path, 'bvh/' + tag_data[id] + '.bvh')
-                names, parents, offsets,\
-                    positions, rotations, base_fps = MocapDataset.load_bvh(bvh_file, channel_map)
-                positions_down_sampled = positions[1::frame_drop]
-                rotations_down_sampled = rotations[1::frame_drop]
-                if len(positions_down_sampled) > max_time_steps:
-                    max_time_steps = len(positions_down_sampled)
-                joints_dict = dict()
-                joints_dict['joints_to_model'] = np.arange(len(parents))
-                joints_dict['joints_parents_all'] = parents
-                joints_dict['joints_parents'] = parents
-                joints_dict['joints_names_all'] = names
-                joints_dict['joints_names'] = names
-                joints_dict['joints_offsets_all'] = offsets
-                joints_dict['joints_left'] = [idx for idx, name in enumerate(names) if 'left' in name.lower()]
-                joints_dict['joints_right'] = [idx for idx, name in enumerate(names) if 'right' in name.lower()]
-                data_dict[tag_data[id]] = dict()
-                data_dict[tag_data[id]]['joints_dict'] = joints_dict
-                data_dict[tag_data[id]]['positions'] = positions_down_sampled
-                data_dict[tag_data[id]]['rotations'] = rotations_down_sampled
-                data_dict[tag_data[id]]['affective_features'] =\
-                    MocapDataset.get_mpi_affective_features(positions_down_sampled)
-                for tag_index, tag_name in enumerate(relevant_tags):
-                    if tag_name.lower() == 'text':
-                        data_dict[tag_data[id]][tag_name] =\
-                            tag_data[tag_names.index(tag_name)].replace(' s ', '\'s ').replace(' t ', '\'t ')
-                        text_vad = []
-                        words = data_dict[tag_data[id]][tag_name].split(' ')
-                        for lexeme in words:
-                            if lexeme.isalpha():
-                                if len(lexeme) == 1 and not (lexeme.lower() is 'a' or lexeme.lower() is 'i'):
-                                    continue
-                                text_vad.append(get_vad(lexeme))
-                        try:
-                            data_dict[tag_data[id]][tag_name + ' VAD'] = np.stack(text_vad)
-                            data_dict[tag_data[id]]['best_tts_rate'],\
-                                data_dict[tag_data[id]]['gesture_splits'] =\
-                                get_gesture_splits(data_dict[tag_data[id]][tag_name], words,
-                                                   len(data_dict[tag_data[id]]['positions']),
-                                                   base_fps / frame_drop)
-                        except ValueError:
-                            data_dict[tag_data[id]][tag_name + ' VAD'] = np.zeros((0, 3))
-                        text_length = len(data_dict[tag_data[id]][tag_name])
-                        if text_length > max_text_length:
-                            max_text_length = text_length
-                        continue
-                    if tag_name.lower() == 'age':
-                        data_dict[tag_data[id]][tag_name] = float(tag_data[tag_names.index(tag_name)]) / 100.
-                        continue
-                    if tag_name is 'Perceived category':
-                        categories = tag_categories[0]
-                    elif tag_name is 'Perceived polarity':
-                        categories = tag_categories[1]
-                    else:
-                        categories = tag_categories[tag_index]
-                    data_dict[tag_data[id]][tag_name] = to_one_hot(tag_data[tag_names.index(tag_name)], categories)
-                    if tag_name is 'Intended emotion' or tag_name is 'Perceived category':
-                        data_dict[tag_data[id]][tag_name + ' VAD'] = get_vad(tag_data[tag_names.index(tag_name)])
-                print('\rData file not found. Processing file {}/{}: {:3.2f}%'.format(
-                    data_counter + 1, num_files, data_counter * 100. / num_files), end='')
-            print('\rData file not found. Processing files: done. Saving...', end='')
-            np.savez_compressed(data_dict_file,
-                                data_dict=data_dict,
-                                tag_categories=tag_categories,
-                                max_text_length=max_text_length,
-                                max_time_steps=max_time_steps)
-            print('done. Returning data.')
-        elif dataset == 'creative_it':
-            mocap_data_dirs = os.listdir(os.path.join(data_path, 'mocap'))
-            for mocap_dir in mocap_data_dirs:
-                mocap_data_files = glob.glob(os.path.join(data_path, 'mocap/' + mocap_dir + '/*.txt'))
-        else:
-            raise FileNotFoundError('Dataset not found.')
-
-    return data_dict, tag_categories, max_text_length, max_time_steps
+                    tag_data.append(line)
+            for category in range(len(tag_categories)):
+                tag_to_append = relevant_tags[category]
+                if tag_data[tag_names.index(tag_to_append)] not in tag_categories[category]:
+                    tag_categories[category].append(tag_data[tag_names.index(tag_to_append)])
+
+        for data_counter, tag_file in enumerate(tag_files):
+            tag_data = []
+            with open(tag_file) as f:
+                for line in f.readlines():
+                    line = line[:-1]
+                    tag_data.append(line)
+            bvh_file = os.path.join(data_path, 'bvh/' + tag_data[id] + '.bvh')
+            names, parents, offsets,\
+                positions, rotations, base_fps = MocapDataset.load_bvh(bvh_file, channel_map)
+            # the first frame is the rest pose
+            positions = positions[1:]
+            rotations = rotations[1:]
+            if len(positions) > max_time_steps:
+                max_time_steps = len(positions)
+            joints_dict = dict()
+            joints_dict['joints_to_model'] = np.arange(len(parents))
+            joints_dict['joints_parents_all'] = parents
+            joints_dict['joints_parents'] = parents
+            joints_dict['joints_names_all'] = names
+            joints_dict['joints_names'] = names
+            joints_dict['joints_offsets_all'] = offsets
+            joints_dict['joints_left'] = [idx for idx, name in enumerate(names) if 'left' in name.lower()]
+            joints_dict['joints_right'] = [idx for idx, name in enumerate(names) if 'right' in name.lower()]
+            data_dict[tag_data[id]] = dict()
+            data_dict[tag_data[id]]['joints_dict'] = joints_dict
+            data_dict[tag_data[id]]['positions'] = positions
+            data_dict[tag_data[id]]['rotations'] = rotations
+            data_dict[tag_data[id]]['affective_features'] =\
+                MocapDataset.get_mpi_affective_features(positions)
+            for tag_index, tag_name in enumerate(relevant_tags):
+                if tag_name.lower() == 'text':
+                    data_dict[tag_data[id]][tag_name] =\
+                        tag_data[tag_names.index(tag_name)].replace(' s ', '\'s ').replace(' t ', '\'t ')
+                    text_vad = []
+                    words = data_dict[tag_data[id]][tag_name].split(' ')
+                    for lexeme in words:
+                        if lexeme.isalpha():
+                            if len(lexeme) == 1 and not (lexeme.lower() is 'a' or lexeme.lower() is 'i'):
+                                continue
+                            text_vad.append(get_vad(lexeme))
+                    try:
+                        data_dict[tag_data[id]][tag_name + ' VAD'] = np.stack(text_vad)
+                        data_dict[tag_data[id]]['best_tts_rate'],\
+                            data_dict[tag_data[id]]['gesture_splits'] =\
+                            get_gesture_splits(data_dict[tag_data[id]][tag_name], words,
+                                               len(data_dict[tag_data[id]]['positions']), base_fps)
+                    except ValueError:
+                        data_dict[tag_data[id]][tag_name + ' VAD'] = np.zeros((0, 3))
+                    text_length = len(data_dict[tag_data[id]][tag_name])
+                    if text_length > max_text_length:
+                        max_text_length = text_length
+                    continue
+                if tag_name.lower() == 'age':
+                    data_dict[tag_data[id]][tag_name] = float(tag_data[tag_names.index(tag_name)]) / 100.
+                    continue
+                if tag_name is 'Perceived category':
+                    categories = tag_categories[0]
+                elif tag_name is 'Perceived polarity':
+                    categories = tag_categories[1]
+                else:
+                    categories = tag_categories[tag_index]
+                data_dict[tag_data[id]][tag_name] = to_one_hot(tag_data[tag_names.index(tag_name)], categories)
+                if tag_name is 'Intended emotion' or tag_name is 'Perceived category':
+                    data_dict[tag_data[id]][tag_name + ' VAD'] = get_vad(tag_data[tag_names.index(tag_name)])
+            print('\rProcessing file {}/{}: {:3.2f}%'.format(
+                data_counter + 1, num_files, data_counter * 100. / num_files), end='')
+        print('\rProcessing files: done.')
+    elif dataset == 'creative_it':
+        mocap_data_dirs = os.listdir(os.path.join(data_path, 'mocap'))
+        for mocap_dir in mocap_data_dirs:
+            mocap_data_files = glob.glob(os.path.join(data_path, 'mocap/' + mocap_dir + '/*.txt'))
+    else:
+        raise FileNotFoundError('Dataset not found.')
+
+
+    return dict(data_dict=data_dict, tag_categories=tag_categories,
+                max_text_length=max_text_length, max_time_steps=max_time_steps)
 
 
 def build_vocab_idx(word_instants, min_word_count):
@@ -279,7 +420,7 @@ def build_embedding_table(embedding_path, target_vocab):
         _word2idx = dict()
         _idx2word = dict()
         with open(_embedding_path, 'r') as f:
-            for l in tqdm(f):
+            for l in tqdm.tqdm(f):
                 line = l.split()
                 word = line[0]
                 w_vec = np.array(line[1:]).astype(np.float)
@@ -305,115 +446,128 @@ def build_embedding_table(embedding_path, target_vocab):
 
 
 def load_data_with_glove(_path, dataset, embedding_src, frame_drop=1, add_mirrored=False):
+    """
+    Same as load_data, with the GloVe embeddings of the words of the texts.
+    """
+    data_dict, word2idx, embedding_table, tag_categories, _ = load_full_rate_data_with_glove(_path, dataset,
+                                                                                           embedding_src)
+    data_dict = ResampledDataDict(data_dict, frame_drop)
+    return data_dict, word2idx, embedding_table, tag_categories, data_dict.max_time_steps
+
+
+def load_full_rate_data_with_glove(_path, dataset, embedding_src):
+    """
+    Same as load_full_rate_data, with the GloVe embeddings of the words of the texts.
+    """
     data_path = os.path.join(_path, dataset)
-    data_dict_file = os.path.join(data_path, 'data_dict_glove_drop_' + str(frame_drop) + '.npz')
-    try:
-        data_dict = np.load(data_dict_file, allow_pickle=True)['data_dict'].item()
-        word2idx = np.load(data_dict_file, allow_pickle=True)['word2idx'].item()
-        embedding_table = np.load(data_dict_file, allow_pickle=True)['embedding_table']
-        tag_categories = list(np.load(data_dict_file, allow_pickle=True)['tag_categories'])
-        max_time_steps = np.load(data_dict_file, allow_pickle=True)['max_time_steps'].item()
-        print('Data file found. Returning data.')
-    except FileNotFoundError:
-        data_dict = []
-        word2idx = []
-        embedding_table = []
-        tag_categories = []
-        max_time_steps = 0.
-        if dataset == 'mpi':
-            channel_map = {
-                'Xrotation': 'x',
-                'Yrotation': 'y',
-                'Zrotation': 'z'
-            }
-            data_dict = dict()
-            tag_names = []
-            with open(os.path.join(data_path, 'tag_names.txt')) as names_file:
-                for line in names_file.readlines():
+    legacy_files = get_legacy_data_dict_files(data_path, 'data_dict_glove_')
+    content = ArtifactCache(os.path.join(_path, 'cache')).get(
+        'data_dict_glove_' + dataset,
+        lambda: load_npz(legacy_files[0]) if len(legacy_files) > 0 else
+        ingest_full_rate_data_with_glove(data_path, dataset, embedding_src),
+        save=save_data_dict, input_files=get_data_files(data_path, embedding_src, *legacy_files),
+        code=[ingest_full_rate_data_with_glove, build_vocab_idx, build_embedding_table, to_one_hot,
+              MocapDataset.load_bvh, MocapDataset.get_mpi_affective_features])
+    return content['data_dict'], content['word2idx'], np.asarray(content['embedding_table']),\
+        [list(c) for c in content['tag_categories']], np.asarray(content['max_time_steps']).item()
+
+
+def ingest_full_rate_data_with_glove(data_path, dataset, embedding_src):
+    data_dict = dict()
+    word2idx = []
+    embedding_table = []
+    tag_categories = []
+    max_time_steps = 0.
+    if dataset == 'mpi':
+        channel_map = {
+            'Xrotation': 'x',
+            'Yrotation': 'y',
+            'Zrotation': 'z'
+        }
+        data_dict = dict()
+        tag_names = []
+        with open(os.path.join(data_path, 'tag_names.txt')) as names_file:
+            for line in names_file.readlines():
+                line = line[:-1]
+                tag_names.append(line)
+        id = tag_names.index('ID')
+        relevant_tags = ['Intended emotion', 'Intended polarity',
+                         'Perceived category', 'Perceived polarity',
+                         'Acting task', 'Gender', 'Age', 'Handedness', 'Native tongue', 'Text']
+        tag_categories = [[] for _ in range(len(relevant_tags) - 1)]
+        tag_files = glob.glob(os.path.join(data_path, 'tags/*.txt'))
+        num_files = len(tag_files)
+        for tag_file in tag_files:
+            tag_data = []
+            with open(tag_file) as f:
+                for line in f.readlines():
                     line = line[:-1]
-                    tag_names.append(line)
-            id = tag_names.index('ID')
-            relevant_tags = ['Intended emotion', 'Intended polarity',
-                             'Perceived category', 'Perceived polarity',
-                             'Acting task', 'Gender', 'Age', 'Handedness', 'Native tongue', 'Text']
-            tag_categories = [[] for _ in range(len(relevant_tags) - 1)]
-            tag_files = glob.glob(os.path.join(data_path, 'tags/*.txt'))
-            num_files = len(tag_files)
-            for tag_file in tag_files:
-                tag_data = []
-                with open(tag_file) as f:
-                    for line in f.readlines():
-                        line = line[:-1]
-                        tag_data.append(line)
-                for category in range(len(tag_categories)):
-                    tag_to_append = relevant_tags[category]
-                    if tag_data[tag_names.index(tag_to_append)] not in tag_categories[category]:
-                        tag_categories[category].append(tag_data[tag_names.index(tag_to_append)])
-
-            all_texts = [[] for _ in range(len(tag_files))]
-            for data_counter, tag_file in enumerate(tag_files):
-                tag_data = []
-                with open(tag_file) as f:
-                    for line in f.readlines():
-                        line = line[:-1]
-                        tag_data.append(line)
-                bvh_file = os.path.join(data_path, 'bvh/' + tag_data[id] + '.bvh')
-                names, parents, offsets,\
-                positions, rotations = MocapDataset.load_bvh(bvh_file, channel_map)
-                positions_down_sampled = positions[1::frame_drop]
-                rotations_down_sampled = rotations[1::frame_drop]
-                if len(positions_down_sampled) > max_time_steps:
-                    max_time_steps = len(positions_down_sampled)
-                joints_dict = dict()
-                joints_dict['joints_to_model'] = np.arange(len(parents))
-                joints_dict['joints_parents_all'] = parents
-                joints_dict['joints_parents'] = parents
-                joints_dict['joints_names_all'] = names
-                joints_dict['joints_names'] = names
-                joints_dict['joints_offsets_all'] = offsets
-                joints_dict['joints_left'] = [idx for idx, name in enumerate(names) if 'left' in name.lower()]
-                joints_dict['joints_right'] = [idx for idx, name in enumerate(names) if 'right' in name.lower()]
-                data_dict[tag_data[id]] = dict()
-                data_dict[tag_data[id]]['joints_dict'] = joints_dict
-                data_dict[tag_data[id]]['positions'] = positions_down_sampled
-                data_dict[tag_data[id]]['rotations'] = rotations_down_sampled
-                data_dict[tag_data[id]]['affective_features'] =\
-                    MocapDataset.get_mpi_affective_features(positions_down_sampled)
-                for tag_index, tag_name in enumerate(relevant_tags):
-                    if tag_name.lower() == 'text':
-                        all_texts[data_counter] = [e for e in str.split(tag_data[tag_names.index(tag_name)]) if
-                                                   e.isalnum()]
-                        data_dict[tag_data[id]][tag_name] = tag_data[tag_names.index(tag_name)]
-                        text_length = len(data_dict[tag_data[id]][tag_name])
-                        continue
-                    if tag_name.lower() == 'age':
-                        data_dict[tag_data[id]][tag_name] = float(tag_data[tag_names.index(tag_name)]) / 100.
-                        continue
-                    if tag_name is 'Perceived category':
-                        categories = tag_categories[0]
-                    elif tag_name is 'Perceived polarity':
-                        categories = tag_categories[1]
-                    else:
-                        categories = tag_categories[tag_index]
-                    data_dict[tag_data[id]][tag_name] = to_one_hot(tag_data[tag_names.index(tag_name)], categories)
-                print('\rData file not found. Reading data files {}/{}: {:3.2f}%'.format(
-                    data_counter + 1, num_files, data_counter * 100. / num_files), end='')
-            print('\rData file not found. Reading files: done.')
-            print('Preparing embedding table:')
-            word2idx = build_vocab_idx(all_texts, min_word_count=0)
-            embedding_table = build_embedding_table(embedding_src, word2idx)
-            np.savez_compressed(data_dict_file,
-                                data_dict=data_dict,
-                                word2idx=word2idx,
-                                embedding_table=embedding_table,
-                                tag_categories=tag_categories,
-                                max_time_steps=max_time_steps)
-            print('done. Returning data.')
-        elif dataset == 'creative_it':
-            mocap_data_dirs = os.listdir(os.path.join(data_path, 'mocap'))
-            for mocap_dir in mocap_data_dirs:
-                mocap_data_files = glob.glob(os.path.join(data_path, 'mocap/' + mocap_dir + '/*.txt'))
-        else:
-            raise FileNotFoundError('Dataset not found.')
-
-    return data_dict, word2idx, embedding_table, tag_categories, max_time_steps
+                    tag_data.append(line)
+            for category in range(len(tag_categories)):
+                tag_to_append = relevant_tags[category]
+                if tag_data[tag_names.index(tag_to_append)] not in tag_categories[category]:
+                    tag_categories[category].append(tag_data[tag_names.index(tag_to_append)])
+
+        all_texts = [[] for _ in range(len(tag_files))]
+        for data_counter, tag_file in enumerate(tag_files):
+            tag_data = []
+            with open(tag_file) as f:
+                for line in f.readlines():
+                    line = line[:-1]
+                    tag_data.append(line)
+            bvh_file = os.path.join(data_path, 'bvh/' + tag_data[id] + '.bvh')
+            names, parents, offsets,\
+            positions, rotations, _ = MocapDataset.load_bvh(bvh_file, channel_map)
+            # the first frame is the rest pose
+            positions = positions[1:]
+            rotations = rotations[1:]
+            if len(positions) > max_time_steps:
+                max_time_steps = len(positions)
+            joints_dict = dict()
+            joints_dict['joints_to_model'] = np.arange(len(parents))
+            joints_dict['joints_parents_all'] = parents
+            joints_dict['joints_parents'] = parents
+            joints_dict['joints_names_all'] = names
+            joints_dict['joints_names'] = names
+            joints_dict['joints_offsets_all'] = offsets
+            joints_dict['joints_left'] = [idx for idx, name in enumerate(names) if 'left' in name.lower()]
+            joints_dict['joints_right'] = [idx for idx, name in enumerate(names) if 'right' in name.lower()]
+            data_dict[tag_data[id]] = dict()
+            data_dict[tag_data[id]]['joints_dict'] = joints_dict
+            data_dict[tag_data[id]]['positions'] = positions
+            data_dict[tag_data[id]]['rotations'] = rotations
+            data_dict[tag_data[id]]['affective_features'] =\
+                MocapDataset.get_mpi_affective_features(positions)
+            for tag_index, tag_name in enumerate(relevant_tags):
+                if tag_name.lower() == 'text':
+                    all_texts[data_counter] = [e for e in str.split(tag_data[tag_names.index(tag_name)]) if
+                                               e.isalnum()]
+                    data_dict[tag_data[id]][tag_name] = tag_data[tag_names.index(tag_name)]
+                    text_length = len(data_dict[tag_data[id]][tag_name])
+                    continue
+                if tag_name.lower() == 'age':
+                    data_dict[tag_data[id]][tag_name] = float(tag_data[tag_names.index(tag_name)]) / 100.
+                    continue
+                if tag_name is 'Perceived category':
+                    categories = tag_categories[0]
+                elif tag_name is 'Perceived polarity':
+                    categories = tag_categories[1]
+                else:
+                    categories = tag_categories[tag_index]
+                data_dict[tag_data[id]][tag_name] = to_one_hot(tag_data[tag_names.index(tag_name)], categories)
+            print('\rReading data files {}/{}: {:3.2f}%'.format(
+                data_counter + 1, num_files, data_counter * 100. / num_files), end='')
+        print('\rReading files: done.')
+        print('Preparing embedding table:')
+        word2idx = build_vocab_idx(all_texts, min_word_count=0)
+        embedding_table = build_embedding_table(embedding_src, word2idx)
+    elif dataset == 'creative_it':
+        mocap_data_dirs = os.listdir(os.path.join(data_path, 'mocap'))
+        for mocap_dir in mocap_data_dirs:
+            mocap_data_files = glob.glob(os.path.join(data_path, 'mocap/' + mocap_dir + '/*.txt'))
+    else:
+        raise FileNotFoundError('Dataset not found.')
+
+
+    return dict(data_dict=data_dict, word2idx=word2idx, embedding_table=embedding_table,
+                tag_categories=tag_categories, max_time_steps=max_time_steps)
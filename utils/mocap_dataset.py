@@ -12,7 +12,7 @@ import utils.common as common
 
 from utils.Quaternions import Quaternions
 from utils.Quaternions_torch import *
-from utils.spline import Spline
+from utils.spline import Footstep_Stream, Spline, Spline_AS_Stream
 
 
 class MocapDataset:
@@ -129,7 +129,7 @@ class MocapDataset:
         return np.isin(joint, joint_parents)
 
     @staticmethod
-    def forward_kinematics(rotations, root_positions, parents, offsets):
+    def forward_kinematics(rotations, root_positions, parents, offsets, return_rotations=False):
         """
         Perform forward kinematics using the given trajectory and local rotations.
         Arguments (where N = batch size, L = sequence length, J = number of joints):
@@ -137,6 +137,8 @@ class MocapDataset:
          -- root_positions: (N, L, 3) tensor describing the root joint positions.
          -- parents: (J) numpy array where each element i contains the parent of joint i.
          -- offsets: (N, J, 3) tensor containing the offset of each joint in the batch.
+         -- return_rotations: also return the list of (N, L, 4) world rotations of the joints,
+            None for the terminal joints.
         """
         assert len(rotations.shape) == 4
         assert rotations.shape[-1] == 4
@@ -161,11 +163,13 @@ class MocapDataset:
                     # This joint is a terminal node -> it would be useless to compute the transformation
                     rotations_world.append(None)
 
+        if return_rotations:
+            return torch.stack(positions_world, dim=3).permute(0, 1, 3, 2), rotations_world
         return torch.stack(positions_world, dim=3).permute(0, 1, 3, 2)
 
     @staticmethod
     def load_bvh(file_name, channel_map=None,
-                 start=None, end=None, order=None, world=False):
+                 start=None, end=None, order=None, world=False, device='cpu'):
         '''
         Reads a BVH file and constructs an animation
 
@@ -193,6 +197,9 @@ class MocapDataset:
             together in world space rather than local
             space
 
+        device : str or torch.device
+            Device on which to run the forward kinematics
+
         Returns
         -------
 
@@ -315,10 +322,11 @@ class MocapDataset:
         f.close()
 
         rotations = qfix(Quaternions.from_euler(np.radians(rotations), order=order, world=world).qs)
-        positions = MocapDataset.forward_kinematics(torch.from_numpy(rotations).cuda().float().unsqueeze(0),
-                                                    torch.from_numpy(positions[:, 0]).cuda().float().unsqueeze(0),
+        positions = MocapDataset.forward_kinematics(torch.from_numpy(rotations).to(device).float().unsqueeze(0),
+                                                    torch.from_numpy(positions[:, 0]).to(device).float().unsqueeze(0),
                                                     parents,
-                                                    torch.from_numpy(offsets).cuda().float()).squeeze().cpu().numpy()
+                                                    torch.from_numpy(offsets).to(device).float())
+        positions = positions.squeeze().cpu().numpy()
         orientations, _ = Quaternions(rotations[:, 0]).angle_axis()
         return names, parents, offsets, positions, rotations, 1. / frame_time
 
@@ -441,18 +449,16 @@ class MocapDataset:
                     for j in range(num_joints * 3):
                         string += ' ' + '{:.6f}'.format(0)
                     f.write(string + '\n')
+                # convert all the frames and joints of the sample at once
+                eulers = np.degrees(Quaternions(save_quats[s, :num_frames[s]]).euler(order='xyz').astype(np.float64))
                 for t in range(num_frames[s]):
                     string = str(trajectory[t, 0]) + ' ' + \
                              str(trajectory[t, 1]) + ' ' + \
                              str(trajectory[t, 2])
-                    for j in range(num_joints):
-                        eulers = np.degrees(Quaternions(save_quats[s, t, j]).euler(order='xyz'))[0]
-                        string += ' ' + '{:.6f}'.format(eulers[0]) + \
-                                  ' ' + '{:.6f}'.format(eulers[1]) + \
-                                  ' ' + '{:.6f}'.format(eulers[2])
+                    string += ''.join(' {:.6f}'.format(e) for e in eulers[t].ravel())
                     f.write(string + '\n')
 
-    def get_positions_and_transformations(self, raw_data, mirrored=False):
+    def get_positions_and_transformations(self, raw_data, mirrored=False, save_bvh=False):
         data = np.swapaxes(np.squeeze(raw_data), -1, 0)
         if data.shape[-1] == 73:
             positions, root_x, root_z, root_r = data[:, 3:-7], data[:, -7], data[:, -6], data[:, -5]
@@ -483,53 +489,32 @@ class MocapDataset:
             positions_local[:, self.joints_left], positions_local[:, self.joints_right] = \
             positions_local[:, self.joints_right], positions_local[:, self.joints_left]
             positions_local[:, :, [0, 2]] = -positions_local[:, :, [0, 2]]
-        positions_world = np.zeros_like(positions_local)
-        num_joints = positions_world.shape[1]
-
-        trajectory = np.empty((num_frames, 3))
-        orientations = np.empty(num_frames)
-        rotations = np.zeros((num_frames, num_joints - 1, 4))
-        cum_rotations = np.zeros((num_frames, 4))
-        rotations_euler = np.zeros((num_frames, num_joints - 1, 3))
-        cum_rotations_euler = np.zeros((num_frames, 3))
+        num_joints = positions_local.shape[1]
+
+        # the root only rotates about the y-axis, so the cumulative rotations follow from the cumulative angles
+        orientations = -root_r
+        cum_rotations = Quaternions.from_angle_axis(np.cumsum(orientations), np.array([0, 1, 0])).qs
+        cum_rotations_euler = Quaternions(cum_rotations).euler('yzx')
+        offsets = Quaternions(cum_rotations[:, np.newaxis]) * np.tile([0, 0, 1], (num_frames, 1, 1))
         translations = np.zeros((num_frames, num_joints, 3))
-        cum_translations = np.zeros((num_frames, 3))
-        offsets = []
-        limbs_all = []
-
-        for t in range(num_frames):
-            positions_world[t, :, :] = (Quaternions(cum_rotations[t - 1]) if t > 0 else Quaternions.id(1)) * \
-                                       positions_local[t]
-            positions_world[t, :, 0] = positions_world[t, :, 0] + (cum_translations[t - 1, 0] if t > 0 else 0)
-            positions_world[t, :, 2] = positions_world[t, :, 2] + (cum_translations[t - 1, 2] if t > 0 else 0)
-            trajectory[t] = positions_world[t, 0]
-            # if t > 0:
-            #     rotations[t, 1:] = Quaternions.between(positions_world[t - 1, 1:], positions_world[t, 1:]).qs
-            # else:
-            #     rotations[t, 1:] = Quaternions.id(positions_world.shape[1] - 1).qs
-            limbs = positions_world[t, 1:] - positions_world[t, self.joint_parents[1:]]
-            rotations[t] = Quaternions.between(self.joint_offsets[1:], limbs)
-            limbs_all.append(limbs)
-            # limb_recons = Quaternions(rotations[t, 1:]) * self._offsets[1:]
-            # test_limbs = np.setdiff1d(np.arange(20), [12, 16])
-            # if np.max(np.abs(limb_recons[test_limbs] - limbs[test_limbs])) > 1e-6:
-            #     temp = 1
-            rotations_euler[t] = Quaternions(rotations[t]).euler('yzx')
-            orientations[t] = -root_r[t]
-            # rotations[t, 0] = Quaternions.from_angle_axis(-root_r[t], np.array([0, 1, 0])).qs
-            # rotations_euler[t, 0] = Quaternions(rotations[t, 0]).euler('yzx')
-            cum_rotations[t] = (Quaternions.from_angle_axis(orientations[t], np.array([0, 1, 0])) *
-                                (Quaternions(cum_rotations[t - 1]) if t > 0 else Quaternions.id(1))).qs
-            # cum_rotations[t] = (Quaternions(rotations[t, 0]) *
-            #                     (Quaternions(cum_rotations[t - 1]) if t > 0 else Quaternions.id(1))).qs
-            cum_rotations_euler[t] = Quaternions(cum_rotations[t]).euler('yzx')
-            offsets.append(Quaternions(cum_rotations[t]) * np.array([0, 0, 1]))
-            translations[t, 0] = Quaternions(cum_rotations[t]) * np.array([root_x[t], 0, root_z[t]])
-            cum_translations[t] = (cum_translations[t - 1] if t > 0 else np.zeros((1, 3))) + translations[t, 0]
-        # limb_lengths =
-        limbs_all = np.stack(limbs_all)
-        self.save_as_bvh(np.expand_dims(positions_world[:, 0], 0), np.expand_dims(orientations.reshape(-1, 1), 0),
-                         np.expand_dims(rotations, 0), dataset_name='edin', subset_name='test')
+        translations[:, 0] = Quaternions(cum_rotations) * np.stack((root_x, np.zeros_like(root_x), root_z), axis=-1)
+        cum_translations = np.cumsum(translations[:, 0], axis=0)
+
+        # each frame is placed by the cumulative rotation and translation up to the previous frame
+        prev_cum_rotations = np.concatenate((Quaternions.id(1).qs, cum_rotations[:-1]), axis=0)
+        prev_cum_translations = np.concatenate((np.zeros((1, 3)), cum_translations[:-1]), axis=0)
+        positions_world = Quaternions(prev_cum_rotations[:, np.newaxis]) * positions_local
+        positions_world[..., [0, 2]] += prev_cum_translations[:, np.newaxis, [0, 2]]
+        trajectory = positions_world[:, 0].copy()
+
+        limbs = positions_world[:, 1:] - positions_world[:, self.joint_parents[1:]]
+        # between only handles flat arrays of vectors
+        rotations = Quaternions.between(np.tile(self.joint_offsets[1:], (num_frames, 1)),
+                                        limbs.reshape(-1, 3)).qs.reshape(num_frames, num_joints - 1, 4)
+        rotations_euler = Quaternions(rotations).euler('yzx')
+        if save_bvh:
+            self.save_as_bvh(np.expand_dims(positions_world[:, 0], 0), np.expand_dims(orientations.reshape(-1, 1), 0),
+                             np.expand_dims(rotations, 0), dataset_name='edin', subset_name='test')
         return positions_local, positions_world, trajectory, orientations, rotations, rotations_euler, \
                translations, cum_rotations, cum_rotations_euler, cum_translations, offsets
 
@@ -712,14 +697,17 @@ class MocapDataset:
 
         affs_dim = 15
 
-        if type(data).__module__ != np.__name__:
-            data_np = data.detach().cpu().numpy()
-        else:
-            data_np = data
+        # tensors stay on their device, so that no transfer to the host is needed, and are detached
+        # like the numpy computation was
+        if torch.is_tensor(data):
+            data = data.detach()
         _0, _1, _2, _3, _4, _5, _6, _7, _8, _9, _10, _11, _12,\
-        _13, _14, _15, _16, _17, _18, _19, _20, _21, _22 = MocapDataset.get_mpi_joints(data_np)
+        _13, _14, _15, _16, _17, _18, _19, _20, _21, _22 = MocapDataset.get_mpi_joints(data)
 
-        affective_features = np.zeros(data_np.shape[:-2] + (affs_dim,))
+        if torch.is_tensor(data):
+            affective_features = data.new_zeros(data.shape[:-2] + (affs_dim,))
+        else:
+            affective_features = np.zeros(data.shape[:-2] + (affs_dim,))
         fidx = 0
         affective_features[..., fidx] = common.angle_between_points(_0, _2, _6) / np.pi
         fidx += 1
@@ -752,58 +740,64 @@ class MocapDataset:
         affective_features[..., fidx] = common.area_of_triangle(_4, _10, _0) / common.area_of_triangle(_4, _14, _0)
         fidx += 1
 
-        affective_features = np.nan_to_num(affective_features)
-        if type(data).__module__ != np.__name__:
-            affective_features = torch.from_numpy(affective_features).cuda()
-        return affective_features
+        if torch.is_tensor(affective_features):
+            return torch.nan_to_num(affective_features)
+        return np.nan_to_num(affective_features)
 
     @staticmethod
     def build_speed_and_phase_track(positions_world):
         """
         Detect foot steps and extract a control signal that describes the current state of the walking cycle.
         This is based on the assumption that the speed of a foot is almost zero during a contact.
+        positions_world is either a single (T, V, 3) sequence or a (N, T, V, 3) batch of sequences,
+        whose phases are computed together once the steps of every sequence are found.
         """
         lf = 4  # Left foot index
         rf = 8  # Right foot index
-        l_speed = np.linalg.norm(np.diff(positions_world[:, lf], axis=0), axis=1)
-        r_speed = np.linalg.norm(np.diff(positions_world[:, rf], axis=0), axis=1)
-        root_speed = np.linalg.norm(np.diff(positions_world[:, 0], axis=0), axis=1)
-        displacements = np.cumsum(root_speed)
+        batch = positions_world.reshape((-1,) + positions_world.shape[-3:])
+        l_speed = np.linalg.norm(np.diff(batch[:, :, lf], axis=1), axis=-1)
+        r_speed = np.linalg.norm(np.diff(batch[:, :, rf], axis=1), axis=-1)
+        root_speed = np.linalg.norm(np.diff(batch[:, :, 0], axis=1), axis=-1)
+        num_samples, num_speeds = l_speed.shape
+
+        steps = np.stack([MocapDataset.detect_footsteps(l_speed[s], r_speed[s]) for s in range(num_samples)])
+        start_phase = np.pi * (l_speed[:, 0] < r_speed[:, 0])
+
+        # the phase grows linearly by pi from each step to the next one and stays constant after the last step
+        indices = np.arange(num_speeds)
+        prev_step = np.maximum.accumulate(np.where(steps, indices, 0), axis=1)
+        next_step = np.minimum.accumulate(np.where(steps, indices, num_speeds)[:, ::-1], axis=1)[:, ::-1]
+        next_step = np.concatenate((next_step[:, 1:], np.full((num_samples, 1), num_speeds)), axis=1)
+        phase = start_phase[:, None] + np.pi * np.cumsum(steps, axis=1)
+        phase = np.where(next_step < num_speeds,
+                         phase + np.pi * (indices - prev_step) / (next_step - prev_step), phase)
+        last_point = (phase[:, -1] - phase[:, -2]) + phase[:, -1]
+        phase = np.concatenate((phase, last_point[:, None]), axis=1)
+        root_speed = np.concatenate((np.zeros((num_samples, 1)), root_speed), axis=1)
+        return root_speed.reshape(positions_world.shape[:-2]), phase.reshape(positions_world.shape[:-2])
+
+    @staticmethod
+    def detect_footsteps(l_speed, r_speed):
+        """
+        Frames of the (T - 1) foot speeds of one sequence at which the contact switches feet, as a boolean array.
+        Same as Footstep_Stream, which runs the state machine on tensors for streamed frames, but skipping the
+        frames of the cooldowns on plain floats, which is much faster for whole sequences.
+        """
+        epsilon = Footstep_Stream.epsilon
+        cooldown = Footstep_Stream.cooldown
+        steps = np.zeros(len(l_speed), dtype=bool)
+        l_speed = l_speed.tolist()
+        r_speed = r_speed.tolist()
         left_contact = l_speed[0] < r_speed[0]
-        epsilon = 0.1  # Hysteresis (i.e. minimum height difference before a foot switch is triggered)
-        cooldown = 3  # Minimum # of frames between steps
-        accumulator = np.pi if left_contact else 0
-        phase_points = [(0, accumulator)]
-        disp_points = [(0, displacements[0])]
         i = cooldown
         while i < len(l_speed):
-            if left_contact and l_speed[i] > r_speed[i] + epsilon:
-                left_contact = False
-                accumulator += np.pi
-                phase_points.append((i, accumulator))
-                disp_points.append((i, displacements[i] - displacements[disp_points[-1][0]]))
-                i += cooldown
-            elif not left_contact and r_speed[i] > l_speed[i] + epsilon:
-                left_contact = True
-                accumulator += np.pi
-                phase_points.append((i, accumulator))
-                disp_points.append((i, displacements[i] - displacements[disp_points[-1][0]]))
+            if (l_speed[i] > r_speed[i] + epsilon) if left_contact else (r_speed[i] > l_speed[i] + epsilon):
+                left_contact = not left_contact
+                steps[i] = True
                 i += cooldown
             else:
                 i += 1
-
-        phase = np.zeros(l_speed.shape[0])
-        end_idx = 0
-        for i in range(len(phase_points) - 1):
-            start_idx = phase_points[i][0]
-            end_idx = phase_points[i + 1][0]
-            phase[start_idx:end_idx] = np.linspace(phase_points[i][1], phase_points[i + 1][1], end_idx - start_idx,
-                                                   endpoint=False)
-        phase[end_idx:] = phase_points[-1][1]
-        last_point = (phase[-1] - phase[-2]) + phase[-1]
-        phase = np.concatenate((phase, [last_point]))
-        root_speed = np.concatenate(([0], root_speed))
-        return root_speed, phase
+        return steps
 
     @staticmethod
     def compute_translations_and_controls(data):
@@ -914,23 +908,29 @@ class MocapDataset:
         num_samples = quat_pred.shape[0]
         num_frames = quat_pred.shape[1]
         offsets = offsets.unsqueeze(1).repeat(1, num_frames, 1, 1)
-        pos_pred = torch.zeros((num_samples, num_frames, V, C)).cuda().float()
+        pos_pred = torch.zeros((num_samples, num_frames, V, C), device=quat_pred.device, dtype=quat_pred.dtype)
         for joint in range(1, V):
             pos_pred[:, :, joint] = qrot(quat_pred[:, :, joint], offsets[:, :, joint]) \
                                     + pos_pred[:, :, parents[joint]]
         return pos_pred
 
-    def get_predicted_features(self, pos_past, orient_past, traj, height, quat_pred, orient_pred):
+    def get_predicted_features(self, pos_past, orient_past, traj, height, quat_pred, orient_pred, spline_stream=None):
+        """
+        Positions, affective features and last-frame spline features of the predicted frames.
+        For autoregressive rollouts, pass the same Spline_AS_Stream at every step so that only the newly
+        predicted frames are processed; pos_past and orient_past are then already part of the stream.
+        """
         num_samples = quat_pred.shape[0]
         num_frames = quat_pred.shape[1]
-        offsets = torch.from_numpy(self.joint_offsets).cuda().float(). \
+        offsets = torch.from_numpy(self.joint_offsets).to(quat_pred.device, quat_pred.dtype). \
             unsqueeze(0).unsqueeze(0).repeat(num_samples, num_frames, 1, 1)
         quat_pred = quat_pred.view(num_samples, num_frames, self.V - 1, -1)
         zeros = torch.zeros_like(orient_pred)
         quats_world = quat_pred.clone()
         quats_world = torch.cat((expmap_to_quaternion(torch.cat((zeros, orient_pred, zeros), dim=-1)).unsqueeze(-2),
                                  quats_world), dim=-2)
-        pos_pred = torch.zeros((num_samples, num_frames, self.V, self.C)).cuda().float()
+        pos_pred = torch.zeros((num_samples, num_frames, self.V, self.C),
+                               device=quat_pred.device, dtype=quat_pred.dtype)
         pos_pred[:, :, 0, [0, 2]] = traj
         pos_pred[:, :, 0, 1] = height
 
@@ -945,18 +945,12 @@ class MocapDataset:
         for joint in range(1, self.V):
             pos_pred[:, :, joint] = qrot(quats_world[:, :, joint], offsets[:, :, joint]) \
                                     + pos_pred[:, :, self.joint_parents[joint]]
-        affs_pred = torch.tensor(MocapDataset.get_affective_features(pos_pred.detach().cpu().numpy())).cuda().float()
-        spline = []
-        for s in range(num_samples):
-            data_pred_curr = dict()
-            data_pred_curr['positions_world'] = torch.cat((pos_past[s], pos_pred[s]), dim=0).detach().cpu().numpy()
-            data_pred_curr['trajectory'] = data_pred_curr['positions_world'][:, 0]
-            data_pred_curr['orientations'] = torch.cat((orient_past[s],
-                                                        orient_pred[s]),
-                                                       dim=0).squeeze().detach().cpu().numpy()
-            data_pred_curr['trans_and_controls'] = MocapDataset.compute_translations_and_controls(data_pred_curr)
-            spline.append(Spline.extract_spline_features(MocapDataset.compute_splines(data_pred_curr))[0][-1:])
-        spline_pred = torch.from_numpy(np.stack(spline, axis=0)).cuda().float()
+        affs_pred = torch.tensor(MocapDataset.get_affective_features(pos_pred.detach().cpu().numpy())).to(
+            quat_pred.device, quat_pred.dtype)
+        if spline_stream is None:
+            spline_stream = Spline_AS_Stream(pos_past, orient_past)
+        spline_stream.append(pos_pred, orient_pred)
+        spline_pred = spline_stream.get_features().to(quat_pred.device, quat_pred.dtype)
         return pos_pred, affs_pred, spline_pred
 
     def __getitem__(self, key):
@@ -1,7 +1,6 @@
 import operator
 
 import numpy as np
-import numpy.core.umath_tests as ut
 import sys
 
 sys.path.append('utils/motion')
@@ -349,7 +348,7 @@ def transforms_multiply(t0s, t1s):
         together
     """
     
-    return ut.matrix_multiply(t0s, t1s)
+    return np.matmul(t0s, t1s)
     
 def transforms_inv(ts):
     fts = ts.reshape(-1, 4, 4)
@@ -379,15 +378,58 @@ def transforms_blank(anim):
     ts[:,:,2,2] = 1.0; ts[:,:,3,3] = 1.0;
     return ts
     
+def transforms_global_quaternions(anim):
+    """
+    Global Animation Rotations & Positions
+    
+    Chains the local rotations as quaternions
+    and the local positions as translations
+    instead of building (F, J, 4, 4) matrices.
+    The hierarchy is walked one depth level
+    at a time so all the joints of a level
+    are computed together, which also removes
+    the need for an incremental joint ordering.
+    
+    Parameters
+    ----------
+    
+    anim : Animation
+        Input animation
+    
+    Returns
+    -------
+    
+    (rotations, positions) : ((F, J) Quaternions, (F, J, 3) ndarray)
+        Global rotations and positions for
+        each frame F and joint J
+    """
+    
+    levels = AnimationStructure.levels_list(anim.parents)
+    local_rotations = anim.rotations.qs
+    rotations = np.empty(local_rotations.shape)
+    positions = np.empty(anim.positions.shape)
+    
+    roots = levels[0]
+    rotations[:,roots] = local_rotations[:,roots]
+    positions[:,roots] = anim.positions[:,roots]
+    
+    for joints in levels[1:]:
+        parents = anim.parents[joints]
+        positions[:,joints] = positions[:,parents] + Quaternions.rotate(
+            rotations[:,parents], anim.positions[:,joints])
+        rotations[:,joints] = Quaternions.multiply(
+            rotations[:,parents], local_rotations[:,joints])
+    
+    return Quaternions(rotations), positions
+    
+    
 def transforms_global(anim):
     """
     Global Animation Transforms
     
-    This relies on joint ordering
-    being incremental. That means a joint
-    J1 must not be a ancestor of J0 if
-    J0 appears before J1 in the joint
-    ordering.
+    Matrix view of the global rotations
+    and positions computed by
+    transforms_global_quaternions
     
     Parameters
     ----------
@@ -403,16 +445,12 @@ def transforms_global(anim):
         each frame F and joint J
     """
     
-    joints  = np.arange(anim.shape[1])
-    parents = np.arange(anim.shape[1])
-    locals  = transforms_local(anim)
-    globals = transforms_blank(anim)
-
-    globals[:,0] = locals[:,0]
+    rotations, positions = transforms_global_quaternions(anim)
     
-    for i in range(1, anim.shape[1]):
-        globals[:,i] = transforms_multiply(globals[:,anim.parents[i]], locals[:,i])
-        
+    globals = np.zeros(anim.shape + (4, 4))
+    globals[:,:,:3,:3] = rotations.transforms()
+    globals[:,:,:3,3] = positions
+    globals[:,:,3,3] = 1.0
     return globals
     
     
@@ -437,8 +475,7 @@ def positions_global(anim):
         and joint position J
     """
     
-    positions = transforms_global(anim)[:,:,:,3]
-    return positions[:,:,:3] / positions[:,:,3,np.newaxis]
+    return transforms_global_quaternions(anim)[1]
     
 """ Rotations """
     
@@ -446,11 +483,9 @@ def rotations_global(anim):
     """
     Global Animation Rotations
     
-    This relies on joint ordering
-    being incremental. That means a joint
-    J1 must not be a ancestor of J0 if
-    J0 appears before J1 in the joint
-    ordering.
+    The hierarchy is walked one depth
+    level at a time, see
+    transforms_global_quaternions
     
     Parameters
     ----------
@@ -466,17 +501,16 @@ def rotations_global(anim):
         and joint J
     """
 
-    joints  = np.arange(anim.shape[1])
-    parents = np.arange(anim.shape[1])
-    locals  = anim.rotations
-    globals = Quaternions.id(anim.shape)
+    levels  = AnimationStructure.levels_list(anim.parents)
+    locals  = anim.rotations.qs
+    globals = np.empty(locals.shape)
     
-    globals[:,0] = locals[:,0]
+    globals[:,levels[0]] = locals[:,levels[0]]
     
-    for i in range(1, anim.shape[1]):
-        globals[:,i] = globals[:,anim.parents[i]] * locals[:,i]
+    for joints in levels[1:]:
+        globals[:,joints] = Quaternions.multiply(globals[:,anim.parents[joints]], locals[:,joints])
         
-    return globals
+    return Quaternions(globals)
     
 def rotations_parents_global(anim):
     rotations = rotations_global(anim)
@@ -177,6 +177,35 @@ def ancestors_list(parents):
     return list(map(lambda j: np.array(joint_ancestors(j)), joints(parents)))
     
     
+def levels_list(parents):
+    """
+    Parameters
+    ----------
+    
+    parents : (J) ndarray
+        parents array
+    
+    Returns
+    -------
+    
+    levels : [ndarray]
+        List of arrays of joint indices for
+        each depth of the hierarchy, starting
+        at the roots, so that the parent of
+        every joint is in an earlier level
+    """
+    
+    parents = np.asarray(parents)
+    depths = np.zeros(len(parents), dtype=int)
+    for j in joints(parents):
+        p = parents[j]
+        while p != -1:
+            depths[j] += 1
+            p = parents[p]
+    
+    return [np.where(depths == d)[0] for d in range(depths.max() + 1)]
+    
+    
 """ Mask Functions """
 
 def mask(parents, filter):
@@ -73,9 +73,7 @@ class BasicInverseKinematics:
                 c = np.array(children[j])
                 if len(c) == 0: continue
                 
-                anim_transforms = Animation.transforms_global(self.animation)
-                anim_positions = anim_transforms[:,:,:3,3]
-                anim_rotations = Quaternions.from_transforms(anim_transforms)
+                anim_rotations, anim_positions = Animation.transforms_global_quaternions(self.animation)
                 
                 jdirs = anim_positions[:,c] - anim_positions[:,np.newaxis,j]
                 ddirs = self.positions[:,c] - anim_positions[:,np.newaxis,j]
@@ -256,7 +254,7 @@ class JacobianInverseKinematics:
         if not self.references is None:
             self.second_descendants = self.descendants.repeat(3, axis=0).astype(int)
             self.second_tdescendants = self.tdescendants.repeat(3, axis=0).astype(int)
-            self.second_targets = dict([(i, self.references[:,i]) for i in xrange(self.references.shape[1])])
+            self.second_targets = dict([(i, self.references[:,i]) for i in range(self.references.shape[1])])
         
         nf = len(self.animation)
         nj = self.animation.shape[1]
@@ -270,10 +268,7 @@ class JacobianInverseKinematics:
         for i in range(self.iterations):
 
             """ Get Global Rotations & Positions """
-            gt = Animation.transforms_global(self.animation)
-            gp = gt[:,:,:,3]
-            gp = gp[:,:,:3] / gp[:,:,3,np.newaxis]
-            gr = Quaternions.from_transforms(gt)
+            gr, gp = Animation.transforms_global_quaternions(self.animation)
             
             x = self.animation.rotations.euler().reshape(nf, -1)
             w = self.weights.repeat(3)
@@ -445,10 +440,7 @@ class ICP:
         for i in range(self.iterations):
             
             """ Get Global Rotations & Positions """
-            gt = Animation.transforms_global(self.animation)
-            gp = gt[:,:,:,3]
-            gp = gp[:,:,:3] / gp[:,:,3,np.newaxis]
-            gr = Quaternions.from_transforms(gt)
+            gr, gp = Animation.transforms_global_quaternions(self.animation)
             
             x = self.animation.rotations.euler().reshape(nf, -1)
             w = self.weights.repeat(3)
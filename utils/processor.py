@@ -1,25 +1,57 @@
+import contextlib
+import functools
+import json
 import math
-import matplotlib.pyplot as plt
 import os
+import random
+import threading
 import time
+import torch.distributed as dist
 import torch.optim as optim
 import torch.nn as nn
-import torchtext as tt
+import torch.utils.checkpoint as checkpoint
 from net.T2GNet import T2GNet as T2GNet
+from net.T2GNet_export import export_t2gnet
 
+from torchlight.torchlight.gpu import MemoryReport, SyncAudit
 from torchlight.torchlight.io import IO
-from torchtext.data.utils import get_tokenizer
 # from utils.mocap_dataset import MocapDataset
+from utils.artifact_cache import ArtifactCache, hash_arrays
+from utils.dtw import dtw
+from utils.encoder_cache import EncoderCache, hash_state_dict
+from utils.evaluation import get_angle_errors
+from utils.inverse_kinematics import JacobianInverseKinematics, get_contact_targets, get_foot_contacts
+from utils.lazy_import import lazy_import
 from utils.mocap_dataset import MocapDataset
+from utils.quantization import benchmark, quantize_model
 from utils.Quaternions import Quaternions
 from utils.visualizations import display_animations
 from utils import losses
 from utils.Quaternions_torch import *
 from utils.spline import Spline_AS, Spline
+from utils.text_processor import load_text_processor
+
+# only needed to build the text processor when it is not saved
+tt = lazy_import('torchtext')
+tt_utils = lazy_import('torchtext.data.utils')
 
 torch.manual_seed(1234)
 
 rec_loss = losses.quat_angle_loss
+resume_file_name = 'resume.pth.tar'
+# the tags fed to the model, in order, with their index in the tag categories, see fill_batch and loader.load_data
+tag_names = ['emotion', 'polarity', 'acting_task', 'gender', 'age', 'handedness', 'native_tongue']
+tag_indices = {'emotion': 0, 'polarity': 1, 'acting_task': 4, 'gender': 5, 'handedness': 7, 'native_tongue': 8}
+
+
+def build_text_processor():
+    text_processor = tt.data.Field(tokenize=tt_utils.get_tokenizer("basic_english"),
+                                   init_token='<sos>',
+                                   eos_token='<eos>',
+                                   lower=True)
+    train_text, eval_text, test_text = tt.datasets.WikiText2.splits(text_processor)
+    text_processor.build_vocab(train_text, eval_text, test_text)
+    return text_processor
 
 
 def find_all_substr(a_str, sub):
@@ -65,6 +97,37 @@ def get_epoch_and_loss(path_to_model_files, epoch='best'):
         float(found_model[all_underscores[2] + 1:all_underscores[3]])
 
 
+def detached_copy(state):
+    """
+    Recursively copy all the tensors in a (nested) state dict to the cpu, so that the copy
+    is not affected by subsequent in-place updates to the model or the optimizer.
+    """
+    if torch.is_tensor(state):
+        return state.detach().cpu().clone()
+    if isinstance(state, dict):
+        return type(state)((k, detached_copy(v)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(detached_copy(v) for v in state)
+    return state
+
+
+def get_mirror_permutation(names, pairs=()):
+    """
+    Index of the mirror image of every item, swapping left and right.
+    Arguments:
+     -- names: list of the item names, e.g. the categories of a tag, mirrored by swapping the words left and right.
+     -- pairs: optional list of (left, right) index pairs to swap, used instead of the names if given.
+    """
+    permutation = list(range(len(names)))
+    if len(pairs) == 0:
+        names = [str(name).lower() for name in names]
+        pairs = [(i, names.index(name.replace('left', 'right'))) for i, name in enumerate(names)
+                 if 'left' in name and name.replace('left', 'right') in names]
+    for left, right in pairs:
+        permutation[left], permutation[right] = right, left
+    return permutation
+
+
 class Processor(object):
     """
         Processor for emotive gesture generation
@@ -73,54 +136,72 @@ class Processor(object):
     def __init__(self, args, data_path, data_loader, Z, T, A, V, C, D, tag_cats,
                  IE, IP, AT, G, AGE, H, NT, joint_names,
                  joint_parents, lower_body_start=15, fill=6, min_train_epochs=20,
-                 generate_while_train=False, save_path=None):
+                 generate_while_train=False, save_path=None, device='cuda:0', dtype=torch.float32):
 
         def get_quats_sos_and_eos():
-            quats_sos_and_eos_file = os.path.join(data_path, 'quats_sos_and_eos.npz')
-            keys = list(self.data_loader['train'].keys())
-            num_samples = len(self.data_loader['train'])
-            try:
-                mean_quats_sos = np.load(quats_sos_and_eos_file, allow_pickle=True)['quats_sos']
-                mean_quats_eos = np.load(quats_sos_and_eos_file, allow_pickle=True)['quats_eos']
-            except FileNotFoundError:
-                mean_quats_sos = np.zeros((self.V, self.D))
-                mean_quats_eos = np.zeros((self.V, self.D))
-                for j in range(self.V):
-                    quats_sos = np.zeros((self.D, num_samples))
-                    quats_eos = np.zeros((self.D, num_samples))
-                    for s in range(num_samples):
-                        quats_sos[:, s] = self.data_loader['train'][keys[s]]['rotations'][0, j]
-                        quats_eos[:, s] = self.data_loader['train'][keys[s]]['rotations'][-1, j]
-                    _, sos_eig_vectors = np.linalg.eig(np.dot(quats_sos, quats_sos.T))
-                    mean_quats_sos[j] = sos_eig_vectors[:, 0]
-                    _, eos_eig_vectors = np.linalg.eig(np.dot(quats_eos, quats_eos.T))
-                    mean_quats_eos[j] = eos_eig_vectors[:, 0]
-                np.savez_compressed(quats_sos_and_eos_file, quats_sos=mean_quats_sos, quats_eos=mean_quats_eos)
-            mean_quats_sos = torch.from_numpy(mean_quats_sos).unsqueeze(0)
-            mean_quats_eos = torch.from_numpy(mean_quats_eos).unsqueeze(0)
-            for s in range(num_samples):
-                pos_sos = \
-                    MocapDataset.forward_kinematics(mean_quats_sos.unsqueeze(0),
-                                                    torch.from_numpy(self.data_loader['train'][keys[s]]
-                                                    ['positions'][0:1, 0]).double().unsqueeze(0),
-                                                    self.joint_parents,
-                                                    torch.from_numpy(self.data_loader['train'][keys[s]]['joints_dict']
-                                                    ['joints_offsets_all']).unsqueeze(0)).squeeze(0).numpy()
-                affs_sos = MocapDataset.get_mpi_affective_features(pos_sos)
-                pos_eos = \
-                    MocapDataset.forward_kinematics(mean_quats_eos.unsqueeze(0),
-                                                    torch.from_numpy(self.data_loader['train'][keys[s]]
-                                                    ['positions'][-1:, 0]).double().unsqueeze(0),
-                                                    self.joint_parents,
-                                                    torch.from_numpy(self.data_loader['train'][keys[s]]['joints_dict']
-                                                    ['joints_offsets_all']).unsqueeze(0)).squeeze(0).numpy()
-                affs_eos = MocapDataset.get_mpi_affective_features(pos_eos)
-                self.data_loader['train'][keys[s]]['positions'] = \
-                    np.concatenate((pos_sos, self.data_loader['train'][keys[s]]['positions'], pos_eos), axis=0)
-                self.data_loader['train'][keys[s]]['affective_features'] = \
-                    np.concatenate((affs_sos, self.data_loader['train'][keys[s]]['affective_features'], affs_eos),
-                                   axis=0)
-            return mean_quats_sos, mean_quats_eos
+            train_data = data_loader['train']
+            keys = list(train_data.keys())
+            first_quats = np.stack([train_data[k]['rotations'][0] for k in keys])
+            last_quats = np.stack([train_data[k]['rotations'][-1] for k in keys])
+            offsets = np.stack([train_data[k]['joints_dict']['joints_offsets_all'] for k in keys])
+            root_positions = np.stack([train_data[k]['positions'][[0, -1], 0] for k in keys])
+            # the pretrained models were trained with the rotations saved in quats_sos_and_eos.npz by the earlier
+            # versions, which are kept as long as the file was saved for the same training samples
+            legacy_files = []
+            legacy_file = os.path.join(data_path, 'quats_sos_and_eos.npz')
+            if os.path.isfile(legacy_file):
+                legacy = np.load(legacy_file, allow_pickle=True)
+                if legacy['quats_sos'].shape == (self.V, self.D) and \
+                        ('keys' not in legacy.files or list(legacy['keys']) == keys):
+                    legacy_files.append(legacy_file)
+
+            def build_quats_sos_and_eos():
+                sos_and_eos = dict(keys=np.array(keys))
+                if len(legacy_files) > 0:
+                    legacy = np.load(legacy_files[0], allow_pickle=True)
+                    sos_and_eos['quats_sos'] = legacy['quats_sos']
+                    sos_and_eos['quats_eos'] = legacy['quats_eos']
+                else:
+                    # the mean of a set of quaternions is the dominant eigenvector of the sum of their outer
+                    # products, solved for all the joints at once
+                    _, sos_eig_vectors = np.linalg.eigh(np.einsum('sji,sjk->jik', first_quats, first_quats))
+                    _, eos_eig_vectors = np.linalg.eigh(np.einsum('sji,sjk->jik', last_quats, last_quats))
+                    sos_and_eos['quats_sos'] = sos_eig_vectors[..., -1]
+                    sos_and_eos['quats_eos'] = eos_eig_vectors[..., -1]
+                # positions and affective features of the sos and eos poses of every training sample,
+                # computed with one forward kinematics call over all the samples
+                num_samples = len(keys)
+                for token, frame in zip(['sos', 'eos'], [0, 1]):
+                    root_pos = torch.from_numpy(root_positions[:, frame:frame + 1]).double()
+                    quats = torch.from_numpy(sos_and_eos['quats_' + token])[None, None].repeat(num_samples, 1, 1, 1)
+                    sos_and_eos['pos_' + token] = MocapDataset.forward_kinematics(
+                        quats, root_pos, self.joint_parents, torch.from_numpy(offsets).unsqueeze(1)).numpy()
+                    sos_and_eos['affs_' + token] = MocapDataset.get_mpi_affective_features(
+                        sos_and_eos['pos_' + token])
+                return sos_and_eos
+
+            # keyed by the values they are computed from, so that every split, frame rate and version of the data
+            # gets its own poses, and by the legacy file their rotations are migrated from
+            sos_and_eos = ArtifactCache(os.path.join(data_path, 'cache')).get(
+                'quats_sos_and_eos', build_quats_sos_and_eos, input_files=legacy_files,
+                params=dict(data=hash_arrays(np.array(keys), np.array(self.joint_parents), first_quats, last_quats,
+                                             offsets, root_positions)),
+                code=[build_quats_sos_and_eos, MocapDataset.forward_kinematics,
+                      MocapDataset.get_mpi_affective_features])
+
+            # pad the training sequences on copies of the sample dicts, leaving the given data untouched
+            train_data_padded = dict()
+            for s, k in enumerate(keys):
+                train_data_padded[k] = dict(train_data[k])
+                train_data_padded[k]['positions'] = \
+                    np.concatenate((sos_and_eos['pos_sos'][s], train_data[k]['positions'],
+                                    sos_and_eos['pos_eos'][s]), axis=0)
+                train_data_padded[k]['affective_features'] = \
+                    np.concatenate((sos_and_eos['affs_sos'][s], train_data[k]['affective_features'],
+                                    sos_and_eos['affs_eos'][s]), axis=0)
+            self.data_loader = dict(data_loader, train=train_data_padded)
+            return torch.from_numpy(sos_and_eos['quats_sos']).unsqueeze(0),\
+                torch.from_numpy(sos_and_eos['quats_eos']).unsqueeze(0)
 
         self.args = args
         self.dataset = args.dataset
@@ -129,15 +210,26 @@ class Processor(object):
             'Yrotation': 'y',
             'Zrotation': 'z'
         }
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.sync_audit = SyncAudit(self.device) if args.sync_audit else None
+        self.memory_report = MemoryReport(self.device) if args.memory_report else None
         self.data_loader = data_loader
         self.result = dict()
         self.iter_info = dict()
         self.epoch_info = dict()
         self.meta_info = dict(epoch=0, iter=0)
+        if dist.is_available() and dist.is_initialized():
+            self.rank = dist.get_rank()
+            self.world_size = dist.get_world_size()
+        else:
+            self.rank = 0
+            self.world_size = 1
+        # only the first process logs and saves checkpoints
         self.io = IO(
             self.args.work_dir,
-            save_log=self.args.save_log,
-            print_log=self.args.print_log)
+            save_log=self.args.save_log and self.rank == 0,
+            print_log=self.args.print_log and self.rank == 0)
 
         # model
         self.T = T + 2
@@ -159,6 +251,15 @@ class Processor(object):
         self.joint_parents = joint_parents
         self.lower_body_start = lower_body_start
         self.quats_sos, self.quats_eos = get_quats_sos_and_eos()
+        # the joints and the handedness categories swapped by mirror_batch
+        joints_dict = data_loader['train'][list(data_loader['train'])[0]]['joints_dict']
+        if len(joints_dict['joints_left']) != len(joints_dict['joints_right']):
+            raise ValueError('Cannot mirror a skeleton with {} left and {} right joints.'.format(
+                len(joints_dict['joints_left']), len(joints_dict['joints_right'])))
+        self.mirrored_joints = torch.tensor(get_mirror_permutation(
+            joint_names, list(zip(joints_dict['joints_left'], joints_dict['joints_right']))), device=self.device)
+        self.mirrored_handedness = torch.tensor(get_mirror_permutation(tag_cats[tag_indices['handedness']]),
+                                                device=self.device)
         # self.quats_sos = torch.from_numpy(Quaternions.id(self.V).qs).unsqueeze(0)
         # self.quats_eos = torch.from_numpy(Quaternions.from_euler(
         #     np.tile([np.pi / 2., 0, 0], (self.V, 1))).qs).unsqueeze(0)
@@ -171,14 +272,15 @@ class Processor(object):
         self.min_train_epochs = min_train_epochs
         self.zfill = fill
         try:
-            self.text_processor = torch.load('text_processor.pt')
+            # the vocabulary the pretrained models are trained with
+            self.text_processor = load_text_processor('text_processor.pt')
         except FileNotFoundError:
-            self.text_processor = tt.data.Field(tokenize=get_tokenizer("basic_english"),
-                                                init_token='<sos>',
-                                                eos_token='<eos>',
-                                                lower=True)
-            train_text, eval_text, test_text = tt.datasets.WikiText2.splits(self.text_processor)
-            self.text_processor.build_vocab(train_text, eval_text, test_text)
+            self.text_processor = ArtifactCache(os.path.join(data_path, 'cache')).get(
+                'text_processor', build_text_processor, save=torch.save,
+                load=functools.partial(torch.load, weights_only=False),
+                params=dict(tokenizer='basic_english', init_token='<sos>', eos_token='<eos>', lower=True,
+                            corpus='WikiText2', torchtext=tt.__version__),
+                code=[build_text_processor], extension='pt')
         self.text_sos = np.int64(self.text_processor.vocab.stoi['<sos>'])
         self.text_eos = np.int64(self.text_processor.vocab.stoi['<eos>'])
         num_tokens = len(self.text_processor.vocab.stoi)  # the size of vocabulary
@@ -200,13 +302,19 @@ class Processor(object):
                             self.IE, self.IP, self.AT, self.G, self.AGE, self.H, self.NT,
                             num_heads_enc, num_heads_dec, num_hidden_units_enc, num_hidden_units_dec,
                             num_layers_enc, num_layers_dec, dropout)
-        if self.args.use_multiple_gpus and torch.cuda.device_count() > 1:
+        self.model.checkpoint_activations = self.args.checkpoint_activations
+        self.model.to(self.device, self.dtype)
+        if self.world_size > 1:
+            # start all the processes from the same weights
+            for param in self.model.state_dict().values():
+                dist.broadcast(param, 0)
+        elif self.device.type == 'cuda' and self.args.use_multiple_gpus and torch.cuda.device_count() > 1:
             self.args.batch_size *= torch.cuda.device_count()
             self.model = nn.DataParallel(self.model)
-        self.model.to(torch.cuda.current_device())
-        print('Total training data:\t\t{}'.format(len(self.data_loader['train'])))
-        print('Total validation data:\t\t{}'.format(len(self.data_loader['test'])))
-        print('Training with batch size:\t{}'.format(self.args.batch_size))
+        self.io.print_log('Total training data:\t\t{}'.format(len(self.data_loader['train'])), print_time=False)
+        self.io.print_log('Total validation data:\t\t{}'.format(len(self.data_loader['test'])), print_time=False)
+        self.io.print_log('Training with batch size:\t{} x {} processes x {} accumulation steps'.format(
+            self.args.batch_size, self.world_size, self.args.accumulation_steps), print_time=False)
 
         # generate
         self.generate_while_train = generate_while_train
@@ -229,13 +337,15 @@ class Processor(object):
             raise ValueError()
         self.lr = self.args.base_lr
         self.tf = self.args.base_tr
+        self.checkpoint_writer = None
+        self.quantized_model = None
 
     def process_data(self, data, poses, quat, trans, affs):
-        data = data.float().cuda()
-        poses = poses.float().cuda()
-        quat = quat.float().cuda()
-        trans = trans.float().cuda()
-        affs = affs.float().cuda()
+        data = data.to(self.device, self.dtype)
+        poses = poses.to(self.device, self.dtype)
+        quat = quat.to(self.device, self.dtype)
+        trans = trans.to(self.device, self.dtype)
+        affs = affs.to(self.device, self.dtype)
         return data, poses, quat, trans, affs
 
     def load_model_at_epoch(self, epoch='best'):
@@ -243,7 +353,7 @@ class Processor(object):
             get_epoch_and_loss(self.args.work_dir, epoch=epoch)
         model_found = False
         try:
-            loaded_vars = torch.load(os.path.join(self.args.work_dir, model_name))
+            loaded_vars = torch.load(os.path.join(self.args.work_dir, model_name), map_location=self.device)
             self.model.load_state_dict(loaded_vars['model_dict'])
             model_found = True
         except (FileNotFoundError, IsADirectoryError):
@@ -253,6 +363,79 @@ class Processor(object):
                 print('Warning! No saved model found at epoch {:d}.'.format(epoch))
         return model_found
 
+    def get_training_state(self, resume_epoch, resume_pass=0, epoch_progress=(0., 0.)):
+        numpy_state = np.random.get_state()
+        rng_states = dict(torch=torch.get_rng_state(),
+                          numpy=(numpy_state[0], numpy_state[1].tolist()) + numpy_state[2:],
+                          python=random.getstate())
+        if torch.cuda.is_available():
+            rng_states['cuda'] = torch.cuda.get_rng_state_all()
+        return detached_copy({
+            'model_dict': self.model.state_dict(),
+            'optimizer_dict': self.optimizer.state_dict(),
+            'lr': self.lr,
+            'tf': self.tf,
+            'meta_info': dict(self.meta_info),
+            'best_loss': self.best_loss,
+            'best_loss_epoch': self.best_loss_epoch,
+            'resume_epoch': resume_epoch,
+            'resume_pass': resume_pass,
+            'epoch_progress': epoch_progress,
+            'rng_states': rng_states
+        })
+
+    def wait_for_checkpoint_writer(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.join()
+            self.checkpoint_writer = None
+
+    def save_training_state(self, file_name, resume_epoch, resume_pass=0, epoch_progress=(0., 0.)):
+        """
+        Save the full training state, i.e., the model, the optimizer, the lr and tf schedules,
+        the rng states and the best loss bookkeeping, so that training can be resumed exactly
+        from the given epoch and pass within the epoch.
+        Only the first process saves the state, since all the processes hold the same weights.
+        The state is copied to the cpu on the calling thread and written to disk on a background
+        thread, so the next training step does not wait for the disk.
+        """
+        if self.rank != 0:
+            return
+        state = self.get_training_state(resume_epoch, resume_pass, epoch_progress)
+        self.wait_for_checkpoint_writer()
+
+        def write_state():
+            # write to a temporary file first so that an interrupted write never corrupts the checkpoint
+            temp_file = os.path.join(self.args.work_dir, 'saving.tmp')
+            torch.save(state, temp_file)
+            os.replace(temp_file, os.path.join(self.args.work_dir, file_name))
+
+        self.checkpoint_writer = threading.Thread(target=write_state)
+        self.checkpoint_writer.start()
+
+    def load_training_state(self, file_name=resume_file_name):
+        try:
+            state = torch.load(os.path.join(self.args.work_dir, file_name), map_location=self.device)
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        self.model.load_state_dict(state['model_dict'])
+        if 'optimizer_dict' not in state.keys():
+            # checkpoint from an older version, containing only the model weights
+            return None
+        self.optimizer.load_state_dict(state['optimizer_dict'])
+        self.lr = state['lr']
+        self.tf = state['tf']
+        for param_group in self.optimizer.param_groups:
+            param_group['lr'] = self.lr
+        self.meta_info.update(state['meta_info'])
+        self.best_loss = state['best_loss']
+        self.best_loss_epoch = state['best_loss_epoch']
+        torch.set_rng_state(state['rng_states']['torch'])
+        np.random.set_state(state['rng_states']['numpy'])
+        random.setstate(state['rng_states']['python'])
+        if 'cuda' in state['rng_states'].keys() and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['rng_states']['cuda'])
+        return state['resume_epoch'], state['resume_pass'], state['epoch_progress']
+
     def adjust_lr(self):
         self.lr = self.lr * self.args.lr_decay
         for param_group in self.optimizer.param_groups:
@@ -289,84 +472,223 @@ class Processor(object):
             if self.args.pavi_log:
                 self.io.log('train', self.meta_info['iter'], self.iter_info)
 
+    def show_sync_audit(self):
+        if self.sync_audit.total > 0:
+            self.io.print_log('\tIter {} made {} host syncs:'.format(self.meta_info['iter'], self.sync_audit.total))
+            for k, v in self.sync_audit.counts.most_common():
+                self.io.print_log('\t\t{} x {}'.format(v, k))
+
     def count_parameters(self):
         return sum(p.numel() for p in self.model.parameters() if p.requires_grad)
 
-    def yield_batch(self, batch_size, dataset):
-        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).cuda()
-        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).cuda()
-        batch_affs = torch.zeros((batch_size, self.T, self.A)).cuda()
-        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).cuda()
-        batch_quat_sos = torch.zeros((batch_size, self.T, self.V * self.D)).cuda()
-        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).cuda()
-        batch_text = torch.zeros((batch_size, self.Z)).cuda().long()
-        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).cuda()
-        batch_perceived_emotion = torch.zeros((batch_size, self.IE)).cuda()
-        batch_perceived_polarity = torch.zeros((batch_size, self.IP)).cuda()
-        batch_acting_task = torch.zeros((batch_size, self.AT)).cuda()
-        batch_gender = torch.zeros((batch_size, self.G)).cuda()
-        batch_age = torch.zeros((batch_size, self.AGE)).cuda()
-        batch_handedness = torch.zeros((batch_size, self.H)).cuda()
-        batch_native_tongue = torch.zeros((batch_size, self.NT)).cuda()
-
-        pseudo_passes = (len(dataset) + batch_size - 1) // batch_size
+    def memory_stage(self, name):
+        if self.memory_report is None or not torch.is_grad_enabled():
+            return contextlib.nullcontext()
+        return self.memory_report.stage(name)
+
+    def show_memory_report(self):
+        for k, v in self.memory_report.saved_bytes.items():
+            info = []
+            if v > 0:
+                info.append('{:.1f} MB saved for backward'.format(v / 2 ** 20))
+            if k in self.memory_report.peak_bytes:
+                info.append('{:.1f} MB peak'.format(self.memory_report.peak_bytes[k] / 2 ** 20))
+            if len(info) > 0:
+                self.io.print_log('\t\t{}: {}'.format(k, ', '.join(info)))
+        self.memory_report.clear()
+
+    def allreduce_gradients(self):
+        """
+        Average the gradients over all the processes. The gradients are flattened into buckets of
+        at most bucket_cap_mb megabytes, and the buckets are reduced asynchronously, so that only
+        a few collective calls are issued per step.
+        The model calls the encoder and the decoder separately before every backward pass,
+        so the gradients are reduced explicitly instead of through DistributedDataParallel hooks.
+        """
+        bucket_cap_bytes = self.args.bucket_cap_mb * 1024 * 1024
+        buckets = [[]]
+        bucket_bytes = 0
+        for param in self.model.parameters():
+            if param.grad is None:
+                continue
+            if bucket_bytes >= bucket_cap_bytes:
+                buckets.append([])
+                bucket_bytes = 0
+            buckets[-1].append(param.grad)
+            bucket_bytes += param.grad.numel() * param.grad.element_size()
+        reductions = []
+        for bucket in buckets:
+            if len(bucket) == 0:
+                continue
+            flat_grads = torch.cat([grad.reshape(-1) for grad in bucket])
+            reductions.append((dist.all_reduce(flat_grads, async_op=True), flat_grads, bucket))
+        for handle, flat_grads, bucket in reductions:
+            handle.wait()
+            flat_grads /= self.world_size
+            offset = 0
+            for grad in bucket:
+                grad.copy_(flat_grads[offset:offset + grad.numel()].view_as(grad))
+                offset += grad.numel()
+
+    def allreduce_loss(self, batch_loss, N):
+        if self.world_size == 1:
+            return batch_loss, N
+        # on the device of the process, which nccl requires
+        totals = torch.tensor([batch_loss, N], dtype=torch.float64, device=self.device)
+        dist.all_reduce(totals)
+        return totals[0].item(), totals[1].item()
+
+    def get_empty_batch(self, batch_size):
+        return [torch.zeros((batch_size, self.V - 1, self.C)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.T, self.V, self.C)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.T, self.A)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.T, self.V * self.D)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.T, self.V * self.D)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.T)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.Z)).to(self.device).long(),
+                torch.zeros((batch_size, self.Z)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.IE)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.IP)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.AT)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.G)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.AGE)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.H)).to(self.device, self.dtype),
+                torch.zeros((batch_size, self.NT)).to(self.device, self.dtype)]
+
+    def fill_batch(self, batch, i, sample):
+        batch_joint_offsets, batch_pos, batch_affs, batch_quat, batch_quat_sos, \
+            batch_quat_valid_idx, batch_text, batch_text_valid_idx, \
+            batch_perceived_emotion, batch_perceived_polarity, batch_acting_task, \
+            batch_gender, batch_age, batch_handedness, batch_native_tongue = batch
+
+        joint_offsets = torch.from_numpy(sample['joints_dict']['joints_offsets_all'][1:])
+        pos = torch.from_numpy(sample['positions'])
+        affs = torch.from_numpy(sample['affective_features'])
+        quat = torch.cat((self.quats_sos,
+                          torch.from_numpy(sample['rotations']),
+                          self.quats_eos), dim=0)
+        quat_sos = self.quats_sos.repeat((self.T, 1, 1))
+        quat_length = quat.shape[0]
+        quat_valid_idx = torch.zeros(self.T)
+        quat_valid_idx[:quat_length] = 1
+        text = torch.cat((self.text_processor.numericalize(sample['Text'])[0],
+                          torch.from_numpy(np.array([self.text_eos]))))
+        if text[0] != self.text_sos:
+            text = torch.cat((torch.from_numpy(np.array([self.text_sos])), text))
+        text_length = text.shape[0]
+        text_valid_idx = torch.zeros(self.Z)
+        text_valid_idx[:text_length] = 1
+
+        batch_joint_offsets[i] = joint_offsets
+        batch_pos[i, :pos.shape[0]] = pos
+        batch_pos[i, pos.shape[0]:] = pos[-1:].clone()
+        batch_affs[i, :affs.shape[0]] = affs
+        batch_affs[i, affs.shape[0]:] = affs[-1:].clone()
+        batch_quat[i, :quat_length] = quat.view(quat_length, -1)
+        batch_quat[i, quat_length:] = quat[-1:].view(1, -1).clone()
+        batch_quat_sos[i] = quat_sos.view(self.T, -1)
+        batch_quat_valid_idx[i] = quat_valid_idx
+        batch_text[i, :text_length] = text
+        batch_text_valid_idx[i] = text_valid_idx
+        batch_perceived_emotion[i] = torch.from_numpy(sample['Perceived category'])
+        batch_perceived_polarity[i] = torch.from_numpy(sample['Perceived polarity'])
+        batch_acting_task[i] = torch.from_numpy(sample['Acting task'])
+        batch_gender[i] = torch.from_numpy(sample['Gender'])
+        batch_age[i] = torch.tensor(sample['Age'])
+        batch_handedness[i] = torch.from_numpy(sample['Handedness'])
+        batch_native_tongue[i] = torch.from_numpy(sample['Native tongue'])
+
+    def get_num_passes(self, batch_size, dataset):
+        global_batch_size = batch_size * self.world_size
+        return (len(dataset) + global_batch_size - 1) // global_batch_size
+
+    def yield_batch(self, batch_size, dataset, start_pass=0):
+        batch = self.get_empty_batch(batch_size)
+
+        # every process draws the same keys for the global batch and keeps its own share,
+        # so that the processes see disjoint samples while sharing the same random state
+        global_batch_size = batch_size * self.world_size
+        pseudo_passes = self.get_num_passes(batch_size, dataset)
 
         probs = []
         for k in dataset.keys():
             probs.append(dataset[k]['positions'].shape[0])
         probs = np.array(probs) / np.sum(probs)
 
-        for p in range(pseudo_passes):
-            rand_keys = np.random.choice(len(dataset), size=batch_size, replace=True, p=probs)
+        for p in range(start_pass, pseudo_passes):
+            rand_keys = np.random.choice(len(dataset), size=global_batch_size, replace=True, p=probs)
+            rand_keys = rand_keys[self.rank * batch_size:(self.rank + 1) * batch_size]
             for i, k in enumerate(rand_keys):
-                joint_offsets = torch.from_numpy(dataset[str(k).zfill(self.zfill)]
-                                                 ['joints_dict']['joints_offsets_all'][1:])
-                pos = torch.from_numpy(dataset[str(k).zfill(self.zfill)]['positions'])
-                affs = torch.from_numpy(dataset[str(k).zfill(self.zfill)]['affective_features'])
-                quat = torch.cat((self.quats_sos,
-                                  torch.from_numpy(dataset[str(k).zfill(self.zfill)]['rotations']),
-                                  self.quats_eos), dim=0)
-                quat_sos = self.quats_sos.repeat((self.T, 1, 1))
-                quat_length = quat.shape[0]
-                quat_valid_idx = torch.zeros(self.T)
-                quat_valid_idx[:quat_length] = 1
-                text = torch.cat((self.text_processor.numericalize(dataset[str(k).zfill(self.zfill)]['Text'])[0],
-                                  torch.from_numpy(np.array([self.text_eos]))))
-                if text[0] != self.text_sos:
-                    text = torch.cat((torch.from_numpy(np.array([self.text_sos])), text))
-                text_length = text.shape[0]
-                text_valid_idx = torch.zeros(self.Z)
-                text_valid_idx[:text_length] = 1
-
-                batch_joint_offsets[i] = joint_offsets
-                batch_pos[i, :pos.shape[0]] = pos
-                batch_pos[i, pos.shape[0]:] = pos[-1:].clone()
-                batch_affs[i, :affs.shape[0]] = affs
-                batch_affs[i, affs.shape[0]:] = affs[-1:].clone()
-                batch_quat[i, :quat_length] = quat.view(quat_length, -1)
-                batch_quat[i, quat_length:] = quat[-1:].view(1, -1).clone()
-                batch_quat_sos[i] = quat_sos.view(self.T, -1)
-                batch_quat_valid_idx[i] = quat_valid_idx
-                batch_text[i, :text_length] = text
-                batch_text_valid_idx[i] = text_valid_idx
-                batch_perceived_emotion[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Perceived category'])
-                batch_perceived_polarity[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Perceived polarity'])
-                batch_acting_task[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Acting task'])
-                batch_gender[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Gender'])
-                batch_age[i] = torch.tensor(dataset[str(k).zfill(self.zfill)]['Age'])
-                batch_handedness[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Handedness'])
-                batch_native_tongue[i] = torch.from_numpy(
-                    dataset[str(k).zfill(self.zfill)]['Native tongue'])
-
-            yield batch_joint_offsets, batch_pos, batch_affs, batch_quat, batch_quat_sos, \
-                batch_quat_valid_idx, batch_text, batch_text_valid_idx, \
-                batch_perceived_emotion, batch_perceived_polarity, batch_acting_task, \
-                batch_gender, batch_age, batch_handedness, batch_native_tongue
+                self.fill_batch(batch, i, dataset[str(k).zfill(self.zfill)])
+
+            if self.args.add_mirrored:
+                yield self.mirror_batch(tuple(batch))
+            else:
+                yield tuple(batch)
+
+    def mirror_batch(self, batch):
+        """
+        Mirror the samples of a batch of yield_batch left to right, each with probability mirror_probability,
+        on the device. The lateral (x) axis is flipped and the left and right joints are swapped in the joint
+        offsets, and in the rotations and the positions between the start and end of sequence poses. Those poses,
+        and the padding repeating the end pose, keep their rotations, so their positions are computed again on the
+        mirrored skeleton at the mirrored root. The affective features are recomputed from the mirrored positions,
+        and the left and right handedness are swapped.
+        Returns the mirrored batch, the batch is not modified.
+        """
+        joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx = batch[:6]
+        handedness = batch[13]
+        num_samples, num_frames = quat.shape[:2]
+        mirrored = (torch.rand(num_samples, device=quat.device) < self.args.mirror_probability).view(-1, 1, 1)
+        flip = pos.new_tensor([-1., 1., 1.])
+        # flipping x reflects the rotations (w, x, y, z) to (w, x, -y, -z), which keeps their continuity
+        quat_flip = quat.new_tensor([1., 1., -1., -1.])
+
+        # the offsets are those of the joints after the root, which is not swapped
+        joint_offsets = torch.where(mirrored, joint_offsets[:, self.mirrored_joints[1:] - 1] * flip, joint_offsets)
+        frames = torch.arange(num_frames, device=quat.device)
+        num_valid_frames = torch.sum(quat_valid_idx, dim=-1, keepdim=True).long()
+        rotation_frames = (frames > 0) & (frames < num_valid_frames - 1)
+        quat_mirrored = quat.view(num_samples, num_frames, self.V, self.D)[:, :, self.mirrored_joints] * quat_flip
+        quat = torch.where(mirrored & rotation_frames.unsqueeze(-1),
+                           quat_mirrored.view(num_samples, num_frames, -1), quat)
+
+        # positions of the start and end of sequence poses, with one forward kinematics call over the batch
+        token_frames = torch.cat((torch.zeros_like(num_valid_frames), num_valid_frames - 1), dim=-1).clamp(min=0)
+        token_quat = torch.gather(quat, 1, token_frames.unsqueeze(-1).expand(-1, -1, quat.shape[-1]))
+        token_root = torch.gather(pos[:, :, 0], 1, token_frames.unsqueeze(-1).expand(-1, -1, self.C)) * flip
+        token_pos = MocapDataset.forward_kinematics(
+            token_quat.view(num_samples, 2, self.V, self.D), token_root, self.joint_parents,
+            torch.cat((torch.zeros_like(joint_offsets[:, 0:1]), joint_offsets), dim=1).unsqueeze(1))
+        pos_mirrored = torch.where(rotation_frames.view(num_samples, num_frames, 1, 1),
+                                   pos[:, :, self.mirrored_joints] * flip,
+                                   torch.where((frames == 0).view(1, -1, 1, 1), token_pos[:, 0:1], token_pos[:, 1:2]))
+        pos = torch.where(mirrored.unsqueeze(-1), pos_mirrored, pos)
+        affs = torch.where(mirrored, MocapDataset.get_mpi_affective_features(pos), affs)
+        handedness = torch.where(mirrored[:, 0], handedness[:, self.mirrored_handedness], handedness)
+        return (joint_offsets, pos, affs, quat) + batch[4:13] + (handedness,) + batch[14:]
+
+    def yield_eval_batch(self, batch_size, dataset, keys=None, shard=True):
+        """
+        Visit every sample of the dataset exactly once, in chunks of at most batch_size samples sorted
+        by length so that each chunk holds sequences of similar lengths. If shard is True, the chunks are
+        dealt round-robin to the processes, otherwise this process visits all of them. Yields the indices
+        of the samples of each chunk in keys, then the batch as in yield_batch, whose size is the number
+        of samples in the chunk.
+        """
+        if keys is None:
+            keys = np.arange(len(dataset))
+        lengths = [dataset[str(k).zfill(self.zfill)]['positions'].shape[0] for k in keys]
+        order = np.argsort(lengths, kind='stable')
+        batch = self.get_empty_batch(batch_size)
+
+        chunks = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+        if shard:
+            chunks = chunks[self.rank::self.world_size]
+        for chunk in chunks:
+            for i, idx in enumerate(chunk):
+                self.fill_batch(batch, i, dataset[str(keys[idx]).zfill(self.zfill)])
+            yield chunk, tuple(b[:len(chunk)] for b in batch)
 
     def return_batch(self, batch_size, dataset, randomized=True):
         if len(batch_size) > 1:
@@ -383,166 +705,56 @@ class Processor(object):
             else:
                 rand_keys = np.arange(batch_size)
 
-        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).cuda()
-        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).cuda()
-        batch_affs = torch.zeros((batch_size, self.T, self.A)).cuda()
-        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).cuda()
-        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).cuda()
-        batch_text = torch.zeros((batch_size, self.Z)).cuda().long()
-        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).cuda()
-        batch_perceived_emotion = torch.zeros((batch_size, self.IE)).cuda()
-        batch_perceived_polarity = torch.zeros((batch_size, self.IP)).cuda()
-        batch_acting_task = torch.zeros((batch_size, self.AT)).cuda()
-        batch_gender = torch.zeros((batch_size, self.G)).cuda()
-        batch_age = torch.zeros((batch_size, self.AGE)).cuda()
-        batch_handedness = torch.zeros((batch_size, self.H)).cuda()
-        batch_native_tongue = torch.zeros((batch_size, self.NT)).cuda()
-
+        batch = self.get_empty_batch(batch_size)
         for i, k in enumerate(rand_keys):
-            joint_offsets = torch.from_numpy(dataset[str(k).zfill(self.zfill)]
-                                             ['joints_dict']['joints_offsets_all'][1:])
-            pos = torch.from_numpy(dataset[str(k).zfill(self.zfill)]['positions'])
-            affs = torch.from_numpy(dataset[str(k).zfill(self.zfill)]['affective_features'])
-            quat = torch.cat((self.quats_sos,
-                              torch.from_numpy(dataset[str(k).zfill(self.zfill)]['rotations']),
-                              self.quats_eos), dim=0)
-            quat_length = quat.shape[0]
-            quat_valid_idx = torch.zeros(self.T)
-            quat_valid_idx[:quat_length] = 1
-            text = torch.cat((self.text_processor.numericalize(dataset[str(k).zfill(self.zfill)]['Text'])[0],
-                              torch.from_numpy(np.array([self.text_eos]))))
-            if text[0] != self.text_sos:
-                text = torch.cat((torch.from_numpy(np.array([self.text_sos])), text))
-            text_length = text.shape[0]
-            text_valid_idx = torch.zeros(self.Z)
-            text_valid_idx[:text_length] = 1
-
-            batch_joint_offsets[i] = joint_offsets
-            batch_pos[i, :pos.shape[0]] = pos
-            batch_pos[i, pos.shape[0]:] = pos[-1:].clone()
-            batch_affs[i, :affs.shape[0]] = affs
-            batch_affs[i, affs.shape[0]:] = affs[-1:].clone()
-            batch_quat[i, :quat_length] = quat.view(quat_length, -1)
-            batch_quat[i, quat_length:] = quat[-1:].view(1, -1).clone()
-            batch_quat_valid_idx[i] = quat_valid_idx
-            batch_text[i, :text_length] = text
-            batch_text_valid_idx[i] = text_valid_idx
-            batch_perceived_emotion[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Perceived category'])
-            batch_perceived_polarity[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Perceived polarity'])
-            batch_acting_task[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Acting task'])
-            batch_gender[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Gender'])
-            batch_age[i] = torch.tensor(dataset[str(k).zfill(self.zfill)]['Age'])
-            batch_handedness[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Handedness'])
-            batch_native_tongue[i] = torch.from_numpy(
-                dataset[str(k).zfill(self.zfill)]['Native tongue'])
-
-        return batch_joint_offsets, batch_pos, batch_affs, batch_quat,\
-            batch_quat_valid_idx, batch_text, batch_text_valid_idx,\
-            batch_perceived_emotion, batch_perceived_polarity, batch_acting_task, \
-            batch_gender, batch_age, batch_handedness, batch_native_tongue
+            self.fill_batch(batch, i, dataset[str(k).zfill(self.zfill)])
+
+        # the start of sequence rotations are not needed here
+        return tuple(batch[:4] + batch[5:])
 
     def forward_pass(self, joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
                      text, text_valid_idx, perceived_emotion, perceived_polarity,
-                     acting_task, gender, age, handedness, native_tongue):
-        self.optimizer.zero_grad()
-        with torch.autograd.detect_anomaly():
+                     acting_task, gender, age, handedness, native_tongue, return_positions=False):
+        with torch.autograd.set_detect_anomaly(self.args.detect_anomaly):
             joint_lengths = torch.norm(joint_offsets, dim=-1)
             scales, _ = torch.max(joint_lengths, dim=-1)
-            text_latent = self.model(text, perceived_emotion, perceived_polarity,
-                                     acting_task, gender, age, handedness, native_tongue,
-                                     only_encoder=True)
-            quat_pred = torch.zeros_like(quat)
-            quat_pred_pre_norm = torch.zeros_like(quat)
-            quat_in = quat_sos[:, :self.T_steps]
-            quat_valid_idx_max = torch.max(torch.sum(quat_valid_idx, dim=-1))
-            for t in range(0, self.T, self.T_steps):
-                if t > quat_valid_idx_max:
-                    break
-                quat_pred[:, t:min(self.T, t + self.T_steps)],\
-                    quat_pred_pre_norm[:, t:min(self.T, t + self.T_steps)] =\
-                    self.model(text_latent, quat=quat_in, offset_lengths= joint_lengths / scales[..., None],
-                               only_decoder=True)
-                if torch.rand(1) > self.tf:
-                    if t + self.T_steps * 2 >= self.T:
-                        quat_in = quat_pred[:, -(self.T - t - self.T_steps):].clone()
-                    else:
-                        quat_in = quat_pred[:, t:t + self.T_steps].clone()
-                else:
+            with self.memory_stage('encoder'):
+                text_latent = self.model(text, perceived_emotion, perceived_polarity,
+                                         acting_task, gender, age, handedness, native_tongue,
+                                         only_encoder=True)
+            with self.memory_stage('decoder'):
+                quat_pred = torch.zeros_like(quat)
+                quat_pred_pre_norm = torch.zeros_like(quat)
+                quat_in = quat_sos[:, :self.T_steps]
+                # the steps past the longest sequence of the batch are zeroed on the device instead of being skipped,
+                # and the teacher forcing is chosen on the device, so that the loop never waits for the device
+                quat_valid_idx_max = torch.max(torch.sum(quat_valid_idx, dim=-1))
+                for t in range(0, self.T, self.T_steps):
+                    step_valid = (quat_valid_idx_max >= t).type(quat.dtype)
+                    quat_pred_step, quat_pred_pre_norm_step = self.model(
+                        text_latent, quat=quat_in, offset_lengths=joint_lengths / scales[..., None], only_decoder=True)
+                    quat_pred[:, t:min(self.T, t + self.T_steps)] = quat_pred_step * step_valid
+                    quat_pred_pre_norm[:, t:min(self.T, t + self.T_steps)] = quat_pred_pre_norm_step * step_valid
+                    use_pred = torch.rand(1, device=quat.device) > self.tf
                     if t + self.T_steps * 2 >= self.T:
-                        quat_in = quat[:, -(self.T - t - self.T_steps):].clone()
+                        quat_in = torch.where(use_pred, quat_pred[:, -(self.T - t - self.T_steps):],
+                                              quat[:, -(self.T - t - self.T_steps):])
                     else:
-                        quat_in = quat[:, t:min(self.T, t + self.T_steps)].clone()
+                        quat_in = torch.where(use_pred, quat_pred[:, t:t + self.T_steps],
+                                              quat[:, t:min(self.T, t + self.T_steps)])
             # quat_pred, quat_pred_pre_norm = self.model(text, intended_emotion, intended_polarity,
             #                                            acting_task, gender, age, handedness, native_tongue,
             #                                            quat_sos[:, :-1], joint_lengths / scales[..., None])
-            quat_fixed = qfix(quat.contiguous().view(quat.shape[0],
-                                                     quat.shape[1], -1,
-                                                     self.D)).contiguous().view(quat.shape[0],
-                                                                                quat.shape[1], -1)
-            quat_pred = qfix(quat_pred.contiguous().view(quat_pred.shape[0],
-                                                         quat_pred.shape[1], -1,
-                                                         self.D)).contiguous().view(quat_pred.shape[0],
-                                                                                    quat_pred.shape[1], -1)
-
-            quat_pred_pre_norm = quat_pred_pre_norm.view(quat_pred_pre_norm.shape[0],
-                                                         quat_pred_pre_norm.shape[1], -1, self.D)
-            quat_norm_loss = self.args.quat_norm_reg *\
-                torch.mean((torch.sum(quat_pred_pre_norm ** 2, dim=-1) - 1) ** 2)
-
-            quat_loss, quat_derv_loss = losses.quat_angle_loss(quat_pred, quat_fixed,
-                                                               quat_valid_idx[:, 1:],
-                                                               self.V, self.D,
-                                                               self.lower_body_start,
-                                                               self.args.upper_body_weight)
-            # quat_loss, quat_derv_loss = losses.quat_angle_loss(quat_pred, quat_fixed[:, 1:],
-            #                                                    quat_valid_idx[:, 1:],
-            #                                                    self.V, self.D,
-            #                                                    self.lower_body_start,
-            #                                                    self.args.upper_body_weight)
-            quat_loss *= self.args.quat_reg
-
-            root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).cuda()
-            pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
-                quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
-                torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
-            affs_pred = MocapDataset.get_mpi_affective_features(pos_pred)
-
-            # row_sums = quat_valid_idx.sum(1, keepdim=True) * self.D * self.V
-            # row_sums[row_sums == 0.] = 1.
-
-            shifted_pos = pos - pos[:, :, 0:1]
-            shifted_pos_pred = pos_pred - pos_pred[:, :, 0:1]
-
-            recons_loss = self.recons_loss_func(shifted_pos_pred, shifted_pos)
-            recons_arms = self.recons_loss_func(shifted_pos_pred[:, :, 7:15], shifted_pos[:, :, 7:15])
-            # recons_loss = self.recons_loss_func(shifted_pos_pred, shifted_pos[:, 1:])
-            # recons_arms = self.recons_loss_func(shifted_pos_pred[:, :, 7:15], shifted_pos[:, 1:, 7:15])
-            # recons_loss = torch.abs(shifted_pos_pred - shifted_pos[:, 1:]).sum(-1)
-            # recons_loss = self.args.upper_body_weight * (recons_loss[:, :, :self.lower_body_start].sum(-1)) +\
-            #               recons_loss[:, :, self.lower_body_start:].sum(-1)
-            # recons_loss = self.args.recons_reg *\
-            #               torch.mean((recons_loss * quat_valid_idx[:, 1:]).sum(-1) / row_sums)
-            #
-            # recons_derv_loss = torch.abs(shifted_pos_pred[:, 1:] - shifted_pos_pred[:, :-1] -
-            #                              shifted_pos[:, 2:] + shifted_pos[:, 1:-1]).sum(-1)
-            # recons_derv_loss = self.args.upper_body_weight *\
-            #     (recons_derv_loss[:, :, :self.lower_body_start].sum(-1)) +\
-            #                    recons_derv_loss[:, :, self.lower_body_start:].sum(-1)
-            # recons_derv_loss = 2. * self.args.recons_reg *\
-            #                    torch.mean((recons_derv_loss * quat_valid_idx[:, 2:]).sum(-1) / row_sums)
-            #
-            # affs_loss = torch.abs(affs[:, 1:] - affs_pred).sum(-1)
-            # affs_loss = self.args.affs_reg * torch.mean((affs_loss * quat_valid_idx[:, 1:]).sum(-1) / row_sums)
-            # affs_loss = self.affs_loss_func(affs_pred, affs[:, 1:])
-            affs_loss = self.affs_loss_func(affs_pred, affs)
-
-            total_loss = quat_norm_loss + quat_loss + recons_loss + affs_loss
-            # train_loss = quat_norm_loss + quat_loss + recons_loss + recons_derv_loss + affs_loss
+            # the forward kinematics and the losses keep several tensors of B x T x V x D values each
+            # for the backward pass, which are recomputed instead when checkpointing the activations
+            with self.memory_stage('losses'):
+                if self.args.checkpoint_activations and torch.is_grad_enabled():
+                    total_loss, shifted_pos_pred, shifted_pos = checkpoint.checkpoint(
+                        self.get_losses, joint_offsets, pos, affs, quat, quat_valid_idx, quat_pred,
+                        quat_pred_pre_norm, use_reentrant=False)
+                else:
+                    total_loss, shifted_pos_pred, shifted_pos = self.get_losses(
+                        joint_offsets, pos, affs, quat, quat_valid_idx, quat_pred, quat_pred_pre_norm)
 
             # animation_pred = {
             #     'joint_names': self.joint_names,
@@ -574,38 +786,157 @@ class Processor(object):
             #
             # display_animations(pos_pred_np, self.joint_parents,
             #                    save=True, dataset_name=self.dataset, subset_name='test', overwrite=True)
+        if return_positions:
+            return total_loss, shifted_pos_pred, shifted_pos
         return total_loss
 
-    def per_train(self):
+    def get_losses(self, joint_offsets, pos, affs, quat, quat_valid_idx, quat_pred, quat_pred_pre_norm):
+        """
+        Training loss of the predicted rotations, as computed in forward_pass.
+        Returns the loss, and the root-relative predicted and ground-truth joint positions.
+        """
+        quat_fixed = qfix(quat.contiguous().view(quat.shape[0],
+                                                 quat.shape[1], -1,
+                                                 self.D)).contiguous().view(quat.shape[0],
+                                                                            quat.shape[1], -1)
+        quat_pred = qfix(quat_pred.contiguous().view(quat_pred.shape[0],
+                                                     quat_pred.shape[1], -1,
+                                                     self.D)).contiguous().view(quat_pred.shape[0],
+                                                                                quat_pred.shape[1], -1)
+
+        quat_pred_pre_norm = quat_pred_pre_norm.view(quat_pred_pre_norm.shape[0],
+                                                     quat_pred_pre_norm.shape[1], -1, self.D)
+        quat_norm_loss = self.args.quat_norm_reg *\
+            torch.mean((torch.sum(quat_pred_pre_norm ** 2, dim=-1) - 1) ** 2)
+
+        quat_loss, quat_derv_loss = losses.quat_angle_loss(quat_pred, quat_fixed,
+                                                           quat_valid_idx[:, 1:],
+                                                           self.V, self.D,
+                                                           self.lower_body_start,
+                                                           self.args.upper_body_weight)
+        # quat_loss, quat_derv_loss = losses.quat_angle_loss(quat_pred, quat_fixed[:, 1:],
+        #                                                    quat_valid_idx[:, 1:],
+        #                                                    self.V, self.D,
+        #                                                    self.lower_body_start,
+        #                                                    self.args.upper_body_weight)
+        quat_loss *= self.args.quat_reg
+
+        root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).to(self.device, self.dtype)
+        pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
+            quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
+            torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
+        affs_pred = MocapDataset.get_mpi_affective_features(pos_pred)
+
+        # row_sums = quat_valid_idx.sum(1, keepdim=True) * self.D * self.V
+        # row_sums[row_sums == 0.] = 1.
+
+        shifted_pos = pos - pos[:, :, 0:1]
+        shifted_pos_pred = pos_pred - pos_pred[:, :, 0:1]
+
+        recons_loss = self.recons_loss_func(shifted_pos_pred, shifted_pos)
+        recons_arms = self.recons_loss_func(shifted_pos_pred[:, :, 7:15], shifted_pos[:, :, 7:15])
+        # recons_loss = self.recons_loss_func(shifted_pos_pred, shifted_pos[:, 1:])
+        # recons_arms = self.recons_loss_func(shifted_pos_pred[:, :, 7:15], shifted_pos[:, 1:, 7:15])
+        # recons_loss = torch.abs(shifted_pos_pred - shifted_pos[:, 1:]).sum(-1)
+        # recons_loss = self.args.upper_body_weight * (recons_loss[:, :, :self.lower_body_start].sum(-1)) +\
+        #               recons_loss[:, :, self.lower_body_start:].sum(-1)
+        # recons_loss = self.args.recons_reg *\
+        #               torch.mean((recons_loss * quat_valid_idx[:, 1:]).sum(-1) / row_sums)
+        #
+        # recons_derv_loss = torch.abs(shifted_pos_pred[:, 1:] - shifted_pos_pred[:, :-1] -
+        #                              shifted_pos[:, 2:] + shifted_pos[:, 1:-1]).sum(-1)
+        # recons_derv_loss = self.args.upper_body_weight *\
+        #     (recons_derv_loss[:, :, :self.lower_body_start].sum(-1)) +\
+        #                    recons_derv_loss[:, :, self.lower_body_start:].sum(-1)
+        # recons_derv_loss = 2. * self.args.recons_reg *\
+        #                    torch.mean((recons_derv_loss * quat_valid_idx[:, 2:]).sum(-1) / row_sums)
+        #
+        # affs_loss = torch.abs(affs[:, 1:] - affs_pred).sum(-1)
+        # affs_loss = self.args.affs_reg * torch.mean((affs_loss * quat_valid_idx[:, 1:]).sum(-1) / row_sums)
+        # affs_loss = self.affs_loss_func(affs_pred, affs[:, 1:])
+        affs_loss = self.affs_loss_func(affs_pred, affs)
+
+        total_loss = quat_norm_loss + quat_loss + recons_loss + affs_loss
+        # train_loss = quat_norm_loss + quat_loss + recons_loss + recons_derv_loss + affs_loss
+        return total_loss, shifted_pos_pred, shifted_pos
+
+    def get_dtw_distances(self, pos_pred, pos, quat_valid_idx):
+        """
+        Per-frame time warping distance between each predicted and ground-truth motion.
+        Arguments (where N = batch size, T = sequence length, V = number of joints):
+         -- pos_pred, pos: (N, T, V, 3) tensors of the root-relative joint positions.
+         -- quat_valid_idx: (N, T) tensor marking the valid frames of each sequence.
+        Returns an (N) tensor.
+        """
+        lengths = torch.sum(quat_valid_idx, dim=-1).long().clamp(min=1)
+        distances, _ = dtw(pos_pred.reshape(pos_pred.shape[0], pos_pred.shape[1], -1),
+                           pos.reshape(pos.shape[0], pos.shape[1], -1), lengths, lengths,
+                           band=self.args.dtw_band if self.args.dtw_band >= 0 else None,
+                           return_path=False, normalize=True)
+        return distances
+
+    def per_train(self, start_pass=0, epoch_progress=(0., 0.)):
 
         self.model.train()
         train_loader = self.data_loader['train']
-        batch_loss = 0.
-        N = 0.
-
-        for joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,\
-            text, text_valid_idx, perceived_emotion, perceived_polarity,\
-                acting_task, gender, age, handedness,\
-                native_tongue in self.yield_batch(self.args.batch_size, train_loader):
-
-            train_loss = self.forward_pass(joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
-                                           text, text_valid_idx, perceived_emotion, perceived_polarity,
-                                           acting_task, gender, age, handedness, native_tongue)
-            train_loss.backward()
-            # nn.utils.clip_grad_norm_(self.model.parameters(), self.args.gradient_clip)
-            self.optimizer.step()
-
-            # Compute statistics
-            batch_loss += train_loss.item()
-            N += quat.shape[0]
+        batch_loss, N = epoch_progress
+        # every optimizer step accumulates the gradients of accumulation_steps batches, or of the batches left at
+        # the end of the epoch, each batch loss being divided by their number so that the gradients are those of
+        # the mean loss over all their samples
+        num_passes = self.get_num_passes(self.args.batch_size, train_loader)
+        accumulation_steps = self.args.accumulation_steps
+
+        for p, (joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
+                text, text_valid_idx, perceived_emotion, perceived_polarity,
+                acting_task, gender, age, handedness,
+                native_tongue) in enumerate(self.yield_batch(self.args.batch_size, train_loader,
+                                                             start_pass=start_pass), start_pass):
+
+            step_start = p - p % accumulation_steps
+            num_accumulated = min(accumulation_steps, num_passes - step_start)
+            is_step_end = p + 1 == step_start + num_accumulated
+            with self.sync_audit if self.sync_audit is not None else contextlib.nullcontext():
+                if p == step_start:
+                    self.optimizer.zero_grad()
+                train_loss = self.forward_pass(joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
+                                               text, text_valid_idx, perceived_emotion, perceived_polarity,
+                                               acting_task, gender, age, handedness, native_tongue)
+                with self.memory_stage('backward'):
+                    (train_loss / num_accumulated).backward()
+                if is_step_end:
+                    if self.world_size > 1:
+                        self.allreduce_gradients()
+                    # nn.utils.clip_grad_norm_(self.model.parameters(), self.args.gradient_clip)
+                    with self.memory_stage('optimizer'):
+                        self.optimizer.step()
+
+                # Compute statistics, kept on the device until they are printed
+                batch_loss += train_loss.detach()
+                N += quat.shape[0]
+            if self.sync_audit is not None:
+                self.show_sync_audit()
+            if not is_step_end:
+                continue
+            if self.memory_report is not None and self.meta_info['iter'] % self.args.log_interval == 0:
+                self.io.print_log('\tIter {} memory per stage:'.format(self.meta_info['iter']))
+                self.show_memory_report()
 
             # statistics
-            self.iter_info['loss'] = train_loss.data.item()
+            if self.meta_info['iter'] % self.args.log_interval == 0:
+                self.iter_info['loss'] = train_loss.item()
             self.iter_info['lr'] = '{:.6f}'.format(self.lr)
             self.iter_info['tf'] = '{:.6f}'.format(self.tf)
             self.show_iter_info()
             self.meta_info['iter'] += 1
 
+            # the state is only saved between optimizer steps, so that no accumulated gradients are lost, with
+            # the epoch progress of all the processes, which is restored by the first process only
+            if self.args.checkpoint_interval > 0 and \
+                    (step_start // accumulation_steps + 1) % self.args.checkpoint_interval == 0:
+                self.save_training_state(resume_file_name, self.meta_info['epoch'], resume_pass=p + 1,
+                                         epoch_progress=self.allreduce_loss(float(batch_loss), N))
+
+        batch_loss, N = self.allreduce_loss(float(batch_loss), N)
         batch_loss /= N
         self.epoch_info['mean_loss'] = batch_loss
         self.show_epoch_info()
@@ -618,19 +949,29 @@ class Processor(object):
         self.model.eval()
         test_loader = self.data_loader['test']
         batch_loss = 0.
+        batch_dtw = 0.
         N = 0.
 
-        for joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx, \
-            text, text_valid_idx, perceived_emotion, perceived_polarity, \
-            acting_task, gender, age, handedness, \
-                native_tongue in self.yield_batch(self.args.batch_size, test_loader):
-            with torch.no_grad():
+        for _, (joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
+                text, text_valid_idx, perceived_emotion, perceived_polarity,
+                acting_task, gender, age, handedness,
+                native_tongue) in self.yield_eval_batch(self.args.batch_size, test_loader):
+            with torch.inference_mode():
                 eval_loss = self.forward_pass(joint_offsets, pos, affs, quat, quat_sos, quat_valid_idx,
                                               text, text_valid_idx, perceived_emotion, perceived_polarity,
-                                              acting_task, gender, age, handedness, native_tongue)
-                batch_loss += eval_loss.item()
+                                              acting_task, gender, age, handedness, native_tongue,
+                                              return_positions=self.args.eval_dtw)
+                if self.args.eval_dtw:
+                    eval_loss, pos_pred, pos_gt = eval_loss
+                    batch_dtw += torch.sum(self.get_dtw_distances(pos_pred, pos_gt, quat_valid_idx))
+                # weight the batch mean by the chunk size, the last chunk may be smaller, and keep the
+                # loss on the same scale as the training loss
+                batch_loss += eval_loss * quat.shape[0] / self.args.batch_size
                 N += quat.shape[0]
 
+        if self.args.eval_dtw:
+            batch_dtw, _ = self.allreduce_loss(float(batch_dtw), N)
+        batch_loss, N = self.allreduce_loss(float(batch_loss), N)
         batch_loss /= N
         self.epoch_info['mean_loss'] = batch_loss
         if self.epoch_info['mean_loss'] < self.best_loss and self.meta_info['epoch'] > self.min_train_epochs:
@@ -640,10 +981,21 @@ class Processor(object):
         else:
             self.loss_updated = False
         self.show_epoch_info()
+        if self.args.eval_dtw:
+            self.io.print_log('\tmean_dtw: {}.'.format(batch_dtw / N))
 
     def train(self):
 
-        if self.args.load_last_best:
+        start_pass = 0
+        epoch_progress = (0., 0.)
+        resumed_state = self.load_training_state() if self.args.load_last_best else None
+        if resumed_state is not None:
+            self.args.start_epoch, start_pass, epoch_progress = resumed_state
+            if self.rank != 0:
+                # the saved progress is the sum over all the processes, see per_train
+                epoch_progress = (0., 0.)
+            print('Resuming training from epoch {}, pass {}.'.format(self.args.start_epoch, start_pass))
+        elif self.args.load_last_best:
             model_found = self.load_model_at_epoch(epoch=self.args.start_epoch)
             if not model_found and self.args.start_epoch is not 'best':
                 print('Warning! Trying to load best known model: '.format(self.args.start_epoch), end='')
@@ -660,7 +1012,9 @@ class Processor(object):
 
             # training
             self.io.print_log('Training epoch: {}'.format(epoch))
-            self.per_train()
+            self.per_train(start_pass=start_pass, epoch_progress=epoch_progress)
+            start_pass = 0
+            epoch_progress = (0., 0.)
             self.io.print_log('Done.')
 
             # evaluation
@@ -672,94 +1026,317 @@ class Processor(object):
 
             # save model and weights
             if self.loss_updated or epoch % self.args.save_interval == 0:
-                torch.save({'model_dict': self.model.state_dict()},
-                           os.path.join(self.args.work_dir, 'epoch_{}_loss_{:.4f}_model.pth.tar'.
-                                        format(epoch, self.epoch_info['mean_loss'])))
+                self.save_training_state('epoch_{}_loss_{:.4f}_model.pth.tar'.
+                                         format(epoch, self.epoch_info['mean_loss']), epoch + 1)
 
                 if self.generate_while_train:
                     self.generate_motion(load_saved_model=False, samples_to_generate=1)
+            self.save_training_state(resume_file_name, epoch + 1)
+        self.wait_for_checkpoint_writer()
 
     def copy_prefix(self, var, prefix_length=None):
         if prefix_length is None:
             prefix_length = self.prefix_length
         return [var[s, :prefix_length].unsqueeze(0) for s in range(var.shape[0])]
 
+    def clean_up_foot_contacts(self, quat_pred, pos_pred, root_pos, joint_offsets, scales):
+        """
+        Inverse kinematics post-process of generated motions,
+        pinning the feet (the lower body end joints and their parents) wherever they are planted.
+        """
+        num_samples, num_frames = quat_pred.shape[:2]
+        feet = [j for j in range(self.lower_body_start, self.V)
+                if not MocapDataset.has_children(j, self.joint_parents)]
+        feet += [self.joint_parents[j] for j in feet]
+        contacts = get_foot_contacts(pos_pred, feet, self.args.ik_contact_threshold * scales.view(-1, 1, 1))
+        targets = get_contact_targets(pos_pred[:, :, feet], contacts)
+        ik = JacobianInverseKinematics(self.joint_parents, iterations=self.args.ik_iterations)
+        offsets = torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1)
+        quat_pred = ik(quat_pred.contiguous().view(num_samples, num_frames, -1, self.D), root_pos, offsets,
+                       {foot: targets[:, :, f] for f, foot in enumerate(feet)},
+                       {foot: contacts[:, :, f] for f, foot in enumerate(feet)})
+        pos_pred = MocapDataset.forward_kinematics(quat_pred, root_pos, self.joint_parents, offsets)
+        return quat_pred.view(num_samples, num_frames, -1), pos_pred
+
+    @staticmethod
+    def get_model_device(model):
+        # the quantized model runs on the cpu, whatever the device of the processor
+        return next(getattr(model, 'module', model).parameters()).device
+
+    def predict_rotations(self, model, batch):
+        """
+        Rotations predicted by a model for a batch of yield_eval_batch, as done in generate_motion.
+        The batch is moved to the device of the model, and the rotations are returned on the processor device.
+        """
+        device = self.get_model_device(model)
+        joint_offsets, _, _, quat, _, _, text, _, perceived_emotion, perceived_polarity,\
+            acting_task, gender, age, handedness, native_tongue = [b.to(device) for b in batch]
+        joint_lengths = torch.norm(joint_offsets, dim=-1)
+        scales, _ = torch.max(joint_lengths, dim=-1)
+        quat_pred, _ = model(text, perceived_emotion, perceived_polarity,
+                             acting_task, gender, age, handedness, native_tongue,
+                             quat[:, :-1], joint_lengths / scales[..., None])
+        return quat_pred.to(self.device)
+
+    def quantize(self, load_saved_model=True, epoch='best'):
+        """
+        Quantize a cpu copy of the model to int8, calibrating it on the training texts, then report its angular
+        error against the float model, which stays on the device, and the ground truth, and its latency.
+        The quantized model is used by generate_motion from then on, on the cpu.
+        """
+        if load_saved_model:
+            self.load_model_at_epoch(epoch=epoch)
+        model = self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+        model.eval()
+        train_loader = self.data_loader['train']
+        test_loader = self.data_loader['test']
+        calibration_keys = np.arange(min(self.args.calibration_samples, len(train_loader)))
+
+        def calibrate(quantized_model):
+            for _, batch in self.yield_eval_batch(self.args.batch_size, train_loader,
+                                                  keys=calibration_keys, shard=False):
+                self.predict_rotations(quantized_model, batch)
+
+        static_modules = ['temporal_smoothing.{}'.format(i) for i in range(len(model.temporal_smoothing))] \
+            if self.args.quantize_convs else None
+        self.quantized_model = quantize_model(model, static_modules, calibrate)
+
+        # angular errors on the valid frames of the test set, in degrees
+        error_sums = {'int8 vs fp32': 0., 'fp32 vs gt': 0., 'int8 vs gt': 0.}
+        num_frames = 0
+        with torch.inference_mode():
+            for _, batch in self.yield_eval_batch(self.args.batch_size, test_loader, shard=False):
+                quat_fp32 = self.predict_rotations(model, batch).cpu().numpy()
+                quat_int8 = self.predict_rotations(self.quantized_model, batch).cpu().numpy()
+                quat_gt = batch[3][:, 1:].cpu().numpy()
+                valid = batch[5][:, 1:].cpu().numpy() > 0
+                for name, (quat_a, quat_b) in zip(error_sums.keys(), [(quat_int8, quat_fp32),
+                                                                      (quat_fp32, quat_gt),
+                                                                      (quat_int8, quat_gt)]):
+                    errors = get_angle_errors(quat_a.reshape(quat_a.shape[:2] + (-1, self.D)),
+                                              quat_b.reshape(quat_b.shape[:2] + (-1, self.D)))
+                    error_sums[name] += np.degrees(np.sum(np.mean(errors, axis=-1)[valid]))
+                num_frames += np.sum(valid)
+        for name, error_sum in error_sums.items():
+            self.io.print_log('Mean angle error {}:\t{:.4f} deg'.format(name, error_sum / max(num_frames, 1)))
+
+        for batch_size in self.args.benchmark_batch_sizes:
+            _, batch = next(self.yield_eval_batch(batch_size, test_loader,
+                                                  keys=np.arange(batch_size) % len(test_loader), shard=False))
+            for name, benchmark_model in [('fp32', model), ('int8', self.quantized_model)]:
+                latency, _ = benchmark(lambda: self.predict_rotations(benchmark_model, batch))
+                self.io.print_log('{} batch size {}:\t{:.2f} ms, {:.1f} samples/s'.format(
+                    name, batch_size, 1000. * latency, batch_size / latency))
+
+    def export(self, export_dir, load_saved_model=True, epoch='best'):
+        """
+        Export what run_exported.py needs to generate gestures without this processor: the TorchScript graphs
+        of the model, the vocabulary table with the tag categories, and the skeleton of the first test sample.
+        """
+        if load_saved_model:
+            self.load_model_at_epoch(epoch=epoch)
+        model = self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+        file_names = export_t2gnet(model, self.quats_sos[0], export_dir)
+
+        vocabulary = {'tokens': list(self.text_processor.vocab.itos),
+                      'unk': int(self.text_processor.vocab.stoi[self.text_processor.unk_token]),
+                      'sos': int(self.text_sos),
+                      'eos': int(self.text_eos),
+                      'text_length': self.Z,
+                      'tags': {k: [str(c) for c in self.tag_cats[i]] for k, i in tag_indices.items()}}
+        joints_dict = self.data_loader['test'][list(self.data_loader['test'])[0]]['joints_dict']
+        skeleton = {'joint_names': list(self.joint_names),
+                    'joint_parents': [int(p) for p in self.joint_parents],
+                    'joint_offsets': np.asarray(joints_dict['joints_offsets_all']).tolist()}
+        for name, content in [('vocabulary', vocabulary), ('skeleton', skeleton)]:
+            file_names.append(os.path.join(export_dir, name + '.json'))
+            with open(file_names[-1], 'w') as f:
+                json.dump(content, f)
+        self.io.print_log('Exported {}.'.format(', '.join(file_names)))
+
+    def get_condition_tags(self, tags, conditions):
+        """
+        Tags of a sample under several conditions, as fed to the model.
+        Arguments:
+         -- tags: list of the (1, K_i) tags of the sample, in the order of tag_names.
+         -- conditions: list of dicts of tag names to values overriding those of the sample, the categorical tags
+            being given by category name and the age in years.
+        Returns the list of (N, K_i) tags of the N conditions.
+        """
+        condition_tags = [[] for _ in tag_names]
+        for condition in conditions:
+            unknown_names = set(condition) - set(tag_names)
+            if len(unknown_names) > 0:
+                raise ValueError('Unknown tags {}, expected some of {}.'.format(', '.join(sorted(unknown_names)),
+                                                                                ', '.join(tag_names)))
+            for i, name in enumerate(tag_names):
+                if name not in condition:
+                    condition_tags[i].append(tags[i][0])
+                elif name == 'age':
+                    condition_tags[i].append(tags[i].new_tensor([condition[name] / 100.]))
+                else:
+                    categories = [str(c) for c in self.tag_cats[tag_indices[name]]]
+                    if str(condition[name]) not in categories:
+                        raise ValueError('Unknown {} {}, expected one of {}.'.format(
+                            name, condition[name], ', '.join(categories)))
+                    condition_tags[i].append(torch.eye(len(categories))[categories.index(str(condition[name]))].
+                                             to(tags[i]))
+        return [torch.stack(t) for t in condition_tags]
+
+    def generate_fan_out(self, key, conditions, model=None):
+        """
+        Rotations predicted for one test sample under several conditions, as done in generate_motion, encoding
+        the text of the sample once, see T2GNet.fan_out.
+        Arguments:
+         -- key: index of the sample in the test set.
+         -- conditions: dict of condition names to dicts of tag values overriding those of the sample, see
+            get_condition_tags, e.g. {'happy': {'emotion': 'happy'}, 'sad': {'emotion': 'sad'}}.
+         -- model: the model to use, the quantized model if there is one and the model otherwise if None.
+        Returns a dict of the condition names to the (T - 1, V * D) predicted rotations.
+        """
+        if model is None:
+            model = self.model if self.quantized_model is None else self.quantized_model
+        model = getattr(model, 'module', model)
+        _, batch = next(self.yield_eval_batch(1, self.data_loader['test'], keys=[key], shard=False))
+        batch = [b.to(self.get_model_device(model)) for b in batch]
+        joint_offsets, quat, text = batch[0], batch[3], batch[6]
+        joint_lengths = torch.norm(joint_offsets, dim=-1)
+        scales, _ = torch.max(joint_lengths, dim=-1)
+        with torch.inference_mode():
+            quat_pred, _ = model.fan_out(text, *self.get_condition_tags(list(batch[8:]), conditions.values()),
+                                         quat[:, :-1], joint_lengths / scales[..., None])
+        return dict(zip(conditions.keys(), quat_pred.to(self.device)))
+
+    def benchmark_fan_out(self, key=0, load_saved_model=True, epoch='best'):
+        """
+        Compare generating a test sample under every intended emotion with generate_fan_out against generating
+        each emotion with its own call, reporting the largest difference of their rotations and their throughput.
+        """
+        if load_saved_model:
+            self.load_model_at_epoch(epoch=epoch)
+        self.model.eval()
+        model = self.model if self.quantized_model is None else self.quantized_model
+        conditions = {str(emotion): {'emotion': emotion} for emotion in self.tag_cats[tag_indices['emotion']]}
+
+        def generate_independently():
+            # one batch of size one per condition, as generate_motion would run them
+            _, batch = next(self.yield_eval_batch(1, self.data_loader['test'], keys=[key], shard=False))
+            quat_pred = {}
+            with torch.inference_mode():
+                for name, condition in conditions.items():
+                    tags = self.get_condition_tags(list(batch[8:]), [condition])
+                    quat_pred[name] = self.predict_rotations(model, batch[:8] + tuple(tags))[0]
+            return quat_pred
+
+        quat_fan_out = self.generate_fan_out(key, conditions, model)
+        quat_independent = generate_independently()
+        max_difference = max(torch.max(torch.abs(quat_fan_out[name] - quat_independent[name])).item()
+                             for name in conditions)
+        self.io.print_log('Fan-out of {} emotions, largest difference to independent calls:\t{:.3g}'.format(
+            len(conditions), max_difference))
+        for name, run in [('independent', generate_independently),
+                          ('fan-out', lambda: self.generate_fan_out(key, conditions, model))]:
+            latency, _ = benchmark(run)
+            self.io.print_log('{} {} emotions:\t{:.2f} ms, {:.1f} samples/s'.format(
+                name, len(conditions), 1000. * latency, len(conditions) / latency))
+
     def generate_motion(self, load_saved_model=True, samples_to_generate=10, randomized=True, epoch='best'):
 
         if load_saved_model:
             self.load_model_at_epoch(epoch=epoch)
         self.model.eval()
+        model = self.model if self.quantized_model is None else self.quantized_model
+        if self.args.encoder_cache_mb > 0:
+            # the texts repeated with the same or other tags reuse their encoder outputs,
+            # the entries on disk are only used by the same weights
+            getattr(model, 'module', model).encoder_cache = EncoderCache(
+                int(self.args.encoder_cache_mb * 2 ** 20), self.args.encoder_cache_dir,
+                namespace=hash_state_dict(getattr(model, 'module', model)))
         test_loader = self.data_loader['test']
 
+        probs = []
+        for k in test_loader.keys():
+            probs.append(test_loader[k]['positions'].shape[0])
+        probs = np.array(probs) / np.sum(probs)
+        if randomized:
+            keys = np.random.choice(len(test_loader), size=samples_to_generate, replace=False, p=probs)
+        else:
+            keys = np.arange(samples_to_generate)
+
+        # generate and save in chunks of batch size, so that the memory does not grow with the number of samples
         start_time = time.time()
-        joint_offsets, pos, affs, quat, quat_valid_idx, \
-            text, text_valid_idx, perceived_emotion, perceived_polarity, \
-            acting_task, gender, age, handedness, \
-            native_tongue = self.return_batch([samples_to_generate], test_loader, randomized=randomized)
-        with torch.no_grad():
-            joint_lengths = torch.norm(joint_offsets, dim=-1)
-            scales, _ = torch.max(joint_lengths, dim=-1)
-            quat_pred = torch.zeros_like(quat)
-            quat_pred[:, 0] = torch.cat(quat_pred.shape[0] * [self.quats_sos]).view(quat_pred[:, 0].shape)
-
-            quat_pred, quat_pred_pre_norm = self.model(text, perceived_emotion, perceived_polarity,
-                                                       acting_task, gender, age, handedness, native_tongue,
-                                                       quat[:, :-1], joint_lengths / scales[..., None])
-            # text_latent = self.model(text, intended_emotion, intended_polarity,
-            #                          acting_task, gender, age, handedness, native_tongue, only_encoder=True)
-            # for t in range(1, self.T):
-            #     quat_pred_curr, _ = self.model(text_latent, quat=quat_pred[:, 0:t],
-            #                                    offset_lengths=joint_lengths / scales[..., None],
-            #                                    only_decoder=True)
-            #     quat_pred[:, t:t + 1] = quat_pred_curr[:, -1:].clone()
-
-            # for s in range(len(quat_pred)):
-            #     quat_pred[s] = qfix(quat_pred[s].view(quat_pred[s].shape[0],
-            #                                           self.V, -1)).view(quat_pred[s].shape[0], -1)
-            quat_pred = torch.cat((quat[:, 1:2], quat_pred), dim=1)
-            quat_pred = qfix(quat_pred.view(quat_pred.shape[0], quat_pred.shape[1],
-                                            self.V, -1)).view(quat_pred.shape[0], quat_pred.shape[1], -1)
-            quat_pred = quat_pred[:, 1:]
-
-            quat_np = quat.detach().cpu().numpy()
-            quat_pred_np = quat_pred.detach().cpu().numpy()
-            root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).cuda()
-            pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
-                quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
-                torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
-
-        animation_pred = {
-            'joint_names': self.joint_names,
-            'joint_offsets': joint_offsets,
-            'joint_parents': self.joint_parents,
-            'positions': pos_pred,
-            'rotations': quat_pred,
-            'valid_idx': quat_valid_idx
-        }
-        MocapDataset.save_as_bvh(animation_pred,
-                                 dataset_name=self.dataset,
-                                 subset_name='test_epoch_{}'.format(epoch),
-                                 include_default_pose=False)
+        for chunk, batch in self.yield_eval_batch(self.args.batch_size, test_loader, keys=keys, shard=False):
+            joint_offsets, pos, _, quat, _, quat_valid_idx = batch[:6]
+            with torch.inference_mode():
+                joint_lengths = torch.norm(joint_offsets, dim=-1)
+                scales, _ = torch.max(joint_lengths, dim=-1)
+
+                quat_pred = self.predict_rotations(model, batch)
+                # text_latent = self.model(text, intended_emotion, intended_polarity,
+                #                          acting_task, gender, age, handedness, native_tongue, only_encoder=True)
+                # for t in range(1, self.T):
+                #     quat_pred_curr, _ = self.model(text_latent, quat=quat_pred[:, 0:t],
+                #                                    offset_lengths=joint_lengths / scales[..., None],
+                #                                    only_decoder=True)
+                #     quat_pred[:, t:t + 1] = quat_pred_curr[:, -1:].clone()
+
+                # for s in range(len(quat_pred)):
+                #     quat_pred[s] = qfix(quat_pred[s].view(quat_pred[s].shape[0],
+                #                                           self.V, -1)).view(quat_pred[s].shape[0], -1)
+                quat_pred = torch.cat((quat[:, 1:2], quat_pred), dim=1)
+                quat_pred = qfix(quat_pred.view(quat_pred.shape[0], quat_pred.shape[1],
+                                                self.V, -1)).view(quat_pred.shape[0], quat_pred.shape[1], -1)
+                quat_pred = quat_pred[:, 1:]
+
+                root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).to(self.device, self.dtype)
+                pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
+                    quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
+                    torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
+                if self.args.ik_post_process:
+                    quat_pred, pos_pred = self.clean_up_foot_contacts(quat_pred, pos_pred, root_pos, joint_offsets,
+                                                                      scales)
+
+            # name the outputs by the position of the samples in keys, as if they had been generated together
+            save_file_names = [str(idx).zfill(self.zfill) for idx in chunk]
+            animation_pred = {
+                'joint_names': self.joint_names,
+                'joint_offsets': joint_offsets,
+                'joint_parents': self.joint_parents,
+                'positions': pos_pred,
+                'rotations': quat_pred,
+                'valid_idx': quat_valid_idx
+            }
+            MocapDataset.save_as_bvh(animation_pred,
+                                     dataset_name=self.dataset,
+                                     subset_name='test_epoch_{}'.format(epoch),
+                                     save_file_paths=save_file_names,
+                                     include_default_pose=False)
+            shifted_pos = pos - pos[:, :, 0:1]
+            animation = {
+                'joint_names': self.joint_names,
+                'joint_offsets': joint_offsets,
+                'joint_parents': self.joint_parents,
+                'positions': shifted_pos,
+                'rotations': quat,
+                'valid_idx': quat_valid_idx
+            }
+
+            MocapDataset.save_as_bvh(animation,
+                                     dataset_name=self.dataset,
+                                     subset_name='gt',
+                                     save_file_paths=save_file_names,
+                                     include_default_pose=False)
+            pos_pred_np = pos_pred.contiguous().view(pos_pred.shape[0],
+                                                     pos_pred.shape[1], -1).permute(0, 2, 1).\
+                detach().cpu().numpy()
+            display_animations(pos_pred_np, self.joint_parents, save=True,
+                               dataset_name=self.dataset,
+                               subset_name='epoch_' + str(self.best_loss_epoch),
+                               save_file_names=save_file_names,
+                               overwrite=True)
         end_time = time.time()
         print('Time taken: {} secs.'.format(end_time - start_time))
-        shifted_pos = pos - pos[:, :, 0:1]
-        animation = {
-            'joint_names': self.joint_names,
-            'joint_offsets': joint_offsets,
-            'joint_parents': self.joint_parents,
-            'positions': shifted_pos,
-            'rotations': quat,
-            'valid_idx': quat_valid_idx
-        }
-
-        MocapDataset.save_as_bvh(animation,
-                                 dataset_name=self.dataset,
-                                 subset_name='gt',
-                                 include_default_pose=False)
-        pos_pred_np = pos_pred.contiguous().view(pos_pred.shape[0],
-                                                 pos_pred.shape[1], -1).permute(0, 2, 1).\
-            detach().cpu().numpy()
-        display_animations(pos_pred_np, self.joint_parents, save=True,
-                           dataset_name=self.dataset,
-                           subset_name='epoch_' + str(self.best_loss_epoch),
-                           overwrite=True)
+        if self.args.encoder_cache_mb > 0:
+            for level, stats in getattr(model, 'module', model).encoder_cache.stats().items():
+                print('Encoder cache {}: {} hits, {} disk hits, {} misses, {} entries, {} bytes.'.format(
+                    level, stats['hits'], stats['disk_hits'], stats['misses'], stats['entries'], stats['bytes']))
@@ -8,6 +8,7 @@ from net.T2GNet_glove import T2GNet as T2GNet
 
 from torchlight.torchlight.io import IO
 # from utils.mocap_dataset import MocapDataset
+from utils.artifact_cache import ArtifactCache, hash_arrays
 from utils.mocap_dataset import MocapDataset
 from utils.Quaternions import Quaternions
 from utils.visualizations import display_animations
@@ -58,31 +59,45 @@ class Processor(object):
     def __init__(self, args, data_path, data_loader, Z, T, A, V, C, D, tag_cats,
                  IE, IP, AT, G, AGE, H, NT, joint_names,
                  joint_parents, word2idx, embedding_table, lower_body_start=15, fill=6, min_train_epochs=20,
-                 generate_while_train=False, save_path=None, device='cuda:0'):
+                 generate_while_train=False, save_path=None, device='cuda:0', dtype=torch.float32):
 
         def get_quats_sos_and_eos():
-            quats_sos_and_eos_file = os.path.join(data_path, 'quats_sos_and_eos.npz')
             keys = list(self.data_loader['train'].keys())
             num_samples = len(self.data_loader['train'])
-            try:
-                mean_quats_sos = np.load(quats_sos_and_eos_file, allow_pickle=True)['quats_sos']
-                mean_quats_eos = np.load(quats_sos_and_eos_file, allow_pickle=True)['quats_eos']
-            except FileNotFoundError:
+            first_quats = np.stack([self.data_loader['train'][k]['rotations'][0] for k in keys])
+            last_quats = np.stack([self.data_loader['train'][k]['rotations'][-1] for k in keys])
+            # the pretrained models were trained with the rotations saved in quats_sos_and_eos.npz by the earlier
+            # versions, which are kept as long as the file was saved for the same training samples
+            legacy_files = []
+            legacy_file = os.path.join(data_path, 'quats_sos_and_eos.npz')
+            if os.path.isfile(legacy_file):
+                legacy = np.load(legacy_file, allow_pickle=True)
+                if legacy['quats_sos'].shape == (self.V, self.D) and \
+                        ('keys' not in legacy.files or list(legacy['keys']) == keys):
+                    legacy_files.append(legacy_file)
+
+            def build_mean_quats_sos_and_eos():
+                if len(legacy_files) > 0:
+                    legacy = np.load(legacy_files[0], allow_pickle=True)
+                    return dict(quats_sos=legacy['quats_sos'], quats_eos=legacy['quats_eos'])
                 mean_quats_sos = np.zeros((self.V, self.D))
                 mean_quats_eos = np.zeros((self.V, self.D))
                 for j in range(self.V):
-                    quats_sos = np.zeros((self.D, num_samples))
-                    quats_eos = np.zeros((self.D, num_samples))
-                    for s in range(num_samples):
-                        quats_sos[:, s] = self.data_loader['train'][keys[s]]['rotations'][0, j]
-                        quats_eos[:, s] = self.data_loader['train'][keys[s]]['rotations'][-1, j]
+                    quats_sos = first_quats[:, j].T
+                    quats_eos = last_quats[:, j].T
                     _, sos_eig_vectors = np.linalg.eig(np.dot(quats_sos, quats_sos.T))
                     mean_quats_sos[j] = sos_eig_vectors[:, 0]
                     _, eos_eig_vectors = np.linalg.eig(np.dot(quats_eos, quats_eos.T))
                     mean_quats_eos[j] = eos_eig_vectors[:, 0]
-                np.savez_compressed(quats_sos_and_eos_file, quats_sos=mean_quats_sos, quats_eos=mean_quats_eos)
-            mean_quats_sos = torch.from_numpy(mean_quats_sos).unsqueeze(0)
-            mean_quats_eos = torch.from_numpy(mean_quats_eos).unsqueeze(0)
+                return dict(quats_sos=mean_quats_sos, quats_eos=mean_quats_eos)
+
+            # keyed by the rotations they are computed from and the legacy file they are migrated from,
+            # see ArtifactCache
+            sos_and_eos = ArtifactCache(os.path.join(data_path, 'cache')).get(
+                'mean_quats_sos_and_eos', build_mean_quats_sos_and_eos, input_files=legacy_files,
+                params=dict(data=hash_arrays(first_quats, last_quats)), code=[build_mean_quats_sos_and_eos])
+            mean_quats_sos = torch.from_numpy(sos_and_eos['quats_sos']).unsqueeze(0)
+            mean_quats_eos = torch.from_numpy(sos_and_eos['quats_eos']).unsqueeze(0)
             for s in range(num_samples):
                 pos_sos = \
                     MocapDataset.forward_kinematics(mean_quats_sos.unsqueeze(0),
@@ -115,6 +130,7 @@ class Processor(object):
             'Zrotation': 'z'
         }
         self.device = device
+        self.dtype = dtype
         self.data_loader = data_loader
         self.result = dict()
         self.iter_info = dict()
@@ -164,10 +180,10 @@ class Processor(object):
         num_layers = 2  # the number of nn.TransformerEncoderLayer in nn.TransformerEncoder
         num_heads = 2  # the number of heads in the multiheadattention models
         dropout = 0.2  # the dropout value
-        self.model = T2GNet(num_tokens, torch.from_numpy(embedding_table).cuda(),
+        self.model = T2GNet(num_tokens, torch.from_numpy(embedding_table).to(device),
                             self.T - 1, self.Z, self.V * self.D, self.D, self.V - 1,
                             self.IE, self.IP, self.AT, self.G, self.AGE, self.H, self.NT,
-                            num_heads, num_hidden_units, num_layers, dropout).to(device)
+                            num_heads, num_hidden_units, num_layers, dropout).to(device, dtype)
 
         # generate
         self.generate_while_train = generate_while_train
@@ -192,11 +208,11 @@ class Processor(object):
         self.tf = self.args.base_tr
 
     def process_data(self, data, poses, quat, trans, affs):
-        data = data.float().to(self.device)
-        poses = poses.float().to(self.device)
-        quat = quat.float().to(self.device)
-        trans = trans.float().to(self.device)
-        affs = affs.float().to(self.device)
+        data = data.to(self.device, self.dtype)
+        poses = poses.to(self.device, self.dtype)
+        quat = quat.to(self.device, self.dtype)
+        trans = trans.to(self.device, self.dtype)
+        affs = affs.to(self.device, self.dtype)
         return data, poses, quat, trans, affs
 
     def load_best_model(self, ):
@@ -204,7 +220,7 @@ class Processor(object):
             get_best_epoch_and_loss(self.args.work_dir)
         best_model_found = False
         try:
-            loaded_vars = torch.load(os.path.join(self.args.work_dir, model_name))
+            loaded_vars = torch.load(os.path.join(self.args.work_dir, model_name), map_location=self.device)
             self.model.load_state_dict(loaded_vars['model_dict'])
             best_model_found = True
         except (FileNotFoundError, IsADirectoryError):
@@ -248,20 +264,20 @@ class Processor(object):
                 self.io.log('train', self.meta_info['iter'], self.iter_info)
 
     def yield_batch(self, batch_size, dataset):
-        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).cuda()
-        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).cuda()
-        batch_affs = torch.zeros((batch_size, self.T, self.A)).cuda()
-        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).cuda()
-        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).cuda()
-        batch_text = torch.zeros((batch_size, self.Z)).cuda().long()
-        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).cuda()
-        batch_intended_emotion = torch.zeros((batch_size, self.IE)).cuda()
-        batch_intended_polarity = torch.zeros((batch_size, self.IP)).cuda()
-        batch_acting_task = torch.zeros((batch_size, self.AT)).cuda()
-        batch_gender = torch.zeros((batch_size, self.G)).cuda()
-        batch_age = torch.zeros((batch_size, self.AGE)).cuda()
-        batch_handedness = torch.zeros((batch_size, self.H)).cuda()
-        batch_native_tongue = torch.zeros((batch_size, self.NT)).cuda()
+        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).to(self.device, self.dtype)
+        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).to(self.device, self.dtype)
+        batch_affs = torch.zeros((batch_size, self.T, self.A)).to(self.device, self.dtype)
+        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).to(self.device, self.dtype)
+        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).to(self.device, self.dtype)
+        batch_text = torch.zeros((batch_size, self.Z)).to(self.device).long()
+        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).to(self.device, self.dtype)
+        batch_intended_emotion = torch.zeros((batch_size, self.IE)).to(self.device, self.dtype)
+        batch_intended_polarity = torch.zeros((batch_size, self.IP)).to(self.device, self.dtype)
+        batch_acting_task = torch.zeros((batch_size, self.AT)).to(self.device, self.dtype)
+        batch_gender = torch.zeros((batch_size, self.G)).to(self.device, self.dtype)
+        batch_age = torch.zeros((batch_size, self.AGE)).to(self.device, self.dtype)
+        batch_handedness = torch.zeros((batch_size, self.H)).to(self.device, self.dtype)
+        batch_native_tongue = torch.zeros((batch_size, self.NT)).to(self.device, self.dtype)
 
         pseudo_passes = (len(dataset) + batch_size - 1) // batch_size
 
@@ -337,20 +353,20 @@ class Processor(object):
             else:
                 rand_keys = np.arange(batch_size)
 
-        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).cuda()
-        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).cuda()
-        batch_affs = torch.zeros((batch_size, self.T, self.A)).cuda()
-        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).cuda()
-        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).cuda()
-        batch_text = torch.zeros((batch_size, self.Z)).cuda().long()
-        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).cuda()
-        batch_intended_emotion = torch.zeros((batch_size, self.IE)).cuda()
-        batch_intended_polarity = torch.zeros((batch_size, self.IP)).cuda()
-        batch_acting_task = torch.zeros((batch_size, self.AT)).cuda()
-        batch_gender = torch.zeros((batch_size, self.G)).cuda()
-        batch_age = torch.zeros((batch_size, self.AGE)).cuda()
-        batch_handedness = torch.zeros((batch_size, self.H)).cuda()
-        batch_native_tongue = torch.zeros((batch_size, self.NT)).cuda()
+        batch_joint_offsets = torch.zeros((batch_size, self.V - 1, self.C)).to(self.device, self.dtype)
+        batch_pos = torch.zeros((batch_size, self.T, self.V, self.C)).to(self.device, self.dtype)
+        batch_affs = torch.zeros((batch_size, self.T, self.A)).to(self.device, self.dtype)
+        batch_quat = torch.zeros((batch_size, self.T, self.V * self.D)).to(self.device, self.dtype)
+        batch_quat_valid_idx = torch.zeros((batch_size, self.T)).to(self.device, self.dtype)
+        batch_text = torch.zeros((batch_size, self.Z)).to(self.device).long()
+        batch_text_valid_idx = torch.zeros((batch_size, self.Z)).to(self.device, self.dtype)
+        batch_intended_emotion = torch.zeros((batch_size, self.IE)).to(self.device, self.dtype)
+        batch_intended_polarity = torch.zeros((batch_size, self.IP)).to(self.device, self.dtype)
+        batch_acting_task = torch.zeros((batch_size, self.AT)).to(self.device, self.dtype)
+        batch_gender = torch.zeros((batch_size, self.G)).to(self.device, self.dtype)
+        batch_age = torch.zeros((batch_size, self.AGE)).to(self.device, self.dtype)
+        batch_handedness = torch.zeros((batch_size, self.H)).to(self.device, self.dtype)
+        batch_native_tongue = torch.zeros((batch_size, self.NT)).to(self.device, self.dtype)
 
         for i, k in enumerate(rand_keys):
             joint_offsets = torch.from_numpy(dataset[str(k).zfill(self.zfill)]
@@ -413,7 +429,7 @@ class Processor(object):
             text, text_valid_idx, intended_emotion, intended_polarity,\
                 acting_task, gender, age, handedness,\
                 native_tongue in self.yield_batch(self.args.batch_size, train_loader):
-            quat_prelude = self.quats_eos.view(1, -1).cuda() \
+            quat_prelude = self.quats_eos.view(1, -1).to(self.device) \
                 .repeat(self.T - 1, 1).unsqueeze(0).repeat(quat.shape[0], 1, 1).float()
             quat_prelude[:, -1] = quat[:, 0].clone()
 
@@ -437,7 +453,7 @@ class Processor(object):
                                                                    self.args.upper_body_weight)
                 quat_loss *= self.args.quat_reg
 
-                root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).cuda()
+                root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).to(self.device, self.dtype)
                 pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
                     quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
                     torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
@@ -532,7 +548,7 @@ class Processor(object):
             with torch.no_grad():
                 joint_lengths = torch.norm(joint_offsets, dim=-1)
                 scales, _ = torch.max(joint_lengths, dim=-1)
-                quat_prelude = self.quats_eos.view(1, -1).cuda() \
+                quat_prelude = self.quats_eos.view(1, -1).to(self.device) \
                     .repeat(self.T - 1, 1).unsqueeze(0).repeat(quat.shape[0], 1, 1).float()
                 quat_prelude[:, -1] = quat[:, 0].clone()
                 quat_pred, quat_pred_pre_norm = self.model(text, intended_emotion, intended_polarity,
@@ -550,7 +566,7 @@ class Processor(object):
                                                                    self.args.upper_body_weight)
                 quat_loss *= self.args.quat_reg
 
-                root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).cuda()
+                root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).to(self.device, self.dtype)
                 pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
                     quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
                     torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
@@ -643,7 +659,7 @@ class Processor(object):
         with torch.no_grad():
             joint_lengths = torch.norm(joint_offsets, dim=-1)
             scales, _ = torch.max(joint_lengths, dim=-1)
-            quat_prelude = self.quats_eos.view(1, -1).cuda() \
+            quat_prelude = self.quats_eos.view(1, -1).to(self.device) \
                 .repeat(self.T - 1, 1).unsqueeze(0).repeat(quat.shape[0], 1, 1).float()
             quat_prelude[:, -1] = quat[:, 0].clone()
             quat_pred, quat_pred_pre_norm = self.model(text, intended_emotion, intended_polarity,
@@ -653,7 +669,7 @@ class Processor(object):
                 quat_pred[s] = qfix(quat_pred[s].view(quat_pred[s].shape[0],
                                                       self.V, -1)).view(quat_pred[s].shape[0], -1)
 
-            root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).cuda()
+            root_pos = torch.zeros(quat_pred.shape[0], quat_pred.shape[1], self.C).to(self.device, self.dtype)
             pos_pred = MocapDataset.forward_kinematics(quat_pred.contiguous().view(
                 quat_pred.shape[0], quat_pred.shape[1], -1, self.D), root_pos, self.joint_parents,
                 torch.cat((root_pos[:, 0:1], joint_offsets), dim=1).unsqueeze(1))
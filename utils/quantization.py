@@ -0,0 +1,134 @@
+import copy
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, get_default_qconfig, prepare, quantize_dynamic
+
+
+class DynamicQuantizableMultiheadAttention(nn.Module):
+    """
+    Inference-only replacement of nn.MultiheadAttention with its query, key, value and output projections as
+    separate nn.Linear layers, so that they are picked up by dynamic quantization. nn.MultiheadAttention keeps
+    the input projections as raw parameters and its output projection is excluded from dynamic quantization.
+    Dropout on the attention weights is not applied, and the attention weights are never returned.
+    """
+
+    def __init__(self, attention):
+        super(DynamicQuantizableMultiheadAttention, self).__init__()
+        if not attention._qkv_same_embed_dim or attention.bias_k is not None or attention.add_zero_attn:
+            raise ValueError('Only attention layers with the same query, key and value sizes '
+                             'and without extra key and value biases can be replaced.')
+        self.embed_dim = attention.embed_dim
+        self.num_heads = attention.num_heads
+        self.batch_first = attention.batch_first
+        self._qkv_same_embed_dim = True
+        projections = []
+        weights = attention.in_proj_weight.detach().chunk(3)
+        biases = [None] * 3 if attention.in_proj_bias is None else attention.in_proj_bias.detach().chunk(3)
+        for weight, bias in zip(weights, biases):
+            projection = nn.Linear(self.embed_dim, self.embed_dim, bias=bias is not None)
+            projection.weight.data.copy_(weight)
+            if bias is not None:
+                projection.bias.data.copy_(bias)
+            projections.append(projection)
+        self.q_proj, self.k_proj, self.v_proj = projections
+        self.out_proj = nn.Linear(self.embed_dim, self.embed_dim, bias=attention.out_proj.bias is not None)
+        self.out_proj.load_state_dict(attention.out_proj.state_dict())
+
+    def forward(self, query, key, value, key_padding_mask=None, need_weights=True, attn_mask=None,
+                average_attn_weights=True, is_causal=False):
+        if self.batch_first:
+            query, key, value = (x.transpose(0, 1) for x in (query, key, value))
+        target_length, batch_size = query.shape[:2]
+        source_length = key.shape[0]
+        head_dim = self.embed_dim // self.num_heads
+
+        def split_heads(x, length):
+            return x.contiguous().view(length, batch_size * self.num_heads, head_dim).transpose(0, 1).\
+                view(batch_size, self.num_heads, length, head_dim)
+
+        q = split_heads(self.q_proj(query), target_length)
+        k = split_heads(self.k_proj(key), source_length)
+        v = split_heads(self.v_proj(value), source_length)
+
+        if attn_mask is not None and attn_mask.dtype == torch.bool:
+            attn_mask = torch.zeros_like(attn_mask, dtype=q.dtype).masked_fill(attn_mask, float('-inf'))
+        if key_padding_mask is not None:
+            if key_padding_mask.dtype == torch.bool:
+                key_padding_mask = torch.zeros_like(key_padding_mask, dtype=q.dtype).\
+                    masked_fill(key_padding_mask, float('-inf'))
+            key_padding_mask = key_padding_mask.view(batch_size, 1, 1, source_length)
+            attn_mask = key_padding_mask if attn_mask is None else attn_mask + key_padding_mask
+        # an explicit mask takes precedence over the causal hint, as in nn.MultiheadAttention
+        output = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask,
+                                                is_causal=is_causal and attn_mask is None)
+        output = output.permute(2, 0, 1, 3).reshape(target_length, batch_size, self.embed_dim)
+        output = self.out_proj(output)
+        if self.batch_first:
+            output = output.transpose(0, 1)
+        return output, None
+
+
+def replace_attention(module):
+    for name, child in module.named_children():
+        if isinstance(child, nn.MultiheadAttention):
+            setattr(module, name, DynamicQuantizableMultiheadAttention(child))
+        else:
+            replace_attention(child)
+
+
+def quantize_model(model, static_modules=None, calibrate=None, backend=None):
+    """
+    Int8 copy of a model for inference on the cpu. The linear layers, including the attention projections,
+    are quantized dynamically: their weights are stored in int8 and their inputs are quantized on the fly.
+    Arguments:
+     -- model: float model, it is not modified.
+     -- static_modules: optional list of names of submodules (e.g. 'temporal_smoothing.0') to quantize
+        statically, with activation ranges observed by running calibrate.
+     -- calibrate: function running the prepared model on the calibration data, required with static_modules.
+     -- backend: quantized engine to use, the torch default if None.
+    Returns the quantized model, in eval mode on the cpu.
+    """
+    if backend is not None:
+        torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().float().eval()
+    replace_attention(model)
+    model = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if static_modules:
+        if calibrate is None:
+            raise ValueError('Static quantization needs a calibration function.')
+        qconfig = get_default_qconfig(torch.backends.quantized.engine)
+        for name in static_modules:
+            parent_name, _, child_name = name.rpartition('.')
+            parent = model.get_submodule(parent_name)
+            # the float inputs are quantized and the outputs dequantized around each module
+            wrapped = nn.Sequential(QuantStub(), getattr(parent, child_name), DeQuantStub())
+            wrapped.qconfig = qconfig
+            setattr(parent, child_name, wrapped)
+        prepare(model, inplace=True)
+        with torch.inference_mode():
+            calibrate(model)
+        convert(model, inplace=True)
+    return model
+
+
+def benchmark(run, num_warmup=3, num_runs=20):
+    """
+    Latency of a function, in seconds per call.
+    Arguments:
+     -- run: function without arguments, e.g. a model applied to a fixed batch.
+     -- num_warmup: number of untimed calls made first.
+     -- num_runs: number of timed calls.
+    Returns the mean and the minimum latency.
+    """
+    with torch.inference_mode():
+        for _ in range(num_warmup):
+            run()
+        latencies = []
+        for _ in range(num_runs):
+            start_time = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - start_time)
+    return sum(latencies) / len(latencies), min(latencies)
@@ -6,85 +6,89 @@
 #
 
 import numpy as np
-import bisect
 import scipy.ndimage
 import torch
 
 
 # Spline all samples
 class Spline_AS:
-    def __init__(self, points, closed=True):
+    def __init__(self, points, closed=True, num_points=None):
+        """
+        points: (N, M, D) control points of N splines. num_points: (N,) number of valid points of each spline,
+        all M points by default. The points past them are padding and are never interpolated.
+        """
         assert len(points.shape) == 3
         self.closed = closed
         self.points = points.clone()
         self.tracks = {}
+        if num_points is None:
+            num_points = points.shape[1]
+        self.num_points = torch.as_tensor(num_points, dtype=torch.long, device=points.device).expand(
+            points.shape[0]).clone()
 
-        # Compute arc lengths and distance track
+        # Compute arc lengths and distance track, the padding segments have zero length
+        samples = torch.arange(points.shape[0], device=points.device).unsqueeze(-1)
         if closed:
-            points_wrapped = torch.cat((points, points[:, 0:1]), dim=1)
+            segments = points[samples, self._next_indices()] - points
+            num_segments = self.num_points
         else:
-            points_wrapped = points
-        self.segment_lengths = torch.norm(points_wrapped[:, 1:] - points_wrapped[:, :-1], dim=-1)
-        self.distances = torch.cat((torch.zeros((self.segment_lengths.shape[0], 1)).cuda().float(),
+            segments = points[:, 1:] - points[:, :-1]
+            num_segments = self.num_points - 1
+        valid = torch.arange(segments.shape[1], device=points.device) < num_segments.unsqueeze(-1)
+        self.segment_lengths = torch.where(valid, torch.norm(segments, dim=-1), torch.zeros_like(segments[..., 0]))
+        self.distances = torch.cat((torch.zeros_like(self.segment_lengths[:, :1]),
                                     torch.cumsum(self.segment_lengths, dim=1)), dim=-1)
 
         self._compute_tangents(self.points)
 
+    def _next_indices(self):
+        # index of the point following each point, wrapping around at the last valid point of each spline
+        return (torch.arange(self.points.shape[1], device=self.points.device) + 1) % self.num_points.unsqueeze(-1)
+
     def _compute_tangents(self, points):
         # Predefined tangent track estimated using finite differences
-        der1 = torch.cat((points[:, 1:] - points[:, :-1],
-                          (points[:, 0] - points[:, -1]).unsqueeze(1)), dim=1)  # 1st derivative
+        samples = torch.arange(points.shape[0], device=points.device)
+        next_indices = self._next_indices()
+        last = self.num_points - 1
+        der1 = points[samples.unsqueeze(-1), next_indices] - points  # 1st derivative
         if not self.closed:
             # Adjust endpoints
             der1[:, 0] = points[:, 1] - points[:, 0]
-            der1[:, -1] = points[:, -1] - points[:, -2]
+            der1[samples, last] = points[samples, last] - points[samples, last - 1]
         tangents = der1 / (torch.norm(der1, dim=-1)[..., None] + 1e-9)  # Re-normalize
         self.tracks['tangent'] = (tangents, 'circular')
 
         # Predefined curvature track
-        next_tangents = tangents[:, (np.arange(points.shape[1]) + 1) % points.shape[1]]
+        next_tangents = tangents[samples.unsqueeze(-1), next_indices]
         diffs = self.tensor_angle_difference(next_tangents, tangents)
         if not self.closed:
             # Adjust endpoints
             diffs[:, 0:1] = self.tensor_angle_difference(tangents[:, 1:2], tangents[:, 0:1])
-            diffs[:, -1:] = self.tensor_angle_difference(tangents[:, -1:], tangents[:, -2:-1])
+            diffs[samples, last] = self.tensor_angle_difference(tangents[samples, last].unsqueeze(1),
+                                                                tangents[samples, last - 1].unsqueeze(1))[:, 0]
         self.tracks['curvature'] = (diffs, 'linear')
 
     def interpolate(self, distance, track=None):
-        if hasattr(distance, '__len__'):
-            # Multi-point interpolation (more efficient)
-            multipoint = True
-            if not isinstance(distance, np.ndarray):
-                distance = np.array(distance)
-        else:
-            multipoint = False
-            distance = np.array([distance])
-
-        if self.closed:
-            # Wrap-around distance
-            distance = distance % self.distances[-1]
-
-        indices = self._get_indices(distance)
-        t = ((distance - self.distances[indices]) / self.segment_lengths[indices])
-        if track is None:
-            result = self._lerp(self.points[indices], self.points[(indices + 1) % self.points.shape[0]],
-                                t.reshape(-1, 1))
-        else:
-            tr = self.tracks[track]
-            if len(tr[0].shape) == 2:
-                t = t.reshape(-1, 1)
-            p0 = tr[0][indices]
-            p1 = tr[0][(indices + 1) % self.points.shape[0]]
-            if tr[1] == 'linear':
-                result = self._lerp(p0, p1, t)
-            elif tr[1] == 'circular':
-                result = self._slerp(p0, p1, t)
-            else:
-                raise ValueError
+        """
+        Interpolate the points or a track at the given distances along each spline.
+        distance is a scalar, an (M,) tensor shared by all the samples or an (N, M) tensor.
+        """
+        distance = torch.as_tensor(distance, dtype=self.distances.dtype, device=self.distances.device)
+        multipoint = distance.dim() > 0
+        distance = distance.reshape(-1, distance.shape[-1] if multipoint else 1).expand(self.points.shape[0], -1)
+        indices, t = self._get_segments(distance)
+        result = self._interpolate_segments(indices, t, track)
         if multipoint:
             return result
         else:
-            return result[0]
+            return result[:, 0]
+
+    def interpolate_tracks(self, distance, tracks):
+        """
+        Interpolate several tracks at the same (N, M) distances, looking up the segments only once.
+        """
+        indices, t = self._get_segments(distance)
+        return {track: self._interpolate_segments(indices, t, track) for track in tracks}
 
     def add_track(self, name, data, interp_mode='linear'):
         assert self.points.shape[0] == data.shape[0]
@@ -93,10 +97,10 @@ class Spline_AS:
         self.tracks[name] = (data.clone(), interp_mode)
 
     def length(self):
-        return self.distances[-1]
+        return self.distances[:, -1]
 
     def size(self):
-        return self.points.shape[0]
+        return self.points.shape[1]
 
     def is_closed(self):
         return self.closed
@@ -106,46 +110,87 @@ class Spline_AS:
 
     def re_parametrize(self, points_per_unit, smoothing_factor):
         """
-        Re-parametrize this spline to have equal-length segments.
+        Re-parametrize all the splines to have equal-length segments, with the points of Spline.re_parametrize.
+        Each spline gets its own number of points, given by num_points of the returned splines,
+        and the points and tracks past them repeat their last value.
         """
+        lengths = self.length()
         if self.closed:
             # Round to nearest integer
-            num_steps = int(np.ceil(self.length() * points_per_unit))
-            dists = np.linspace(0, self.length(), num_steps, endpoint=False)
+            num_steps = torch.ceil(lengths * points_per_unit).long()
+            step = lengths / num_steps
         else:
             # Shorten the spline a little bit
-            if self.length() < 1.:
-                dists = np.arange(0, self.length(), step=self.length() / points_per_unit)
-            else:
-                dists = np.arange(0, self.length(), step=1. / points_per_unit)
-
-        points = self.interpolate(dists)
-        points_smooth = scipy.ndimage.filters.gaussian_filter1d(points.T, points_per_unit * smoothing_factor).T
-
-        new_spline = Spline(points, closed=self.closed)
+            step = torch.where(lengths < 1., lengths / points_per_unit, torch.full_like(lengths, 1. / points_per_unit))
+            num_steps = torch.ceil(lengths / step).long()
+        steps = torch.minimum(torch.arange(int(num_steps.max()), device=lengths.device),
+                              num_steps.unsqueeze(-1) - 1)
+        dists = steps.to(lengths.dtype) * step.unsqueeze(-1)
+
+        track_names = [name for name in self.tracks.keys() if name not in ['tangent', 'curvature']]
+        new_tracks = self.interpolate_tracks(dists, [None] + track_names)
+        points = new_tracks.pop(None)
+        sigma = points_per_unit * smoothing_factor
+        points_smooth = self._gaussian_filter(points, sigma, num_steps)
+
+        new_spline = Spline_AS(points, closed=self.closed, num_points=num_steps)
         new_spline._compute_tangents(points_smooth)
-        for track_name, track_val in self.tracks.items():
-            if track_name in ['tangent', 'curvature']:
-                continue
-            new_track = self.interpolate(dists, track=track_name)
-            if track_val[1] == 'linear':
-                new_track = scipy.ndimage.filters.gaussian_filter1d(new_track.T, points_per_unit * smoothing_factor).T
-            new_spline.add_track(track_name, new_track, interp_mode=track_val[1])
+        for track_name in track_names:
+            new_track = new_tracks[track_name]
+            if self.tracks[track_name][1] == 'linear':
+                new_track = self._gaussian_filter(new_track, sigma, num_steps)
+            new_spline.add_track(track_name, new_track, interp_mode=self.tracks[track_name][1])
         return new_spline
 
-    def _get_indices(self, distance):
-        # Find spline segment via binary search
-        indices = np.empty(len(distance), dtype=int)
-        for k, dist in enumerate(distance):
-            i = bisect.bisect_right(self.distances, dist) - 1
+    def _get_segments(self, distance):
+        """
+        Segment indices and interpolation weights of (N, M) distances, found with one batched binary search.
+        """
+        if self.closed:
+            # Wrap-around distance
+            distance = distance % self.distances[:, -1:]
+        indices = torch.searchsorted(self.distances.contiguous(), distance.contiguous(), right=True) - 1
+        if not self.closed:
             # These checks apply only to the non-closed spline case
-            if not self.closed:
-                if i < 0:
-                    i = 0
-                if i == len(self.points) - 1:
-                    i = len(self.points) - 2
-            indices[k] = i
-        return indices
+            indices = torch.minimum(indices.clamp(min=0), self.num_points.unsqueeze(-1) - 2)
+        t = (distance - torch.gather(self.distances, 1, indices)) / torch.gather(self.segment_lengths, 1, indices)
+        return indices, t
+
+    def _interpolate_segments(self, indices, t, track):
+        samples = torch.arange(indices.shape[0], device=indices.device).unsqueeze(-1)
+        next_indices = (indices + 1) % self.num_points.unsqueeze(-1)
+        if track is None:
+            return self._lerp(self.points[samples, indices], self.points[samples, next_indices], t.unsqueeze(-1))
+        tr = self.tracks[track]
+        if len(tr[0].shape) == 3:
+            t = t.unsqueeze(-1)
+        p0 = tr[0][samples, indices]
+        p1 = tr[0][samples, next_indices]
+        if tr[1] == 'linear':
+            return self._lerp(p0, p1, t)
+        elif tr[1] == 'circular':
+            return self._slerp(p0, p1, t)
+        else:
+            raise ValueError
+
+    @staticmethod
+    def _gaussian_filter(data, sigma, lengths=None):
+        """
+        gaussian_filter1d along the points of (N, M, ...) tensors, with the same half-sample reflection at the ends.
+        lengths: (N,) number of valid points of each sample, whose padding gets the filtered last valid point.
+        """
+        radius = int(4 * sigma + 0.5)
+        weights = torch.exp(-0.5 * torch.arange(-radius, radius + 1, dtype=data.dtype, device=data.device) ** 2 /
+                            sigma ** 2)
+        weights = weights / weights.sum()
+        if lengths is None:
+            lengths = torch.full((data.shape[0],), data.shape[1], dtype=torch.long, device=data.device)
+        lengths = lengths.view(-1, 1, 1)
+        centers = torch.minimum(torch.arange(data.shape[1], device=data.device).view(1, -1, 1), lengths - 1)
+        indices = (centers + torch.arange(-radius, radius + 1, device=data.device)) % (2 * lengths)
+        indices = torch.where(indices >= lengths, 2 * lengths - 1 - indices, indices)
+        samples = torch.arange(data.shape[0], device=data.device).view(-1, 1, 1)
+        return torch.einsum('nlr...,r->nl...', data[samples, indices], weights)
 
     @staticmethod
     def _lerp(a, b, t):
@@ -155,25 +200,14 @@ class Spline_AS:
     @staticmethod
     def _slerp(a, b, t):
         """ Circular/spherical interpolation between two points. """
-        magnitude = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-9
-        o = np.arccos(np.clip(np.sum(a * b, axis=1) / magnitude, -1, 1))
+        magnitude = torch.norm(a, dim=-1) * torch.norm(b, dim=-1) + 1e-9
+        o = torch.acos(torch.clamp(torch.sum(a * b, dim=-1) / magnitude, -1, 1)).unsqueeze(-1)
         # Fall back to linear interpolation for very small angles
         # in order to avoid the degenerate case sin(x)/x -> 0/0
-        mask = o < 1e-3
-
-        # Linear interpolation
-        result = np.empty(a.shape, dtype=a.dtype)
-        t_ = t[mask]
-        result[mask] = (1 - t_) * a[mask] + t_ * b[mask]
-
-        # Spherical interpolation
-        mask = ~mask
-        t_ = t[mask].reshape(-1)
-        o_ = o[mask]
-        result[mask] = (np.sin((1 - t_) * o_).reshape(-1, 1) * a[mask] + np.sin(t_ * o_).reshape(-1, 1) * b[
-            mask]) / np.sin(o_).reshape(-1, 1)
-
-        return result
+        linear = o < 1e-3
+        sin_o = torch.where(linear, torch.ones_like(o), torch.sin(o))
+        spherical = (torch.sin((1 - t) * o) * a + torch.sin(t * o) * b) / sin_o
+        return torch.where(linear, (1 - t) * a + t * b, spherical)
 
     @staticmethod
     def tensor_angle_difference(y, x):
@@ -219,6 +253,126 @@ class Spline_AS:
         return spline_features, spline.get_track('phase')
 
 
+# Footstep state machine of MocapDataset.detect_footsteps for all samples, fed one frame at a time
+class Footstep_Stream:
+    epsilon = 0.1  # Hysteresis (i.e. minimum height difference before a foot switch is triggered)
+    cooldown = 3  # Minimum # of frames between steps
+
+    def __init__(self, num_samples, device='cpu'):
+        self.num_steps = 0  # number of foot speed samples consumed
+        self.left_contact = torch.zeros(num_samples, device=device, dtype=torch.bool)
+        self.accumulator = torch.zeros(num_samples, device=device, dtype=torch.float64)
+        self.next_step = torch.full((num_samples,), self.cooldown, device=device, dtype=torch.long)
+        self.last_step = torch.zeros(num_samples, device=device, dtype=torch.long)
+        self.prev_step = torch.zeros(num_samples, device=device, dtype=torch.long)
+
+    def update(self, l_speed, r_speed):
+        """
+        Consume the next (N,) left and right foot speeds and return which samples switched feet on them.
+        """
+        k = self.num_steps
+        self.num_steps += 1
+        if k == 0:
+            self.left_contact = l_speed < r_speed
+            self.accumulator = self.left_contact.double() * np.pi
+            return torch.zeros_like(self.left_contact)
+        # a switch is only checked once the cooldown since the previous one is over
+        active = self.next_step == k
+        fire = active & torch.where(self.left_contact, l_speed > r_speed + self.epsilon,
+                                    r_speed > l_speed + self.epsilon)
+        self.left_contact = self.left_contact ^ fire
+        self.accumulator = self.accumulator + fire.double() * np.pi
+        self.prev_step = torch.where(fire, self.last_step, self.prev_step)
+        self.last_step = torch.where(fire, torch.full_like(self.last_step, k), self.last_step)
+        self.next_step = torch.where(active, k + 1 + fire.long() * (self.cooldown - 1), self.next_step)
+        return fire
+
+
+# Spline features of all samples, updated as frames are appended
+class Spline_AS_Stream:
+    """
+    Tensor version of MocapDataset.compute_splines followed by Spline.extract_spline_features for the last frame
+    of every sample. Each call to append only processes the newly appended frames, so the features of a growing
+    sequence cost O(1) per frame instead of rebuilding the controls and the spline over the whole sequence.
+    """
+    lf = 4  # Left foot index
+    rf = 8  # Right foot index
+    sigma = 5  # Standard deviation of the low-pass filter on the speeds in compute_translations_and_controls
+
+    def __init__(self, positions, orientations):
+        """
+        positions: (N, T, V, 3) world positions, orientations: (N, T) or (N, T, 1) facing angles.
+        At least three frames are needed before the features are defined.
+        """
+        num_samples = positions.shape[0]
+        self.device = positions.device
+        self.radius = int(4 * self.sigma + 0.5)
+        weights = np.exp(-0.5 * np.arange(-self.radius, self.radius + 1) ** 2 / self.sigma ** 2)
+        self.weights = torch.from_numpy(weights / weights.sum()).to(self.device)
+        self.num_frames = 0
+        self.last_root = None
+        self.last_feet = None
+        self.last_orientation = None
+        # latest root speeds along the ground, enough for the low-pass filter at the last two frames
+        self.speeds = torch.zeros((num_samples, 0), device=self.device, dtype=torch.float64)
+        self.tangent = None
+        self.footsteps = Footstep_Stream(num_samples, self.device)
+        self.append(positions, orientations)
+
+    def append(self, positions, orientations):
+        positions = positions.detach().to(self.device, torch.float64)
+        orientations = orientations.detach().to(self.device, torch.float64).reshape(positions.shape[:2])
+        for t in range(positions.shape[1]):
+            root = positions[:, t, 0]
+            feet = positions[:, t, [self.lf, self.rf]]
+            if self.last_root is not None:
+                root_diff = root[:, [0, 2]] - self.last_root[:, [0, 2]]
+                self.tangent = root_diff
+                self.speeds = torch.cat((self.speeds[:, -self.radius:],
+                                         torch.norm(root_diff, dim=-1, keepdim=True)), dim=-1)
+                feet_speeds = torch.norm(feet - self.last_feet, dim=-1)
+                self.footsteps.update(feet_speeds[:, 0], feet_speeds[:, 1])
+            self.last_root = root
+            self.last_feet = feet
+            self.num_frames += 1
+        self.last_orientation = orientations[:, -1]
+
+    def _amplitudes(self):
+        # gaussian_filter1d with the default half-sample reflection, evaluated at the last two frames
+        speeds = torch.cat((self.speeds, self.speeds[:, -1:]), dim=-1)
+        length = speeds.shape[-1]
+        centers = torch.arange(length - 2, length, device=self.device).unsqueeze(-1)
+        indices = (centers + torch.arange(-self.radius, self.radius + 1, device=self.device)) % (2 * length)
+        indices = torch.where(indices >= length, 2 * length - 1 - indices, indices)
+        return (speeds[:, indices] * self.weights).sum(-1)
+
+    def get_features(self):
+        """
+        Features [curvature, amplitude, frequency, direction relative to the tangent] of the last frame,
+        as an (N, 1, 5) tensor.
+        """
+        assert self.num_frames > 2
+        footsteps = self.footsteps
+        k = footsteps.num_steps - 1
+        stepped = footsteps.last_step == k
+        # the phase is constant after the last step and the final frame extrapolates the previous slope
+        slope = torch.where(stepped, np.pi / (k - footsteps.prev_step).clamp(min=1).double(),
+                            torch.zeros_like(footsteps.accumulator))
+        phase = torch.stack((footsteps.accumulator, footsteps.accumulator + slope), dim=-1)
+        amplitudes = self._amplitudes()
+        phase_signal = torch.stack((torch.cos(phase), torch.sin(phase)), dim=-1) * amplitudes.unsqueeze(-1)
+        amplitude = torch.norm(phase_signal[:, -1], dim=-1)
+        phase_signal = phase_signal / (torch.norm(phase_signal, dim=-1, keepdim=True) + 1e-9)
+        frequency = Spline_AS.tensor_angle_difference(phase_signal[:, 1:], phase_signal[:, :1])[:, 0]
+        # the last two tangents of an open spline coincide, so the last curvature is always zero
+        curvature = torch.zeros_like(amplitude)
+        tangent = self.tangent / (torch.norm(self.tangent, dim=-1, keepdim=True) + 1e-9)
+        direction = torch.stack((torch.sin(self.last_orientation), torch.cos(self.last_orientation)), dim=-1)
+        return torch.cat((torch.stack((curvature, amplitude, frequency), dim=-1),
+                          Spline_AS.versor_angle_difference(direction.unsqueeze(1), tangent.unsqueeze(1))[:, 0]),
+                         dim=-1).unsqueeze(1)
+
+
 class Spline:
     def __init__(self, points, closed=True):
         assert len(points.shape) == 2
@@ -272,21 +426,7 @@ class Spline:
 
         indices = self._get_indices(distance)
         t = ((distance - self.distances[indices]) / self.segment_lengths[indices])
-        if track is None:
-            result = self._lerp(self.points[indices], self.points[(indices + 1) % self.points.shape[0]],
-                                t.reshape(-1, 1))
-        else:
-            tr = self.tracks[track]
-            if len(tr[0].shape) == 2:
-                t = t.reshape(-1, 1)
-            p0 = tr[0][indices]
-            p1 = tr[0][(indices + 1) % self.points.shape[0]]
-            if tr[1] == 'linear':
-                result = self._lerp(p0, p1, t)
-            elif tr[1] == 'circular':
-                result = self._slerp(p0, p1, t)
-            else:
-                raise ValueError
+        result = self._interpolate_segments(indices, t, track)
         if multipoint:
             return result
         else:
@@ -324,34 +464,53 @@ class Spline:
             else:
                 dists = np.arange(0, self.length(), step=1. / points_per_unit)
 
-        points = self.interpolate(dists)
+        # look up the segments once and interpolate the points and all the tracks with them
+        indices = self._get_indices(dists)
+        t = ((dists - self.distances[indices]) / self.segment_lengths[indices])
+        points = self._interpolate_segments(indices, t, None)
         points_smooth = scipy.ndimage.filters.gaussian_filter1d(points.T, points_per_unit * smoothing_factor).T
 
         new_spline = Spline(points, closed=self.closed)
         new_spline._compute_tangents(points_smooth)
-        for track_name, track_val in self.tracks.items():
-            if track_name in ['tangent', 'curvature']:
-                continue
-            new_track = self.interpolate(dists, track=track_name)
-            if track_val[1] == 'linear':
-                new_track = scipy.ndimage.filters.gaussian_filter1d(new_track.T, points_per_unit * smoothing_factor).T
-            new_spline.add_track(track_name, new_track, interp_mode=track_val[1])
+        track_names = [name for name in self.tracks.keys() if name not in ['tangent', 'curvature']]
+        new_tracks = {track_name: self._interpolate_segments(indices, t, track_name) for track_name in track_names}
+        # smooth all the linear tracks with a single filter call
+        linear_names = [name for name in track_names if self.tracks[name][1] == 'linear']
+        if len(linear_names) > 0:
+            linear_tracks = [new_tracks[name].reshape(len(dists), -1) for name in linear_names]
+            smoothed = scipy.ndimage.filters.gaussian_filter1d(np.concatenate(linear_tracks, axis=1),
+                                                               points_per_unit * smoothing_factor, axis=0)
+            splits = np.cumsum([track.shape[1] for track in linear_tracks])[:-1]
+            for name, track in zip(linear_names, np.split(smoothed, splits, axis=1)):
+                new_tracks[name] = track.reshape(new_tracks[name].shape)
+        for track_name in track_names:
+            new_spline.add_track(track_name, new_tracks[track_name], interp_mode=self.tracks[track_name][1])
         return new_spline
 
     def _get_indices(self, distance):
-        # Find spline segment via binary search
-        indices = np.empty(len(distance), dtype=int)
-        for k, dist in enumerate(distance):
-            i = bisect.bisect_right(self.distances, dist) - 1
-            # These checks apply only to the non-closed spline case
-            if not self.closed:
-                if i < 0:
-                    i = 0
-                if i == len(self.points) - 1:
-                    i = len(self.points) - 2
-            indices[k] = i
+        # Find spline segments via one binary search over all the distances
+        indices = np.searchsorted(self.distances, distance, side='right') - 1
+        # These checks apply only to the non-closed spline case
+        if not self.closed:
+            indices = np.clip(indices, 0, len(self.points) - 2)
         return indices
 
+    def _interpolate_segments(self, indices, t, track):
+        if track is None:
+            return self._lerp(self.points[indices], self.points[(indices + 1) % self.points.shape[0]],
+                              t.reshape(-1, 1))
+        tr = self.tracks[track]
+        if len(tr[0].shape) == 2:
+            t = t.reshape(-1, 1)
+        p0 = tr[0][indices]
+        p1 = tr[0][(indices + 1) % self.points.shape[0]]
+        if tr[1] == 'linear':
+            return self._lerp(p0, p1, t)
+        elif tr[1] == 'circular':
+            return self._slerp(p0, p1, t)
+        else:
+            raise ValueError
+
     @staticmethod
     def _lerp(a, b, t):
         """ Linear interpolation between two points. """
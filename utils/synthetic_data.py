@@ -0,0 +1,98 @@
+import numpy as np
+import os
+import torch
+
+from utils.arguments import get_parser
+from utils.mocap_dataset import MocapDataset
+from utils.Quaternions import Quaternions
+from utils.Quaternions_torch import qfix
+
+
+# the mpi skeleton, see MocapDataset.get_mpi_affective_features
+joint_names = ['Hips', 'Chest', 'Chest2', 'Chest3', 'Chest4', 'Neck', 'Head',
+               'LeftCollar', 'LeftShoulder', 'LeftElbow', 'LeftWrist',
+               'RightCollar', 'RightShoulder', 'RightElbow', 'RightWrist',
+               'LeftHip', 'LeftKnee', 'LeftAnkle', 'LeftToe',
+               'RightHip', 'RightKnee', 'RightAnkle', 'RightToe']
+joint_parents = np.array([-1, 0, 1, 2, 3, 4, 5, 4, 7, 8, 9, 4, 11, 12, 13, 0, 15, 16, 17, 0, 19, 20, 21])
+joint_offsets = np.array([[0., 0., 0.], [0., 8., 0.], [0., 8., 0.], [0., 8., 0.], [0., 8., 0.], [0., 6., 0.],
+                          [0., 8., 0.],
+                          [4., 4., 0.], [10., 0., 0.], [25., 0., 0.], [22., 0., 0.],
+                          [-4., 4., 0.], [-10., 0., 0.], [-25., 0., 0.], [-22., 0., 0.],
+                          [9., 0., 0.], [0., -42., 0.], [0., -40., 0.], [0., -7., 12.],
+                          [-9., 0., 0.], [0., -42., 0.], [0., -40., 0.], [0., -7., 12.]])
+tag_categories = [['Joy', 'Anger', 'Sadness'], ['Positive', 'Negative'],
+                  ['Joy', 'Anger', 'Sadness'], ['Positive', 'Negative'],
+                  ['Narration', 'Sentence'], ['Female', 'Male'], [], ['Right', 'Left'], ['German', 'English']]
+tag_keys = ['Intended emotion', 'Intended polarity', 'Perceived category', 'Perceived polarity',
+            'Acting task', 'Gender', 'Age', 'Handedness', 'Native tongue']
+texts = ['hello there', 'how are you today', 'this is a short sentence', 'i am so happy to see you']
+
+
+def get_data_dict(num_samples=8, min_frames=20, max_frames=40, seed=0, fill=6):
+    """
+    Random samples of smooth motion on the mpi skeleton, in the format returned by loader.load_data,
+    to run the training and generation code without the dataset.
+    Returns the data dict and the tag categories.
+    """
+    rng = np.random.RandomState(seed)
+    joints_dict = {'joints_to_model': np.arange(len(joint_parents)),
+                   'joints_parents_all': joint_parents, 'joints_parents': joint_parents,
+                   'joints_names_all': joint_names, 'joints_names': joint_names,
+                   'joints_offsets_all': joint_offsets,
+                   'joints_left': [j for j, name in enumerate(joint_names) if 'left' in name.lower()],
+                   'joints_right': [j for j, name in enumerate(joint_names) if 'right' in name.lower()]}
+    data_dict = dict()
+    for s in range(num_samples):
+        num_frames = rng.randint(min_frames, max_frames + 1)
+        angles = np.cumsum(rng.randn(num_frames, len(joint_parents), 3) * 0.02, axis=0)
+        rotations = qfix(torch.from_numpy(Quaternions.from_euler(angles).qs)).numpy()
+        root_positions = np.cumsum(rng.randn(num_frames, 3), axis=0)
+        positions = MocapDataset.forward_kinematics(torch.from_numpy(rotations)[None],
+                                                    torch.from_numpy(root_positions)[None], joint_parents,
+                                                    torch.from_numpy(joint_offsets)[None])[0].numpy()
+        sample = {'joints_dict': joints_dict, 'positions': positions, 'rotations': rotations,
+                  'affective_features': MocapDataset.get_mpi_affective_features(positions),
+                  'Text': texts[s % len(texts)], 'Age': rng.randint(20, 60) / 100.,
+                  'gesture_splits': [0, num_frames // 2, num_frames]}
+        for key, categories in zip(tag_keys, tag_categories):
+            if len(categories) > 0:
+                sample[key] = np.eye(len(categories))[rng.randint(len(categories))]
+        data_dict[str(s).zfill(fill)] = sample
+    return data_dict, tag_categories
+
+
+def get_args(work_dir, **kwargs):
+    """
+    The arguments of main.py with their default values, without logging or loading a saved model,
+    overridden by kwargs.
+    """
+    args = get_parser().parse_args([])
+    args.load_last_best = False
+    args.print_log = False
+    args.save_log = False
+    args.work_dir = work_dir
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def get_processor(args, data_path, data_dict_train, data_dict_eval, tag_categories, device='cpu'):
+    """
+    Processor of the given data, with the dimensions main.py gets from the data.
+    """
+    # imported here since the processor imports most of the project
+    from utils.processor import Processor
+
+    sample = data_dict_train[list(data_dict_train)[0]]
+    samples = list(data_dict_train.values()) + list(data_dict_eval.values())
+    os.makedirs(args.work_dir, exist_ok=True)
+    return Processor(args, data_path, dict(train=data_dict_train, test=data_dict_eval),
+                     max([len(s['Text']) for s in samples]), max([len(s['positions']) for s in samples]) + 2,
+                     sample['affective_features'].shape[-1], sample['positions'].shape[1],
+                     sample['positions'].shape[2], sample['rotations'].shape[-1], tag_categories,
+                     sample['Intended emotion'].shape[-1], sample['Intended polarity'].shape[-1],
+                     sample['Acting task'].shape[-1], sample['Gender'].shape[-1], 1,
+                     sample['Handedness'].shape[-1], sample['Native tongue'].shape[-1],
+                     sample['joints_dict']['joints_names'], sample['joints_dict']['joints_parents'],
+                     save_path=args.work_dir, device=device)
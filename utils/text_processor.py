@@ -0,0 +1,78 @@
+import collections
+import pickle
+import re
+import torch
+
+
+basic_english_patterns = [(re.compile(p), r) for p, r in [(r'\'', ' \'  '), (r'\"', ''), (r'\.', ' . '),
+                                                          (r'<br \/>', ' '), (r',', ' , '), (r'\(', ' ( '),
+                                                          (r'\)', ' ) '), (r'\!', ' ! '), (r'\?', ' ? '),
+                                                          (r'\;', ' '), (r'\:', ' '), (r'\s+', ' ')]]
+
+
+def basic_english_normalize(line):
+    # same as torchtext.data.utils._basic_english_normalize
+    line = line.lower()
+    for pattern, replacement in basic_english_patterns:
+        line = pattern.sub(replacement, line)
+    return line.split()
+
+
+class Vocab(object):
+    """
+    Vocabulary of a text processor saved with torchtext 0.8 or older, with the same itos and stoi.
+    """
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # the unknown tokens map to the unknown index, as in torchtext
+        self.stoi = collections.defaultdict(self.get_unk_index, self.stoi)
+
+    def get_unk_index(self):
+        return self.unk_index
+
+    def __len__(self):
+        return len(self.itos)
+
+
+class Field(object):
+    """
+    Text processor saved with torchtext 0.8 or older, numericalizing the texts as torchtext.data.Field does.
+    """
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def numericalize(self, arr, device=None):
+        # every item of arr is a sequence of tokens, so a string is numericalized one character at a time
+        var = torch.tensor([[self.vocab.stoi[x] for x in ex] for ex in arr], dtype=torch.int64, device=device)
+        if not self.batch_first:
+            var.t_()
+        return var.contiguous()
+
+
+class Unpickler(pickle.Unpickler):
+    classes = {('torchtext.data.field', 'Field'): Field,
+               ('torchtext.vocab', 'Vocab'): Vocab,
+               ('torchtext.data.utils', '_basic_english_normalize'): basic_english_normalize}
+
+    def find_class(self, module, name):
+        if (module, name) in self.classes:
+            return self.classes[(module, name)]
+        return super(Unpickler, self).find_class(module, name)
+
+
+class PickleModule(object):
+    Unpickler = Unpickler
+
+    @staticmethod
+    def load(file, **kwargs):
+        return Unpickler(file, **kwargs).load()
+
+
+def load_text_processor(file_name):
+    """
+    Load a text processor saved with torchtext 0.8 or older, such as text_processor.pt, without torchtext,
+    whose later versions no longer have torchtext.data.Field.
+    """
+    return torch.load(file_name, pickle_module=PickleModule, weights_only=False)
@@ -1,14 +1,17 @@
-import matplotlib.animation as animation
-import matplotlib.colors as colors
-import matplotlib.patheffects as pe
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d.axes3d as p3
 import numpy as np
 import os
 import sys
 
+from utils.lazy_import import lazy_import
 from utils.mocap_dataset import MocapDataset
 
+# matplotlib is only imported when something is plotted
+animation = lazy_import('matplotlib.animation')
+colors = lazy_import('matplotlib.colors')
+pe = lazy_import('matplotlib.patheffects')
+plt = lazy_import('matplotlib.pyplot')
+p3 = lazy_import('mpl_toolkits.mplot3d.axes3d')
+
 
 def display_animations(database, joint_parents, save=False, save_overlayed=False,
                        dataset_name=None, subset_name=None, save_file_names=None,